@@ -0,0 +1,498 @@
+"""Двухуровневый кеш: LRU в памяти процесса перед общим SQLite-файлом.
+
+L1 - OrderedDict на процесс, ограниченный суммарным размером значений
+(L1_MAX_BYTES), вытесняются давно читанные. L2 - таблица в SQLite-файле
+LOCATION, общая для всех процессов хоста (режим WAL, чтение не блокирует
+запись); её ограничивают MAX_ENTRIES и MAX_BYTES, первыми уходят записи,
+которые дольше всех не читали ни в одном процессе.
+
+Каждая запись в L2 добавляет ключ в журнал invalidations. Процесс не
+чаще SYNC_INTERVAL секунд дочитывает журнал и выбрасывает из L1 чужие
+изменения, так что устаревшее значение живёт в L1 не дольше этого
+интервала. Если журнал успели обрезать, L1 очищается целиком. Значение,
+прочитанное из L2, не попадает в L1, если ключ успели выбросить, пока
+шло чтение: иначе старое значение осталось бы в L1 после изменения.
+
+Попадания и промахи каждого уровня, как и время последнего чтения
+ключей, копятся в процессе и пишутся в L2 не чаще STATS_INTERVAL
+секунд (см. cache_stats).
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .middleware import current_metrics
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, used REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_used ON cache (used)',
+    'CREATE TABLE IF NOT EXISTS invalidations ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, pid INTEGER)',
+    'CREATE TABLE IF NOT EXISTS stats ('
+    'name TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+)
+# Сколько последних сообщений об изменениях хранить в журнале.
+LOG_SIZE = 10000
+CULL_EVERY = 100
+# Число счётчиков изменений ключей в L1 (ключи делят их по хешу).
+VERSION_SLOTS = 4096
+STAT_NAMES = ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class Tier:
+    """Общие для процесса L1 и соединения с L2 одного LOCATION.
+
+    Экземпляры бэкенда Django создаёт на каждый поток, поэтому L1
+    и счётчики живут здесь, а соединения с SQLite - свои у потока.
+    """
+
+    def __init__(self, path, max_bytes, sync_interval, stats_interval):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.stats_interval = stats_interval
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.entries = OrderedDict()
+        self.size = 0
+        # Меняются при выбрасывании ключа из L1 и при очистке L1.
+        self.versions = [0] * VERSION_SLOTS
+        self.epoch = 0
+        self.stats = Counter()
+        self.unsaved = Counter()
+        # Ключ: когда его читали в последний раз, для LRU в L2.
+        self.used = {}
+        self.last_sync = 0.0
+        self.last_flush = time.monotonic()
+        connection = self.connection()
+        connection.execute('PRAGMA journal_mode = WAL')
+        with self.transaction() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.last_seen = connection.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM invalidations'
+            ).fetchone()[0]
+
+    def connection(self):
+        """Соединение потока в режиме автокоммита, для чтения."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def count(self, name, amount=1):
+        self.stats[name] += amount
+        self.unsaved[name] += amount
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.cache_tiers[name] += amount
+
+    # L1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def _put(self, key, pickled, expires):
+        self._drop(key)
+        if len(pickled) > self.max_bytes:
+            return
+        self.entries[key] = (pickled, expires)
+        self.size += len(pickled)
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def remember(self, key, pickled, expires):
+        """Кладёт в L1 значение, только что записанное этим процессом."""
+        with self.lock:
+            self._put(key, pickled, expires)
+
+    def mark(self, key):
+        """Отметка версии ключа перед чтением из L2, см. fill."""
+        return self.epoch, self.versions[hash(key) % VERSION_SLOTS]
+
+    def fill(self, key, pickled, expires, mark):
+        """Кладёт в L1 прочитанное из L2, если ключ с тех пор не менялся."""
+        with self.lock:
+            if self.mark(key) == mark:
+                self._put(key, pickled, expires)
+
+    def recall(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def forget(self, keys):
+        with self.lock:
+            for key in keys:
+                self._drop(key)
+                self.versions[hash(key) % VERSION_SLOTS] += 1
+
+    def forget_all(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.epoch += 1
+
+    def mark_used(self, keys):
+        now = time.time()
+        for key in keys:
+            self.used[key] = now
+
+    # Синхронизация
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = now
+        connection = self.connection()
+        rows = connection.execute(
+            'SELECT id, key, pid FROM invalidations WHERE id > ? ORDER BY id',
+            (self.last_seen,)
+        ).fetchall()
+        if (self.unsaved or self.used) and (
+                force or now - self.last_flush >= self.stats_interval):
+            self.last_flush = now
+            self.flush()
+        if not rows:
+            return
+        pid = os.getpid()
+        if rows[0][0] != self.last_seen + 1 or any(
+                key is None and origin != pid for _, key, origin in rows):
+            # Пропущены сообщения или другой процесс очистил кеш.
+            self.forget_all()
+        else:
+            # Свои изменения L1 уже учёл при записи.
+            self.forget(key for _, key, origin in rows if origin != pid)
+        self.last_seen = rows[-1][0]
+
+    def flush(self):
+        """Пишет накопленные счётчики и время чтения ключей в L2."""
+        unsaved, self.unsaved = self.unsaved, Counter()
+        used, self.used = self.used, {}
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT INTO stats (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE '
+                'SET value = value + excluded.value',
+                unsaved.items()
+            )
+            connection.executemany(
+                'UPDATE cache SET used = ? WHERE key = ?',
+                [(when, key) for key, when in used.items()]
+            )
+
+    def published(self, connection, keys):
+        """Пишет ключи в журнал в транзакции изменения L2."""
+        pid = os.getpid()
+        connection.executemany(
+            'INSERT INTO invalidations (key, pid) VALUES (?, ?)',
+            [(key, pid) for key in keys]
+        )
+        last = connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+        if last % LOG_SIZE < len(keys):
+            connection.execute(
+                'DELETE FROM invalidations WHERE id <= ?', (last - LOG_SIZE,)
+            )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT вокруг блока."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def _forget_connections_in_child():
+    # Соединения SQLite нельзя использовать после fork, L1 можно.
+    for tier in _tiers.values():
+        tier.local = threading.local()
+
+
+os.register_at_fork(after_in_child=_forget_connections_in_child)
+
+
+class TieredCache(BaseCache):
+    """Бэкенд кеша: LOCATION - путь к SQLite-файлу общего уровня.
+
+    OPTIONS: MAX_ENTRIES, MAX_BYTES и CULL_FREQUENCY относятся к L2,
+    L1_MAX_BYTES - к памяти процесса, SYNC_INTERVAL - секунды между
+    чтениями журнала изменений, STATS_INTERVAL - между записями
+    счётчиков в L2. Размер записи - длина pickle значения.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        with _tiers_lock:
+            tier = _tiers.get(location)
+            if tier is None:
+                tier = _tiers[location] = Tier(
+                    location,
+                    int(options.get('L1_MAX_BYTES', 32 * 1024 * 1024)),
+                    float(options.get('SYNC_INTERVAL', 0.1)),
+                    float(options.get('STATS_INTERVAL', 1)),
+                )
+        self.tier = tier
+        max_bytes = options.get('MAX_BYTES')
+        self._max_bytes = None if max_bytes is None else int(max_bytes)
+        self._writes = 0
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expires(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    def _load(self, keys):
+        """{ключ: (pickled, expires)} для keys из L1, затем из L2."""
+        tier = self.tier
+        tier.sync()
+        found = {}
+        missing = []
+        for key in keys:
+            entry = tier.recall(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                found[key] = entry
+        tier.count('l1_hits', len(found))
+        tier.count('l1_misses', len(missing))
+        tier.mark_used(found)
+        if not missing:
+            return found
+        marks = {key: tier.mark(key) for key in missing}
+        now = time.time()
+        placeholders = ', '.join('?' * len(missing))
+        rows = tier.connection().execute(
+            f'SELECT key, value, expires FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            missing + [now]
+        ).fetchall()
+        tier.count('l2_hits', len(rows))
+        tier.count('l2_misses', len(missing) - len(rows))
+        for key, pickled, expires in rows:
+            tier.fill(key, pickled, expires, marks[key])
+            found[key] = (pickled, expires)
+        tier.mark_used(key for key, _, _ in rows)
+        return found
+
+    def _store(self, items, timeout, only_new=False):
+        """Пишет {ключ: значение} в L2 и журнал; возвращает записанные."""
+        expires = self._expires(timeout)
+        now = time.time()
+        rows = {
+            key: pickle.dumps(value, self.pickle_protocol)
+            for key, value in items.items()
+        }
+        with self.tier.transaction() as connection:
+            if only_new:
+                connection.executemany(
+                    'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                    [(key, now) for key in rows]
+                )
+                written = []
+                for key, pickled in rows.items():
+                    cursor = connection.execute(
+                        'INSERT OR IGNORE INTO cache '
+                        '(key, value, expires, used) VALUES (?, ?, ?, ?)',
+                        (key, pickled, expires, now)
+                    )
+                    if cursor.rowcount:
+                        written.append(key)
+            else:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO cache (key, value, expires, used) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(key, pickled, expires, now)
+                     for key, pickled in rows.items()]
+                )
+                written = list(rows)
+            if written:
+                self.tier.published(connection, written)
+            self._writes += len(written)
+            if self._writes >= CULL_EVERY:
+                self._writes = 0
+                self._cull(connection, now)
+        self.tier.forget(written)
+        for key in written:
+            self.tier.remember(key, rows[key], expires)
+        return written
+
+    def _cull(self, connection, now):
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        count, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache'
+        ).fetchone()
+        over_count = count > self._max_entries
+        over_size = self._max_bytes is not None and size > self._max_bytes
+        if not (over_count or over_size):
+            return
+        if self._cull_frequency == 0:
+            connection.execute('DELETE FROM cache')
+            self.tier.published(connection, [None])
+            return
+        # Освобождаем долю CULL_FREQUENCY сверх превышения, начиная
+        # с записей, которые дольше всех не читали.
+        excess_count = excess_size = 0
+        if over_count:
+            excess_count = count - self._max_entries + (
+                self._max_entries // self._cull_frequency)
+        if over_size:
+            excess_size = size - self._max_bytes + (
+                self._max_bytes // self._cull_frequency)
+        culled = []
+        freed = 0
+        for key, length in connection.execute(
+                'SELECT key, LENGTH(value) FROM cache ORDER BY used'):
+            if len(culled) >= excess_count and freed >= excess_size:
+                break
+            culled.append(key)
+            freed += length
+        connection.executemany(
+            'DELETE FROM cache WHERE key = ?', [(key,) for key in culled]
+        )
+        self.tier.published(connection, culled)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        entry = self._load([key]).get(key)
+        if entry is None:
+            return default
+        return pickle.loads(entry[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = self._load(list(keys))
+        return {
+            keys[key]: pickle.loads(pickled)
+            for key, (pickled, _) in found.items()
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store({self._key(key, version): value}, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(
+            {self._key(key, version): value for key, value in data.items()},
+            timeout
+        )
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self._store(
+            {self._key(key, version): value}, timeout, only_new=True
+        ))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self.tier.transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self._expires(timeout), key, time.time())
+            )
+            if cursor.rowcount:
+                self.tier.published(connection, [key])
+        self.tier.forget([key])
+        return bool(cursor.rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self.tier.transaction() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)', (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            pickled = pickle.dumps(value, self.pickle_protocol)
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?', (pickled, key)
+            )
+            self.tier.published(connection, [key])
+        self.tier.forget([key])
+        self.tier.remember(key, pickled, row[1])
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return key in self._load([key])
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self.tier.transaction() as connection:
+            connection.executemany(
+                'DELETE FROM cache WHERE key = ?', [(key,) for key in keys]
+            )
+            self.tier.published(connection, keys)
+        self.tier.forget(keys)
+
+    def clear(self):
+        with self.tier.transaction() as connection:
+            connection.execute('DELETE FROM cache')
+            self.tier.published(connection, [None])
+        self.tier.forget_all()
+
+    def stats(self):
+        """Счётчики уровней: этого процесса и всех процессов вместе."""
+        self.tier.sync(force=True)
+        connection = self.tier.connection()
+        shared = dict(connection.execute('SELECT name, value FROM stats'))
+        entries, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache'
+        ).fetchone()
+        return {
+            'process': {name: self.tier.stats[name] for name in STAT_NAMES},
+            'shared': {name: shared.get(name, 0) for name in STAT_NAMES},
+            'l1_entries': len(self.tier.entries),
+            'l1_bytes': self.tier.size,
+            'l2_entries': entries,
+            'l2_bytes': size,
+        }
+
+    def reset_stats(self):
+        with self.tier.transaction() as connection:
+            connection.execute('DELETE FROM stats')
+        self.tier.stats.clear()
+        self.tier.unsaved.clear()
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Попадания и промахи уровней L1 и L2 кеша core.cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', help='Обнулить счётчики.'
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(cache, 'stats'):
+            raise CommandError(
+                f'Кеш {type(cache).__name__} не ведёт счётчиков уровней.'
+            )
+        stats = cache.stats()
+        shared = stats['shared']
+        for level in ('l1', 'l2'):
+            hits = shared[f'{level}_hits']
+            misses = shared[f'{level}_misses']
+            total = hits + misses
+            ratio = round(hits / total, 3) if total else '-'
+            self.stdout.write(
+                f'{level}: hit {hits:>8} miss {misses:>8} доля hit {ratio}'
+            )
+        self.stdout.write(
+            f'записей: L1 {stats["l1_entries"]} '
+            f'({stats["l1_bytes"]} байт, этот процесс), '
+            f'L2 {stats["l2_entries"]} ({stats["l2_bytes"]} байт)'
+        )
+        if options['reset']:
+            cache.reset_stats()
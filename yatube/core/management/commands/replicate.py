@@ -0,0 +1,78 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import replication
+
+
+class Command(BaseCommand):
+    help = (
+        'Догоняет реплики из DATABASE_REPLICAS по журналу записей '
+        'основной базы. --init сначала копирует в реплику всю базу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help='Реплики, по умолчанию все из DATABASE_REPLICAS.',
+        )
+        parser.add_argument(
+            '--init', action='store_true',
+            help='Скопировать базу в реплику и начать журнал с этого места.',
+        )
+        parser.add_argument(
+            '--follow', action='store_true',
+            help='Не завершаться, проигрывать новые записи каждые '
+                 '--interval секунд.',
+        )
+        parser.add_argument('--interval', type=float, default=0.5)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Удалить записи журнала, проигранные на всех репликах.',
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError(
+                'Реплики не настроены: задайте YATUBE_REPLICAS.'
+            )
+        unknown = set(aliases) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(f'Это не реплики: {", ".join(sorted(unknown))}')
+        connections['default'].ensure_connection()
+        primary = connections['default'].connection
+        replicas = {
+            alias: sqlite3.connect(settings.DATABASES[alias]['NAME'])
+            for alias in aliases
+        }
+        if options['init']:
+            for alias, replica in replicas.items():
+                last_id = replication.snapshot(primary, replica)
+                self.stdout.write(f'{alias}: копия на позиции {last_id}')
+        while True:
+            self.replay(primary, replicas, options)
+            if options['prune']:
+                pruned = replication.prune(primary, replicas.values())
+                self.stdout.write(f'Удалено из журнала: {pruned}')
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
+
+    def replay(self, primary, replicas, options):
+        for alias, replica in replicas.items():
+            try:
+                applied = replication.replay(
+                    primary, replica, options['batch_size']
+                )
+            except ValueError as error:
+                raise CommandError(f'{alias}: {error}')
+            if applied or not options['follow']:
+                self.stdout.write(
+                    f'{alias}: проиграно {applied}, позиция '
+                    f'{replication.position(replica)}'
+                )
@@ -0,0 +1,241 @@
+"""Метрики запроса: SQL, кеш и шаблоны.
+
+RequestMetricsMiddleware для доли запросов settings.REQUEST_METRICS_SAMPLE_RATE
+считает запросы к базе и их время, повторяющиеся запросы (признак N+1),
+попадания и промахи кеша и время отрисовки шаблонов. Итог попадает
+в заголовок Server-Timing и строку лога core.metrics, а превышение
+settings.REQUEST_METRICS_BUDGETS пишется предупреждением.
+
+Сборщик метрик хранится в contextvars: вложенные блоки collect_metrics
+и параллельные запросы не мешают друг другу. Кеши оборачиваются только
+внутри блока и потом получают прежние методы, а время шаблонов считает
+движок TimedDjangoTemplates (settings.TEMPLATES) без подмены классов.
+
+При нулевой доле middleware отключается при загрузке и ничего не стоит.
+"""
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import (DjangoTemplates, Template,
+                                             reraise)
+
+logger = logging.getLogger('core.metrics')
+
+_metrics = ContextVar('request_metrics', default=None)
+_MISSING = object()
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+CACHE_WRITES = ('set', 'set_many', 'add', 'delete', 'delete_many', 'incr')
+
+
+def current_metrics():
+    """Метрики запроса, обрабатываемого в этом контексте, или None."""
+    return _metrics.get()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []
+        self.signatures = Counter()
+        self.cache_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        # Попадания и промахи по уровням core.cache.TieredCache.
+        self.cache_tiers = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.signatures.values())
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements.append(sql)
+            self.signatures[IN_LIST.sub('IN (...)', sql)] += 1
+
+    def summary(self, total):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'duplicates': self.duplicates,
+            'cache_calls': self.cache_calls,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_ms': round(self.cache_time * 1000, 2),
+            'cache_tiers': dict(self.cache_tiers),
+            'templates_ms': round(self.template_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+
+
+def _counted(method, metrics):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.cache_time += time.perf_counter() - start
+            metrics.cache_calls += 1
+    return wrapper
+
+
+def _timed_get(cache, metrics):
+    original = cache.get
+
+    def get(key, default=None, version=None):
+        value = original(key, _MISSING, version=version)
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+    return _counted(get, metrics)
+
+
+def _timed_get_many(cache, metrics):
+    original = cache.get_many
+
+    def get_many(keys, version=None):
+        keys = list(keys)
+        values = original(keys, version=version)
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+    return _counted(get_many, metrics)
+
+
+@contextmanager
+def collect_metrics():
+    """Считает запросы к базам и обращения к кешам внутри блока."""
+    metrics = RequestMetrics()
+    saved = []
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        # Обёртки внешнего блока, если он есть, вернутся на место.
+        saved.append((cache, {
+            name: cache.__dict__.get(name, _MISSING)
+            for name in ('get', 'get_many') + CACHE_WRITES
+        }))
+        cache.get = _timed_get(cache, metrics)
+        cache.get_many = _timed_get_many(cache, metrics)
+        for name in CACHE_WRITES:
+            setattr(cache, name, _counted(getattr(cache, name), metrics))
+    token = _metrics.set(metrics)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(metrics.record_query)
+                )
+            yield metrics
+    finally:
+        _metrics.reset(token)
+        for cache, methods in saved:
+            for name, method in methods.items():
+                if method is _MISSING:
+                    delattr(cache, name)
+                else:
+                    setattr(cache, name, method)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(context, request)
+        # Вложенные шаблоны уже учтены во внешнем.
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Движок Django, шаблоны которого пишут время в метрики запроса."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        if not self.rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.rate:
+            return self.get_response(request)
+        start = time.perf_counter()
+        with collect_metrics() as metrics:
+            response = self.get_response(request)
+        summary = metrics.summary(time.perf_counter() - start)
+        response['Server-Timing'] = self.server_timing(summary)
+        self.report(request, response, metrics, summary)
+        return response
+
+    def server_timing(self, summary):
+        return ', '.join((
+            f'db;dur={summary["db_ms"]};desc="{summary["queries"]} queries '
+            f'{summary["duplicates"]} duplicates"',
+            f'cache;dur={summary["cache_ms"]};desc="{summary["cache_hits"]} '
+            f'hits {summary["cache_misses"]} misses"',
+            f'tpl;dur={summary["templates_ms"]}',
+            f'total;dur={summary["total_ms"]}',
+        ))
+
+    def report(self, request, response, metrics, summary):
+        line = dict(
+            summary,
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+        )
+        logger.info(json.dumps(line), extra={'metrics': line})
+        exceeded = {
+            name: summary[name]
+            for name, budget in settings.REQUEST_METRICS_BUDGETS.items()
+            if summary.get(name, 0) > budget
+        }
+        if exceeded:
+            repeated = [
+                sql for sql, count in metrics.signatures.most_common(3)
+                if count > 1
+            ]
+            logger.warning(
+                'Запрос %s %s вышел за бюджет: %s; повторяются: %s',
+                request.method, request.path,
+                json.dumps(exceeded), repeated,
+            )
@@ -0,0 +1,227 @@
+"""Чтение с реплик SQLite и журнал записей, по которому они догоняют базу.
+
+Роутер отправляет чтения GET-запросов на реплики из DATABASE_REPLICAS,
+а записи и всё остальное - в default. После записи ответ ставит cookie
+REPLICA_PIN_COOKIE, и REPLICA_PIN_SECONDS секунд чтения этого клиента
+тоже идут в default: он видит свои изменения, даже если реплика
+отстала. Вне запросов (команды, shell) реплики не используются.
+
+Чтения, результат которых попадает в общий кеш, идут в default внутри
+primary_reads(): ключ кеша может уже учитывать запись, которую реплика
+ещё не проиграла, и отставшие данные разошлись бы всем клиентам.
+
+Пока реплики настроены, каждая изменяющая инструкция к default вместе
+с параметрами пишется в LOG_TABLE той же транзакцией. Команда
+replicate копирует базу в файл реплики (snapshot) и затем проигрывает
+на нём журнал по порядку (replay).
+"""
+import pickle
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3.base import FORMAT_QMARK_REGEX
+
+LOG_TABLE = 'core_replication_log'
+STATE_TABLE = 'core_replication_state'
+WRITE_STATEMENT = re.compile(
+    r'\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE
+)
+
+_state = threading.local()
+
+
+class PrimaryReplicaRouter:
+    """Чтения запроса - на случайную реплику, остальное - в default."""
+
+    def db_for_read(self, model, **hints):
+        if (
+            not settings.DATABASE_REPLICAS
+            or not getattr(_state, 'routing', False)
+            or _state.pinned or _state.wrote
+            or getattr(_state, 'primary', False)
+            # Внутри транзакции читаем то, что в ней записано.
+            or connections['default'].in_atomic_block
+        ):
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что в default.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == 'default'
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока идут в default, а не на реплику."""
+    previous = getattr(_state, 'primary', False)
+    _state.primary = True
+    try:
+        yield
+    finally:
+        _state.primary = previous
+
+
+class ReplicaMiddleware:
+    """Включает чтение с реплик для GET-запросов без свежих записей."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        try:
+            pinned_until = float(
+                request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0)
+            )
+        except ValueError:
+            pinned_until = 0
+        _state.routing = request.method in ('GET', 'HEAD')
+        _state.pinned = pinned_until > time.time()
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.routing = False
+        if _state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+            )
+        return response
+
+
+def _record(connection, sql, params, many):
+    connection.connection.execute(
+        f'INSERT INTO {LOG_TABLE} (statement, params, many) VALUES (?, ?, ?)',
+        (sql, pickle.dumps(params, pickle.HIGHEST_PROTOCOL), many)
+    )
+
+
+def log_writes(execute, sql, params, many, context):
+    """execute_wrapper: пишет изменяющие инструкции в журнал."""
+    if not WRITE_STATEMENT.match(sql):
+        return execute(sql, params, many, context)
+    if many:
+        params = list(params)
+    connection = context['connection']
+    if connection.in_atomic_block:
+        result = execute(sql, params, many, context)
+        _record(connection, sql, params, many)
+        return result
+    # В автокоммите инструкция и её запись в журнале - одна транзакция,
+    # иначе чужая запись может вклиниться между ними.
+    with transaction.atomic(using=connection.alias):
+        result = execute(sql, params, many, context)
+        _record(connection, sql, params, many)
+    return result
+
+
+def create_log(raw):
+    raw.execute(
+        f'CREATE TABLE IF NOT EXISTS {LOG_TABLE} ('
+        f'id INTEGER PRIMARY KEY AUTOINCREMENT, statement TEXT NOT NULL, '
+        f'params BLOB, many INTEGER NOT NULL)'
+    )
+
+
+def _start_log(sender, connection, **kwargs):
+    if connection.alias != 'default' or not settings.DATABASE_REPLICAS:
+        return
+    create_log(connection.connection)
+    connection.execute_wrappers.append(log_writes)
+
+
+connection_created.connect(_start_log)
+
+
+def position(replica):
+    """Последняя проигранная на реплике запись журнала."""
+    row = replica.execute(
+        f"SELECT name FROM sqlite_master WHERE name = '{STATE_TABLE}'"
+    ).fetchone()
+    if row is None:
+        return None
+    return replica.execute(f'SELECT last_id FROM {STATE_TABLE}').fetchone()[0]
+
+
+def snapshot(primary, replica):
+    """Копирует базу primary в replica и запоминает позицию журнала.
+
+    primary и replica - соединения sqlite3, primary вне транзакции.
+    Копия снимается за один шаг backup, поэтому она согласована
+    с позицией.
+    """
+    create_log(primary)
+    last_id = primary.execute(
+        f'SELECT COALESCE(MAX(id), 0) FROM {LOG_TABLE}'
+    ).fetchone()[0]
+    primary.backup(replica)
+    replica.execute(f'DROP TABLE IF EXISTS {STATE_TABLE}')
+    replica.execute(f'CREATE TABLE {STATE_TABLE} (last_id INTEGER NOT NULL)')
+    replica.execute(f'INSERT INTO {STATE_TABLE} VALUES (?)', (last_id,))
+    replica.commit()
+    return last_id
+
+
+def replay(primary, replica, batch_size=1000):
+    """Проигрывает на replica записи журнала после её позиции.
+
+    Каждая пачка - одна транзакция вместе с новой позицией. Возвращает
+    число проигранных инструкций.
+    """
+    applied = 0
+    last_id = position(replica)
+    if last_id is None:
+        raise ValueError('Реплика не инициализирована: нужен snapshot.')
+    # Ограничения проверены на основной базе, порядок записей тот же.
+    replica.execute('PRAGMA foreign_keys = OFF')
+    while True:
+        rows = primary.execute(
+            f'SELECT id, statement, params, many FROM {LOG_TABLE} '
+            f'WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return applied
+        with replica:
+            for last_id, statement, params, many in rows:
+                params = pickle.loads(params)
+                if params is None:
+                    replica.execute(statement)
+                    continue
+                statement = FORMAT_QMARK_REGEX.sub('?', statement).replace(
+                    '%%', '%')
+                if many:
+                    replica.executemany(statement, params)
+                else:
+                    replica.execute(statement, params)
+            replica.execute(f'UPDATE {STATE_TABLE} SET last_id = ?',
+                            (last_id,))
+        applied += len(rows)
+
+
+def prune(primary, replicas):
+    """Удаляет из журнала записи, проигранные на всех репликах."""
+    positions = [position(replica) for replica in replicas]
+    if not positions or None in positions:
+        return 0
+    with primary:
+        cursor = primary.execute(
+            f'DELETE FROM {LOG_TABLE} WHERE id <= ?', (min(positions),)
+        )
+    return cursor.rowcount
@@ -0,0 +1,39 @@
+"""Проверка бюджетов запросов в тестах."""
+from contextlib import contextmanager
+
+from .middleware import collect_metrics
+
+
+def _listing(metrics):
+    lines = []
+    seen = set()
+    for number, sql in enumerate(metrics.statements, 1):
+        mark = '  '
+        if sql in seen:
+            mark = '↻ '
+        seen.add(sql)
+        lines.append(f'{number:>3}. {mark}{sql}')
+    return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(queries=None, cache_calls=None, label=''):
+    """Падает, если в блоке больше запросов к базе или обращений к кешу.
+
+    Работает и как декоратор. В сообщении об ошибке перечислены
+    все выполненные запросы, повторы отмечены стрелкой.
+    """
+    with collect_metrics() as metrics:
+        yield metrics
+    problems = []
+    if queries is not None and metrics.queries > queries:
+        problems.append(f'запросов {metrics.queries} > {queries}')
+    if cache_calls is not None and metrics.cache_calls > cache_calls:
+        problems.append(
+            f'обращений к кешу {metrics.cache_calls} > {cache_calls}'
+        )
+    if problems:
+        raise AssertionError(
+            f'{label} вышел за бюджет: {", ".join(problems)}\n'
+            f'{_listing(metrics)}'
+        )
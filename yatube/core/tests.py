@@ -1,6 +1,48 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
 from http import HTTPStatus
 
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import (Client, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.client import RequestFactory
+from django.urls import path, reverse
+
+from core.cache import CULL_EVERY, TieredCache
+from core.middleware import collect_metrics, current_metrics
+from core.replication import (ReplicaMiddleware, create_log, log_writes,
+                              position, replay, snapshot)
+from core.testing import query_budget
+from posts import feed, timeline
+from posts.models import Comment, Follow, Post, User
+
+
+def authors_view(request):
+    names = [post.author.username for post in Post.objects.all()]
+    return HttpResponse(', '.join(names))
+
+
+def read_view(request):
+    return HttpResponse(router.db_for_read(Post))
+
+
+def write_view(request):
+    router.db_for_write(Post)
+    return read_view(request)
+
+
+urlpatterns = [
+    path('authors/', authors_view),
+    path('read/', read_view),
+    path('write/', write_view),
+]
 
 
 class ViewTestClass(TestCase):
@@ -11,3 +53,364 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1)
+class RequestMetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for index in range(3):
+            user = User.objects.create_user(username=f'author_{index}')
+            Post.objects.create(author=user, text=f'Пост {index}')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def timings(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_server_timing_header(self):
+        """Заголовок содержит запросы, кеш, шаблоны и общее время."""
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            response = self.client.get('/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'cache', 'tpl', 'total'})
+        self.assertRegex(timings['db']['desc'], r'"[1-9]\d* queries')
+        self.assertGreater(float(timings['tpl']['dur']), 0)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['path'], '/')
+        self.assertEqual(line['status'], HTTPStatus.OK)
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['cache_misses'], 0)
+
+    def test_cache_hits_are_counted(self):
+        """Страница из кеша даёт попадания и ни одного запроса к базе."""
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            self.client.get('/')
+            self.client.get('/')
+        line = json.loads(logs.records[1].getMessage())
+        self.assertGreater(line['cache_hits'], 0)
+        self.assertEqual(line['queries'], 0)
+
+    @override_settings(
+        ROOT_URLCONF='core.tests',
+        REQUEST_METRICS_BUDGETS={'duplicates': 1},
+    )
+    def test_duplicates_exceed_budget(self):
+        """Повторяющиеся запросы N+1 пишутся предупреждением."""
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            self.client.get('/authors/')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['duplicates'], 2)
+        self.assertEqual(logs.records[1].levelname, 'WARNING')
+        self.assertIn('auth_user', logs.records[1].getMessage())
+        self.assertIsNone(current_metrics())
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_disabled(self):
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for index in range(3):
+            user = User.objects.create_user(username=f'author_{index}')
+            Post.objects.create(author=user, text=f'Пост {index}')
+
+    def test_within_budget(self):
+        with query_budget(queries=1, cache_calls=2) as used:
+            list(Post.objects.select_related('author'))
+            cache.get('key')
+            cache.set('key', 1)
+        self.assertEqual((used.queries, used.cache_calls), (1, 2))
+
+    def test_nested_collectors(self):
+        """Вложенный блок возвращает кешу обёртки внешнего."""
+        with collect_metrics() as outer:
+            with collect_metrics() as inner:
+                cache.get('key')
+                self.assertIs(current_metrics(), inner)
+            cache.get('key')
+            self.assertIs(current_metrics(), outer)
+        self.assertEqual((inner.cache_calls, outer.cache_calls), (1, 2))
+        self.assertNotIn('get', cache.__dict__)
+        self.assertIsNone(current_metrics())
+
+    def test_exceeded_budget_lists_queries(self):
+        """Сообщение перечисляет запросы и отмечает повторы."""
+        with self.assertRaises(AssertionError) as raised:
+            with query_budget(queries=1, label='authors'):
+                [post.author.username for post in Post.objects.all()]
+        message = str(raised.exception)
+        self.assertIn('authors вышел за бюджет: запросов 4 > 1', message)
+        self.assertEqual(message.count('↻'), 2)
+        self.assertIn('FROM "auth_user"', message)
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.backend()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def backend(self, location=None, **options):
+        options.setdefault('SYNC_INTERVAL', 0)
+        return TieredCache(location or self.location, {'OPTIONS': options})
+
+    def test_operations(self):
+        cache = self.cache
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertFalse(cache.add('key', 2))
+        self.assertTrue(cache.add('other', 2))
+        self.assertEqual(cache.incr('other', 3), 5)
+        self.assertEqual(
+            cache.get_many(['key', 'other', 'missing']),
+            {'key': {'value': 1}, 'other': 5},
+        )
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.set('short', 1, timeout=-1)
+        self.assertFalse(cache.has_key('short'))
+        cache.clear()
+        self.assertIsNone(cache.get('other'))
+
+    def test_l1_is_bounded_lru_by_bytes(self):
+        # L1 общий для LOCATION, поэтому нужен свой файл.
+        cache = self.backend(
+            os.path.join(self.directory, 'small.sqlite3'), L1_MAX_BYTES=2500
+        )
+        cache.set('a', b'a' * 1000)
+        cache.set('b', b'b' * 1000)
+        cache.get('a')
+        cache.set('c', b'c' * 1000)
+        self.assertEqual(list(cache.tier.entries), [':1:a', ':1:c'])
+        self.assertLessEqual(cache.tier.size, 2500)
+        self.assertEqual(cache.get('b'), b'b' * 1000)
+        cache.set('huge', b'h' * 5000)
+        self.assertNotIn(':1:huge', cache.tier.entries)
+        self.assertEqual(cache.get('huge'), b'h' * 5000)
+
+    def test_l2_culls_least_recently_read_by_bytes(self):
+        cache = self.backend(
+            os.path.join(self.directory, 'bounded.sqlite3'),
+            MAX_BYTES=5000, CULL_FREQUENCY=5,
+        )
+        for index in range(4):
+            cache.set(f'old_{index}', b'x' * 1000)
+        cache.get('old_0')
+        cache.tier.flush()
+        cache.tier.forget_all()
+        cache._writes = CULL_EVERY - 1
+        cache.set('new', b'x' * 1000)
+        # 5000 байт данных и заголовки pickle: уходят непрочитанные.
+        stats = cache.stats()
+        self.assertLessEqual(stats['l2_bytes'], 5000)
+        self.assertIsNotNone(cache.get('old_0'))
+        self.assertIsNotNone(cache.get('new'))
+        self.assertIsNone(cache.get('old_1'))
+
+    def test_stats_per_tier(self):
+        cache = self.cache
+        cache.set('key', 1)
+        cache.tier.entries.clear()
+        with collect_metrics() as metrics:
+            cache.get('key')
+            cache.get('key')
+            cache.get('missing')
+        self.assertEqual(metrics.cache_tiers, {
+            'l1_hits': 1, 'l1_misses': 2, 'l2_hits': 1, 'l2_misses': 1,
+        })
+        self.assertEqual(
+            cache.stats()['shared'],
+            {'l1_hits': 1, 'l1_misses': 2, 'l2_hits': 1, 'l2_misses': 1},
+        )
+        cache.reset_stats()
+        self.assertEqual(cache.stats()['shared']['l1_hits'], 0)
+
+    def test_read_racing_local_write_does_not_fill_l1(self):
+        """Старое значение, прочитанное до записи, не остаётся в L1."""
+        cache = self.cache
+        cache.set('key', 'old')
+        cache.tier.entries.clear()
+        key = cache._key('key', None)
+        mark = cache.tier.mark(key)
+        pickled, expires = cache.tier.connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        cache.set('key', 'new')
+        cache.tier.fill(key, pickled, expires, mark)
+        self.assertEqual(cache.get('key'), 'new')
+
+    def test_stats_are_written_once_per_interval(self):
+        cache = self.backend(
+            os.path.join(self.directory, 'stats.sqlite3'), STATS_INTERVAL=60
+        )
+        cache.get('missing')
+        cache.tier.last_sync = 0
+        cache.tier.sync()
+        self.assertTrue(cache.tier.unsaved)
+        self.assertEqual(cache.stats()['shared']['l2_misses'], 1)
+
+    def test_change_in_other_process_invalidates_l1(self):
+        """Запись из дочернего процесса выбрасывает значение из L1."""
+        self.cache.set('key', 'old')
+        self.assertEqual(self.cache.get('key'), 'old')
+        context = multiprocessing.get_context('fork')
+        child = context.Process(
+            target=lambda: self.backend().set('key', 'new')
+        )
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_clear_in_other_process_empties_l1(self):
+        self.cache.set('key', 1)
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=lambda: self.backend().clear())
+        child.start()
+        child.join()
+        self.assertIsNone(self.cache.get('key'))
+
+
+@override_settings(ROOT_URLCONF='core.tests', DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.client.get('/read/').content, b'replica')
+        self.assertEqual(self.client.post('/read/').content, b'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+
+    def test_reads_after_write_are_pinned(self):
+        """После записи клиент читает из default, пока не выйдет срок."""
+        response = self.client.get('/write/')
+        self.assertEqual(response.content, b'default')
+        self.assertIn('primary_until', response.cookies)
+        self.assertEqual(self.client.get('/read/').content, b'default')
+        self.client.cookies['primary_until'] = str(time.time() - 1)
+        self.assertEqual(self.client.get('/read/').content, b'replica')
+        self.assertEqual(Client().get('/read/').content, b'replica')
+
+
+class ReplicationTest(TransactionTestCase):
+    # Снимок базы нельзя снять внутри открытой транзакции TestCase.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.replica = sqlite3.connect(
+            os.path.join(self.directory, 'replica.sqlite3')
+        )
+        create_log(connection.connection)
+
+    def tearDown(self):
+        self.replica.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_replay_catches_up(self):
+        with connection.execute_wrapper(log_writes):
+            author = User.objects.create_user(username='author')
+            post = Post.objects.create(author=author, text='Первый')
+            self.assertEqual(
+                snapshot(connection.connection, self.replica),
+                position(self.replica),
+            )
+            Post.objects.filter(pk=post.pk).update(text='Исправленный')
+            Comment.objects.bulk_create(
+                Comment(post=post, author=author, text=f'Комментарий {i}')
+                for i in range(3)
+            )
+            Post.objects.create(author=author, text='Второй').delete()
+        self.assertGreater(replay(connection.connection, self.replica), 0)
+        self.assertEqual(
+            self.replica.execute(
+                'SELECT id, text FROM posts_post').fetchall(),
+            [(post.pk, 'Исправленный')],
+        )
+        self.assertEqual(self.replica.execute(
+            'SELECT COUNT(*) FROM posts_comment').fetchone()[0], 3)
+        self.assertEqual(replay(connection.connection, self.replica), 0)
+
+
+LAGGING_REPLICA = 'replica_lagging'
+
+
+@override_settings(DATABASE_REPLICAS=[LAGGING_REPLICA])
+class ReplicaLagTest(TransactionTestCase):
+    """Общие кеши не наполняются данными отставшей реплики."""
+    databases = {'default', LAGGING_REPLICA}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.databases[LAGGING_REPLICA] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.directory, 'replica.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[LAGGING_REPLICA].close()
+        del connections[LAGGING_REPLICA]
+        del connections.databases[LAGGING_REPLICA]
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        Post.objects.create(author=self.author, text='Старый пост')
+        replica = connections[LAGGING_REPLICA]
+        replica.ensure_connection()
+        connection.ensure_connection()
+        connection.connection.backup(replica.connection)
+        # Дальше реплика отстаёт: журнал на неё не проигрывается.
+        self.post = Post.objects.create(author=self.author, text='Новый пост')
+
+    def through_replica(self, func):
+        """func() внутри GET-запроса, читающего с реплики."""
+        result = []
+
+        def view(request):
+            result.append(func())
+            return HttpResponse()
+
+        ReplicaMiddleware(view)(RequestFactory().get('/'))
+        return result[0]
+
+    def test_replica_lags(self):
+        self.assertFalse(self.through_replica(
+            lambda: Post.objects.filter(pk=self.post.pk).exists()
+        ))
+
+    def test_cached_page_is_read_from_primary(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Новый пост')
+        self.assertContains(
+            self.client.get(reverse('posts:index')), 'Новый пост'
+        )
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=1)
+    def test_feed_caches_are_read_from_primary(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        keys = self.through_replica(
+            lambda: feed.recent_post_keys(self.author.pk)
+        )
+        self.assertIn(self.post.pk, [post_id for _, post_id in keys])
+        self.assertIn(self.author.pk, self.through_replica(
+            timeline.celebrity_ids
+        ))
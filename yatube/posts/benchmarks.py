@@ -0,0 +1,30 @@
+"""Общее для команд замеров bench_*."""
+import copy
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test import override_settings
+
+
+class Rollback(Exception):
+    """Выход из transaction.atomic с откатом данных замера."""
+
+
+@contextmanager
+def isolated_cache():
+    """Кеш default во временном SQLite-файле на время замера.
+
+    Замеры чистят кеш и сбрасывают поколения; с общим кешем это
+    задело бы работающий сайт.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube_bench_')
+    caches = copy.deepcopy(settings.CACHES)
+    caches['default']['LOCATION'] = os.path.join(directory, 'cache.sqlite3')
+    try:
+        with override_settings(CACHES=caches):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
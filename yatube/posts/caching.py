@@ -0,0 +1,378 @@
+"""Версионированный кеш публичных страниц.
+
+У каждой области (общая лента, группа, автор, пост) есть номер поколения
+в кеше. Ключ закешированной страницы включает номера поколений, поэтому
+запись поста или комментария делает старые страницы недостижимыми сразу,
+а сами страницы можно хранить долго.
+
+Страница кешируется одна на всех, персональные части подставляются
+при ответе (см. holes). Попадания, промахи и обходы считаются
+по каждому представлению, см. page_cache_stats.
+
+Страницу пересобирает один запрос за раз (single_flight): остальные
+получают устаревшую копию или ждут его результата, поэтому истечение
+или сброс популярной страницы не превращается в лавину запросов к базе.
+
+Страницы от PAGE_COMPRESS_MIN_BYTES хранятся сжатыми zlib, а рядом
+лежит готовая страница гостя в gzip: гостю, принимающему gzip, она
+отдаётся как есть, без заполнения дырок и повторного сжатия.
+"""
+import copy
+import gzip
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from core.replication import primary_reads
+
+from .holes import fill_holes
+
+GENERATION_KEY = 'feed:generation:{}'
+PAGE_KEY = 'page:{}:{}:{}'
+STATS_KEY = 'page:stats:{}:{}'
+LOCK_KEY = 'lock:{}'
+# Как часто ждущий запрос проверяет, не готов ли результат.
+LOCK_POLL_INTERVAL = 0.05
+STATS_OUTCOMES = ('hit', 'stale', 'miss', 'bypass')
+# Размер записанных страниц до сжатия и в кеше.
+STATS_SIZES = ('raw_bytes', 'stored_bytes')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+GLOBAL_SCOPE = 'global'
+# Представления под public_page, для отчёта о попаданиях.
+PAGE_PREFIXES = []
+# Счётчики копятся в процессе и пишутся в кеш не чаще раза в столько
+# секунд: запись в общий кеш на каждый запрос выстраивает процессы
+# в очередь к нему.
+STATS_FLUSH_INTERVAL = 1
+
+_pending_stats = Counter()
+_stats_lock = threading.Lock()
+_stats_flushed = 0.0
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def author_card_scope(author_id):
+    """Имя автора в карточках его постов."""
+    return f'author-card:{author_id}'
+
+
+def group_card_scope(group_id):
+    """Название и slug группы в карточках её постов."""
+    return f'group-card:{group_id}'
+
+
+def _fresh_generation():
+    # Поколение после вытеснения ключа не должно совпасть со старым.
+    return time.time_ns()
+
+
+def generation(*scopes):
+    """Строка с текущими поколениями перечисленных лент."""
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _fresh_generation(), None)
+            values[key] = cache.get(key)
+    return '.'.join(str(values[key]) for key in keys)
+
+
+def generations(scopes):
+    """{область: поколение} одним get_many.
+
+    Недостающие поколения записываются одним set_many: гонка двух
+    процессов даст лишь лишний пересчёт, ведь новое поколение
+    не совпадёт ни с одним старым.
+    """
+    keys = {GENERATION_KEY.format(scope): scope for scope in scopes}
+    values = cache.get_many(list(keys))
+    missing = {key: _fresh_generation() for key in keys if key not in values}
+    if missing:
+        cache.set_many(missing, None)
+        values.update(missing)
+    return {scope: values[key] for key, scope in keys.items()}
+
+
+def bump(*scopes):
+    """Переводит ленты на новое поколение."""
+    for scope in set(scopes):
+        key = GENERATION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_generation(), None)
+
+
+def post_scopes(post):
+    """Области, на страницах которых виден пост."""
+    scopes = [
+        GLOBAL_SCOPE, author_scope(post.author.username), post_scope(post.pk)
+    ]
+    if post.group_id:
+        scopes.append(group_scope(post.group.slug))
+    return scopes
+
+
+def depends_on(request, *scopes):
+    """Добавляет к странице области, известные только после выборки.
+
+    Например, страница поста зависит от ленты его автора.
+    """
+    request._page_scopes = getattr(request, '_page_scopes', ()) + scopes
+
+
+def _flight_entry(key, valid):
+    entry = cache.get(key)
+    if entry is None or valid is not None and not valid(entry['value']):
+        return None
+    return entry
+
+
+def _fresh(entry):
+    return entry is not None and entry['fresh_until'] > time.time()
+
+
+def _recompute(key, compute, timeout):
+    # Значение уйдёт в общий кеш под уже новым ключом: реплика
+    # могла ещё не догнать запись, которая этот ключ сменила.
+    with primary_reads():
+        value = compute()
+    if value is not None:
+        cache.set(key, {
+            'value': value, 'fresh_until': time.time() + timeout,
+        }, timeout + settings.FEED_CACHE_GRACE)
+    return value, 'miss'
+
+
+def single_flight(key, compute, timeout, valid=None):
+    """(значение, исход) из кеша; пересчёт - не больше одного сразу.
+
+    Значение хранится FEED_CACHE_GRACE секунд сверх timeout. Истёкшее
+    значение пересчитывает запрос, взявший блокировку, остальные
+    получают его же с исходом 'stale'. Если значения нет вовсе, они
+    до FEED_CACHE_LOCK_WAIT секунд ждут результата и только потом
+    считают сами. compute может вернуть None - такое не кешируется,
+    и ждущие считают сами, как только блокировка снята.
+    valid отбраковывает прочитанное значение, как будто его нет.
+    """
+    entry = _flight_entry(key, valid)
+    if _fresh(entry):
+        return entry['value'], 'hit'
+    lock = LOCK_KEY.format(key)
+    if cache.add(lock, 1, settings.FEED_CACHE_LOCK_TIMEOUT):
+        try:
+            # Пока мы брали блокировку, предыдущий владелец мог закончить.
+            entry = _flight_entry(key, valid)
+            if _fresh(entry):
+                return entry['value'], 'hit'
+            return _recompute(key, compute, timeout)
+        finally:
+            cache.delete(lock)
+    if entry is not None:
+        return entry['value'], 'stale'
+    deadline = time.monotonic() + settings.FEED_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        # Блокировка снимается после записи значения: проверить её
+        # раньше значения, чтобы не пропустить записанное.
+        released = not cache.has_key(lock)
+        entry = _flight_entry(key, valid)
+        if entry is not None:
+            return entry['value'], 'hit'
+        if released:
+            break
+    return _recompute(key, compute, timeout)
+
+
+def _count(key_prefix, outcome, amount=1):
+    with _stats_lock:
+        _pending_stats[STATS_KEY.format(key_prefix, outcome)] += amount
+    if time.monotonic() - _stats_flushed >= STATS_FLUSH_INTERVAL:
+        flush_page_cache_stats()
+
+
+def flush_page_cache_stats():
+    """Переносит накопленные в процессе счётчики в кеш."""
+    global _stats_flushed
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+        _stats_flushed = time.monotonic()
+    for key, amount in pending.items():
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            if not cache.add(key, amount, None):
+                cache.incr(key, amount)
+
+
+def page_cache_stats(key_prefixes):
+    """{представление: {hit, stale, miss, bypass, ratio, raw_bytes,
+    stored_bytes, saved}} по счётчикам в кеше."""
+    flush_page_cache_stats()
+    keys = {
+        STATS_KEY.format(prefix, outcome): (prefix, outcome)
+        for prefix in key_prefixes
+        for outcome in STATS_OUTCOMES + STATS_SIZES
+    }
+    values = cache.get_many(keys)
+    stats = {}
+    for key, (prefix, outcome) in keys.items():
+        stats.setdefault(prefix, {})[outcome] = values.get(key, 0)
+    for counts in stats.values():
+        served = counts['hit'] + counts['stale']
+        cached = served + counts['miss']
+        counts['ratio'] = round(served / cached, 3) if cached else None
+        counts['saved'] = counts['raw_bytes'] - counts['stored_bytes']
+    return stats
+
+
+def reset_page_cache_stats(key_prefixes):
+    with _stats_lock:
+        _pending_stats.clear()
+    cache.delete_many([
+        STATS_KEY.format(prefix, outcome)
+        for prefix in key_prefixes
+        for outcome in STATS_OUTCOMES + STATS_SIZES
+    ])
+
+
+def _cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def _page_entry(request, response, key_prefix):
+    """Запись кеша для страницы с метками дырок."""
+    content = response.content
+    depends = request._page_scopes
+    entry = {
+        'content': content,
+        'compressed': False,
+        'guest': None,
+        'content_type': response['Content-Type'],
+        'depends': depends,
+        'versions': generation(*depends) if depends else '',
+    }
+    raw = stored = len(content)
+    if len(content) >= settings.PAGE_COMPRESS_MIN_BYTES:
+        guest = copy.copy(request)
+        guest.user = AnonymousUser()
+        guest_body = fill_holes(guest, content)
+        entry['content'] = zlib.compress(content)
+        entry['compressed'] = True
+        entry['guest'] = gzip.compress(guest_body, mtime=0)
+        raw += len(guest_body)
+        stored = len(entry['content']) + len(entry['guest'])
+    _count(key_prefix, 'raw_bytes', raw)
+    _count(key_prefix, 'stored_bytes', stored)
+    return entry
+
+
+def _page_response(request, entry):
+    """Ответ из записи: готовая страница гостя или заполненные дырки."""
+    content_type = entry['content_type']
+    if entry['guest'] is not None and not request.user.is_authenticated:
+        accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if ACCEPTS_GZIP.search(accepted):
+            response = HttpResponse(entry['guest'], content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+            return response
+        return HttpResponse(
+            gzip.decompress(entry['guest']), content_type=content_type
+        )
+    content = entry['content']
+    if entry['compressed']:
+        content = zlib.decompress(content)
+    return HttpResponse(
+        fill_holes(request, content), content_type=content_type
+    )
+
+
+def public_page(key_prefix, scopes):
+    """Кеш готовых страниц, общих для всех посетителей.
+
+    Страница рендерится с метками вместо персональных частей (см. holes)
+    и дополняется ими для каждого посетителя, поэтому одна запись
+    в кеше обслуживает и гостей, и вошедших пользователей. Ответ
+    различается по Cookie и Accept-Encoding.
+
+    scopes получает аргументы представления и возвращает список областей,
+    из которых собрана страница; их поколения входят в ключ. Области,
+    добавленные представлением через depends_on, сохраняются вместе
+    со страницей и сверяются при чтении.
+    """
+    PAGE_PREFIXES.append(key_prefix)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                _count(key_prefix, 'bypass')
+                response = view(request, *args, **kwargs)
+                response['X-Cache'] = 'BYPASS'
+                return response
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = PAGE_KEY.format(
+                key_prefix, generation(*scopes(*args, **kwargs)), path
+            )
+            rendered = []
+
+            def render():
+                request._page_scopes = ()
+                request._punch_holes = True
+                try:
+                    response = view(request, *args, **kwargs)
+                finally:
+                    request._punch_holes = False
+                rendered.append(response)
+                if not _cacheable(request, response):
+                    return None
+                return _page_entry(request, response, key_prefix)
+
+            def current(entry):
+                return (
+                    not entry['depends']
+                    or generation(*entry['depends']) == entry['versions']
+                )
+
+            entry, outcome = single_flight(
+                key, render, settings.FEED_CACHE_TIMEOUT, current
+            )
+            _count(key_prefix, outcome)
+            if entry is not None:
+                response = _page_response(request, entry)
+            else:
+                response = rendered[0]
+                if not response.streaming:
+                    response.content = fill_holes(request, response.content)
+            response['X-Cache'] = outcome.upper()
+            patch_vary_headers(response, ('Cookie', 'Accept-Encoding'))
+            return response
+        return wrapper
+    return decorator
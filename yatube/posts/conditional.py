@@ -0,0 +1,129 @@
+"""Условные GET-запросы (ETag) для лент и страницы поста.
+
+Валидаторы считаются одним запросом по индексам: последний пост ленты
+(pub_date, id), правка поста и последний комментарий к нему. Результат
+хранится в кеше под поколением ленты или поста. В ETag
+к ним добавляются поколения лент из caching: они меняются при правке
+и удалении постов и комментариев, которые последнюю запись не
+сдвигают. Для авторизованного читателя в ETag входят его id
+и поколение его ленты автора, которое меняется и при подписке.
+
+Last-Modified не отдаётся: время последней записи не меняется при
+правке старого поста, удалении комментария или подписке, и по
+If-Modified-Since клиент получил бы 304 на устаревшую страницу.
+
+Неизменная страница получает 304 до кеша страниц, основных запросов
+и шаблонов.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.views.decorators.http import condition
+
+from .caching import (author_scope, generation, group_scope, post_scope,
+                      single_flight)
+from .models import Comment, Post
+
+FEED_ORDERING = ('-pub_date', '-id')
+LATEST_KEY = 'conditional:latest:{}:{}'
+
+
+def _viewer(request):
+    if not request.user.is_authenticated:
+        return 'anonymous'
+    follow_version = generation(author_scope(request.user.username))
+    return f'{request.user.pk}.{follow_version}'
+
+
+def _etag(request, parts):
+    raw = '|'.join(
+        str(part) for part in (request.get_full_path(), _viewer(request))
+        + tuple(parts)
+    )
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def _cached(scope, compute):
+    """Результат compute, закешированный под поколением области scope."""
+    version = generation(scope)
+    value, _ = single_flight(
+        LATEST_KEY.format(scope, version), lambda: compute() or (),
+        settings.FEED_CACHE_TIMEOUT,
+    )
+    return value, version
+
+
+def feed_validators(posts, scope):
+    """Части ETag ленты: её последний пост и поколение.
+
+    Последний пост хранится в кеше под поколением ленты, поэтому
+    повторный запрос, как и закешированная страница, обходится без базы.
+    """
+    latest, version = _cached(scope, lambda: posts.order_by(
+        *FEED_ORDERING).values_list('pub_date', 'id').first())
+    return latest, version
+
+
+def group_validators(request, slug):
+    return feed_validators(
+        Post.objects.filter(group__slug=slug), group_scope(slug)
+    )
+
+
+def profile_validators(request, username):
+    return feed_validators(
+        Post.objects.filter(author__username=username),
+        author_scope(username),
+    )
+
+
+def post_validators(request, post_id):
+    """Правка поста и последний комментарий; None, если поста нет."""
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by(
+        '-created', '-id')
+    row, version = _cached(post_scope(post_id), lambda: Post.objects.filter(
+        pk=post_id
+    ).annotate(
+        last_comment_created=Subquery(comments.values('created')[:1]),
+        last_comment_id=Subquery(comments.values('id')[:1]),
+    ).values_list(
+        'modified', 'image_ready', 'author__username',
+        'last_comment_created', 'last_comment_id',
+    ).first())
+    if not row:
+        return None
+    modified, image_ready, username, comment_created, comment_id = row
+    return (
+        modified, image_ready, comment_created, comment_id, version,
+        generation(author_scope(username)),
+    )
+
+
+def conditional_page(validators):
+    """condition() с ETag из частей, которые возвращает validators.
+
+    validators получает аргументы представления; None означает, что
+    страницы нет.
+    """
+    def etag(request, *args, **kwargs):
+        parts = validators(request, *args, **kwargs)
+        if parts is None:
+            return None
+        return _etag(request, parts)
+
+    def decorator(view):
+        conditional = condition(etag_func=etag)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            # Сжатое тело - другое представление, как в GZipMiddleware.
+            tag = response.get('ETag', '')
+            if response.has_header('Content-Encoding') and (
+                    tag.startswith('"')):
+                response['ETag'] = f'W/{tag}'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET x = x + 1 из сигналов моделей,
+строка AuthorStats создаётся пересчётом при первом чтении.
+"""
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .models import AuthorStats, Comment, Follow, Post, User
+
+
+def recount(user_id):
+    """Пересчитывает счётчики пользователя по исходным таблицам."""
+    stats, _ = AuthorStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': Post.shards.for_author(user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        }
+    )
+    return stats
+
+
+def stats_for(user):
+    """Счётчики пользователя без агрегирующих запросов."""
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        return recount(user.pk)
+
+
+def bump(user_id, field, delta):
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta}
+    )
+
+
+def bump_comments(post_id, delta, using=None):
+    """using - база поста, если он на шарде."""
+    Post.objects.using(using).filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def _subquery_count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def recount_all():
+    """Чинит все счётчики одним UPDATE на таблицу (и на шард)."""
+    for alias in sharding.post_databases():
+        Post.objects.using(alias).update(
+            comments_count=_subquery_count(Comment.objects.all(), 'post')
+        )
+    # Размер пачки выбирает бэкенд: у SQLite свой предел на INSERT.
+    AuthorStats.objects.bulk_create(
+        AuthorStats(user_id=user_id)
+        for user_id in User.objects.filter(
+            stats__isnull=True).values_list('id', flat=True)
+    )
+    AuthorStats.objects.update(
+        posts_count=_subquery_count(Post.objects.all(), 'author'),
+        followers_count=_subquery_count(Follow.objects.all(), 'author'),
+        following_count=_subquery_count(Follow.objects.all(), 'user'),
+    )
+    if sharding.enabled():
+        _recount_sharded_posts()
+
+
+def _recount_sharded_posts():
+    # Подзапрос из default к таблицам шардов невозможен.
+    for alias in settings.POST_SHARDS:
+        rows = Post.objects.using(alias).order_by().values(
+            'author').annotate(total=Count('pk')).values_list(
+            'author', 'total')
+        for author_id, total in rows:
+            AuthorStats.objects.filter(user_id=author_id).update(
+                posts_count=total)
@@ -0,0 +1,148 @@
+"""Гибридная лента подписок (push для обычных авторов, pull для знаменитых).
+
+Страница ленты собирается k-way слиянием разложенных записей
+TimelineEntry читателя со списками последних постов знаменитых авторов,
+на которых он подписан. Списки последних постов хранятся в кеше
+и сбрасываются при создании или удалении поста автора.
+"""
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.replication import primary_reads
+
+from . import sharding
+from .models import Follow, Post, TimelineEntry
+from .timeline import TIMELINE_ORDERING, celebrity_ids, timeline_for
+from .utils import (CursorPaginator, get_page_context, get_post_page,
+                    keyset_filter)
+
+RECENT_POSTS_KEY = 'feed:recent:{}'
+POST_ORDERING = ('-pub_date', '-id')
+
+
+def recent_post_keys(author_id):
+    """Ключи (pub_date, id) последних постов автора, от новых к старым."""
+    key = RECENT_POSTS_KEY.format(author_id)
+    keys = cache.get(key)
+    if keys is None:
+        with primary_reads():
+            keys = list(
+                Post.objects.filter(author_id=author_id).order_by(
+                    *POST_ORDERING
+                ).values_list('pub_date', 'id')[:settings.FEED_RECENT_POSTS]
+            )
+        cache.set(key, keys, None)
+    return keys
+
+
+def forget_recent_posts(author_id):
+    cache.delete(RECENT_POSTS_KEY.format(author_id))
+
+
+def _author_keys(author_id, bound, backwards, limit):
+    """Ключи постов автора за границей bound в порядке обхода."""
+    keys = recent_post_keys(author_id)
+    complete = len(keys) < settings.FEED_RECENT_POSTS
+    if bound is None:
+        if len(keys) >= limit or complete:
+            return keys[:limit]
+    elif not backwards:
+        older = [key for key in keys if key < bound]
+        if len(older) >= limit or complete:
+            return older[:limit]
+    else:
+        newer = [key for key in keys if key > bound]
+        if len(newer) < len(keys) or complete:
+            return newer[::-1][:limit]
+    queryset = Post.objects.filter(author_id=author_id).order_by(
+        *POST_ORDERING
+    )
+    if bound is not None:
+        queryset = queryset.filter(
+            keyset_filter(POST_ORDERING, bound, not backwards)
+        )
+    if backwards:
+        queryset = queryset.reverse()
+    return list(queryset.values_list('pub_date', 'id')[:limit])
+
+
+class FeedPaginator(CursorPaginator):
+    """Курсорный пагинатор над гибридной лентой читателя."""
+    supports_offset = False
+
+    def __init__(self, object_list, per_page, user=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.user = user
+
+    def pulled_authors(self):
+        followed = Follow.objects.filter(user=self.user).values_list(
+            'author_id', flat=True
+        )
+        celebrities = celebrity_ids()
+        if not celebrities:
+            return set()
+        return celebrities.intersection(followed)
+
+    def fetch(self, values, backwards, limit):
+        pushed = super().fetch(values, backwards, limit)
+        authors = self.pulled_authors()
+        if not authors:
+            return pushed
+        bound = tuple(values) if values is not None else None
+        entries = {(entry.pub_date, entry.post_id): entry for entry in pushed}
+        streams = [[(entry.pub_date, entry.post_id) for entry in pushed]]
+        for author_id in authors:
+            streams.append(_author_keys(author_id, bound, backwards, limit))
+        merged = []
+        for key in heapq.merge(*streams, reverse=not backwards):
+            if merged and merged[-1] == key:
+                continue
+            merged.append(key)
+            if len(merged) == limit:
+                break
+        missing = [key[1] for key in merged if key not in entries]
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            missing
+        )
+        rows = []
+        for key in merged:
+            entry = entries.get(key)
+            if entry is None:
+                post = posts.get(key[1])
+                if post is None:
+                    continue
+                entry = TimelineEntry(
+                    user=self.user,
+                    post=post,
+                    author_id=post.author_id,
+                    pub_date=post.pub_date,
+                )
+            rows.append(entry)
+        return rows
+
+
+def get_follow_page(request):
+    """Страница ленты подписок текущего пользователя.
+
+    При шардировании лента читается с шардов авторов подписок.
+    """
+    if sharding.enabled():
+        author_ids = list(Follow.objects.filter(
+            user=request.user).values_list('author_id', flat=True))
+        return get_post_page(
+            Post.objects.filter(author_id__in=author_ids).select_related(
+                'author', 'group'),
+            request,
+            author_ids,
+        )
+    page_obj = get_page_context(
+        timeline_for(request.user),
+        request,
+        ordering=TIMELINE_ORDERING,
+        paginator_class=FeedPaginator,
+        user=request.user,
+    )
+    page_obj.object_list = [entry.post for entry in page_obj]
+    return page_obj
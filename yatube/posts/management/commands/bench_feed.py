@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from posts import timeline
+from posts.benchmarks import Rollback, isolated_cache
+from posts.feed import get_follow_page
+from posts.models import Follow, Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет стоимость публикации и чтения ленты подписок '
+        'для автора с большим числом подписчиков в режимах push и hybrid. '
+        'Все данные создаются в транзакции и откатываются, кеш '
+        'временный.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=10000)
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def timed(self, func, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples), max(samples)
+
+    def populate(self, followers, authors, posts):
+        User.objects.bulk_create(
+            User(username=f'bench_{i}') for i in range(followers + authors)
+        )
+        users = list(
+            User.objects.filter(username__startswith='bench_').order_by('id')
+        )
+        celebrity, others = users[0], users[1:authors]
+        reader = users[authors]
+        Follow.objects.bulk_create(
+            Follow(user=user, author=celebrity) for user in users[1:]
+        )
+        Follow.objects.bulk_create(
+            Follow(user=reader, author=author) for author in others
+        )
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Пост {i}')
+            for author in [celebrity] + others
+            for i in range(posts)
+        )
+        return celebrity, reader
+
+    def measure(self, celebrity, reader, repeat):
+        cache.clear()
+        timeline.rebuild()
+        request = RequestFactory().get('/follow/')
+        request.user = reader
+
+        def publish():
+            with transaction.atomic():
+                Post.objects.create(author=celebrity, text='Новый пост')
+                transaction.set_rollback(True)
+
+        def read():
+            list(get_follow_page(request))
+
+        return self.timed(publish, repeat), self.timed(read, repeat)
+
+    def handle(self, *args, **options):
+        try:
+            with isolated_cache(), transaction.atomic():
+                celebrity, reader = self.populate(
+                    options['followers'], options['authors'], options['posts']
+                )
+                for mode, threshold in (
+                    ('push', options['followers'] + options['authors'] + 1),
+                    ('hybrid', options['followers']),
+                ):
+                    with override_settings(FEED_CELEBRITY_THRESHOLD=threshold):
+                        publish, read = self.measure(
+                            celebrity, reader, options['repeat']
+                        )
+                    self.stdout.write(
+                        f'{mode:>6}: публикация {publish[0]:8.2f} мс '
+                        f'(макс. {publish[1]:.2f}), '
+                        f'чтение ленты {read[0]:6.2f} мс '
+                        f'(макс. {read[1]:.2f})'
+                    )
+                raise Rollback
+        except Rollback:
+            pass
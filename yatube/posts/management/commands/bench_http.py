@@ -0,0 +1,425 @@
+import io
+import json
+import os
+import posixpath
+import random
+import re
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.middleware import collect_metrics
+from posts.models import Follow, Group, Post, User
+
+# (имя, нужен ли вход, вес) - смесь запросов по умолчанию.
+MIX = (
+    ('index', False, 30),
+    ('group_list', False, 15),
+    ('profile', False, 15),
+    ('post_detail', False, 20),
+    ('follow_index', True, 15),
+    ('add_comment', True, 5),
+)
+SAMPLE_SIZE = 1000
+CSRF_SECRET = 'bench' * 6 + 'hp'
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries')
+# Сколько секунд ждать, пока сервер ревизии начнёт принимать запросы.
+SERVER_START_TIMEOUT = 30
+# Без неё базу ревизии не заполнить (команда появилась не сразу).
+SEED_COMMAND = 'posts/management/commands/seed_yatube.py'
+
+
+def percentile(samples, share):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class InProcessClient:
+    """Вызывает WSGI-приложение из yatube/wsgi.py без сети."""
+
+    def __init__(self):
+        from yatube.wsgi import application
+        self.application = application
+
+    def request(self, method, path, cookies, data=None):
+        body = urlencode(data or {}).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'HTTP_COOKIE': '; '.join(
+                f'{name}={value}' for name, value in cookies.items()
+            ),
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        setup_testing_defaults(environ)
+        status = []
+
+        def start_response(line, headers, exc_info=None):
+            status.append(int(line.split()[0]))
+
+        with collect_metrics() as metrics:
+            response = self.application(environ, start_response)
+            try:
+                for _ in response:
+                    pass
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        return status[0], metrics.queries
+
+
+class RemoteClient:
+    """Ходит на запущенный сервер; запросы к базе берёт из Server-Timing."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.sessions = threading.local()
+        self.requests = requests
+
+    def request(self, method, path, cookies, data=None):
+        session = getattr(self.sessions, 'session', None)
+        if session is None:
+            session = self.sessions.session = self.requests.Session()
+        response = session.request(
+            method, self.base_url + path, cookies=cookies, data=data,
+            allow_redirects=False,
+        )
+        found = SERVER_TIMING_QUERIES.search(
+            response.headers.get('Server-Timing', '')
+        )
+        return response.status_code, int(found.group(1)) if found else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный замер представлений: p50/p95/p99, запросы в секунду '
+        'и запросы к базе на запрос для взвешенной смеси анонимного '
+        'и авторизованного трафика. Умеет сравнивать две git-ревизии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, использующего ту же базу. '
+                 'По умолчанию приложение вызывается в этом процессе.',
+        )
+        parser.add_argument('--json', help='Сохранить результат в файл.')
+        parser.add_argument(
+            '--baseline', help='Сравнить с результатом из файла --json.',
+        )
+        parser.add_argument(
+            '--revisions', nargs=2, metavar=('OLD', 'NEW'),
+            help='Замерить серверы двух git-ревизий, каждый на своей '
+                 'новой базе, заполненной seed_yatube этой ревизии.',
+        )
+        parser.add_argument(
+            '--seed-args', default='',
+            help='Аргументы seed_yatube для баз ревизий, одной строкой.',
+        )
+
+    def handle(self, *args, **options):
+        if options['revisions']:
+            return self.compare_revisions(options)
+        self.rng = random.Random(options['seed'])
+        self.prepare(options['users'])
+        client = (
+            RemoteClient(options['url']) if options['url']
+            else InProcessClient()
+        )
+        try:
+            self.run(client, self.plan(options['warmup']), 1)
+            started = time.perf_counter()
+            results = self.run(
+                client, self.plan(options['requests']),
+                options['concurrency']
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            for key in self.session_keys:
+                SessionStore(session_key=key).delete()
+        report = self.summarize(results, elapsed)
+        self.print_report(report)
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                self.print_diff(json.load(file), report)
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, indent=2)
+
+    def prepare(self, users_count):
+        def sample(queryset):
+            ids = list(queryset.values_list('id', flat=True)[:SAMPLE_SIZE])
+            self.rng.shuffle(ids)
+            return ids
+
+        self.posts = sample(Post.objects.order_by('-id'))
+        self.groups = list(
+            Group.objects.filter(
+                id__in=sample(Group.objects.order_by('id'))
+            ).values_list('slug', flat=True)
+        )
+        self.authors = list(
+            User.objects.filter(
+                id__in=sample(User.objects.filter(posts__isnull=False)
+                              .order_by('id').distinct())
+            ).values_list('username', flat=True)
+        )
+        readers = User.objects.filter(
+            id__in=Follow.objects.values('user_id')
+        ).order_by('id')[:users_count]
+        if not (self.posts and self.groups and self.authors and readers):
+            raise CommandError(
+                'Мало данных: заполните базу командой seed_yatube.'
+            )
+        self.session_keys = []
+        self.cookies = []
+        for reader in readers:
+            session = SessionStore()
+            session[SESSION_KEY] = str(reader.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = reader.get_session_auth_hash()
+            session.create()
+            self.session_keys.append(session.session_key)
+            self.cookies.append({
+                settings.SESSION_COOKIE_NAME: session.session_key,
+                settings.CSRF_COOKIE_NAME: CSRF_SECRET,
+            })
+
+    def target(self, name):
+        """Метод, путь и данные запроса к представлению name."""
+        rng = self.rng
+        if name == 'index':
+            return 'GET', reverse('posts:index'), None
+        if name == 'group_list':
+            slug = rng.choice(self.groups)
+            return 'GET', reverse('posts:group_list', args=[slug]), None
+        if name == 'profile':
+            username = rng.choice(self.authors)
+            return 'GET', reverse('posts:user', args=[username]), None
+        if name == 'post_detail':
+            post_id = rng.choice(self.posts)
+            return 'GET', reverse('posts:post_detail', args=[post_id]), None
+        if name == 'follow_index':
+            return 'GET', reverse('posts:follow_index'), None
+        post_id = rng.choice(self.posts)
+        data = {'text': 'Нагрузочный комментарий',
+                'csrfmiddlewaretoken': CSRF_SECRET}
+        return 'POST', reverse('posts:add_comment', args=[post_id]), data
+
+    def plan(self, count):
+        names = [name for name, _, _ in MIX]
+        weights = [weight for _, _, weight in MIX]
+        logged_in = {name: login for name, login, _ in MIX}
+        plan = []
+        for name in self.rng.choices(names, weights, k=count):
+            cookies = {}
+            if logged_in[name]:
+                cookies = self.rng.choice(self.cookies)
+            plan.append((name, cookies) + self.target(name))
+        return plan
+
+    def run(self, client, plan, concurrency):
+        def call(item):
+            name, cookies, method, path, data = item
+            start = time.perf_counter()
+            status, queries = client.request(method, path, cookies, data)
+            return name, time.perf_counter() - start, status, queries
+
+        if concurrency == 1:
+            return [call(item) for item in plan]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(call, plan))
+
+    def summarize(self, results, elapsed):
+        views = {}
+        for name, _, _ in MIX:
+            rows = [row for row in results if row[0] == name]
+            if not rows:
+                continue
+            latencies = [row[1] * 1000 for row in rows]
+            queries = [row[3] for row in rows if row[3] is not None]
+            views[name] = {
+                'requests': len(rows),
+                'errors': sum(1 for row in rows if row[2] >= 400),
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries': (
+                    round(statistics.mean(queries), 1) if queries else None
+                ),
+            }
+        return {
+            'requests': len(results),
+            'rps': round(len(results) / elapsed, 1),
+            'views': views,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'{"представление":<14} {"запр.":>6} {"ошиб.":>6} '
+            f'{"p50":>8} {"p95":>8} {"p99":>8} {"SQL":>6}'
+        )
+        for name, view in report['views'].items():
+            queries = '-' if view['queries'] is None else view['queries']
+            self.stdout.write(
+                f'{name:<14} {view["requests"]:>6} {view["errors"]:>6} '
+                f'{view["p50_ms"]:>8} {view["p95_ms"]:>8} '
+                f'{view["p99_ms"]:>8} {queries:>6}'
+            )
+        self.stdout.write(f'Запросов в секунду: {report["rps"]}')
+
+    def print_diff(self, old, new):
+        self.stdout.write('Изменение p95 и SQL относительно базового замера:')
+        for name, view in new['views'].items():
+            before = old['views'].get(name)
+            if before is None:
+                continue
+            change = (view['p95_ms'] / before['p95_ms'] - 1) * 100
+            self.stdout.write(
+                f'{name:<14} p95 {before["p95_ms"]:>8} -> '
+                f'{view["p95_ms"]:>8} ({change:+.0f}%), '
+                f'SQL {before["queries"]} -> {view["queries"]}'
+            )
+        change = (new['rps'] / old['rps'] - 1) * 100
+        self.stdout.write(
+            f'rps {old["rps"]} -> {new["rps"]} ({change:+.0f}%)'
+        )
+
+    def compare_revisions(self, options):
+        """Замеряет сервер каждой ревизии харнессом текущего дерева.
+
+        Ревизия запускается runserver из git worktree на новой базе,
+        которую создают и заполняют её же migrate и seed_yatube: схема
+        базы всегда совпадает с кодом сервера. Запросы шлёт bench_http
+        этого дерева с --url, читая образцы данных из той же базы.
+        Ревизии без seed_yatube отвергаются до создания worktree.
+        """
+        project = os.path.relpath(settings.BASE_DIR, self.git_root())
+        missing = [
+            revision for revision in options['revisions']
+            if not self.has_file(revision, project, SEED_COMMAND)
+        ]
+        if missing:
+            raise CommandError(
+                f'В ревизиях {", ".join(missing)} нет {SEED_COMMAND}: '
+                f'базу для них нечем заполнить. Возьмите ревизии, где '
+                f'команда seed_yatube уже есть.'
+            )
+        arguments = [
+            f'--{name}={options[name]}'
+            for name in ('requests', 'warmup', 'concurrency', 'users', 'seed')
+        ]
+        seed_arguments = shlex.split(options['seed_args'])
+        reports = []
+        workdir = tempfile.mkdtemp()
+        try:
+            for revision in options['revisions']:
+                tree = os.path.join(workdir, revision.replace('/', '_'))
+                self.git('worktree', 'add', '--detach', tree, revision)
+                try:
+                    base = os.path.join(tree, project)
+                    env = dict(
+                        os.environ,
+                        YATUBE_DB_PATH=os.path.join(base, 'db.sqlite3'),
+                        YATUBE_CACHE_PATH=os.path.join(base, 'cache.sqlite3'),
+                        YATUBE_METRICS_SAMPLE_RATE='1',
+                    )
+                    manage = [sys.executable, 'manage.py']
+                    self.stdout.write(f'== {revision}')
+                    subprocess.run(
+                        manage + ['migrate', '--noinput', '-v0'],
+                        cwd=base, env=env, check=True,
+                    )
+                    subprocess.run(
+                        manage + ['seed_yatube', f'--seed={options["seed"]}']
+                        + seed_arguments,
+                        cwd=base, env=env, check=True,
+                    )
+                    output = os.path.join(workdir, f'{len(reports)}.json')
+                    with self.server(base, env) as url:
+                        subprocess.run(
+                            manage + ['bench_http', f'--url={url}',
+                                      f'--json={output}'] + arguments,
+                            cwd=settings.BASE_DIR, env=env, check=True,
+                        )
+                    with open(output) as file:
+                        reports.append(json.load(file))
+                finally:
+                    self.git('worktree', 'remove', '--force', tree)
+        except subprocess.CalledProcessError as error:
+            raise CommandError(f'Замер ревизии не удался: {error}')
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        self.print_diff(*reports)
+
+    @contextmanager
+    def server(self, base, env):
+        """Запускает runserver в каталоге base и отдаёт его адрес."""
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', '--noreload',
+             f'127.0.0.1:{port}'],
+            cwd=base, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), 1).close()
+                    break
+                except OSError:
+                    if process.poll() is not None or (
+                            time.monotonic() > deadline):
+                        raise CommandError('Сервер ревизии не запустился.')
+                    time.sleep(0.1)
+            yield f'http://127.0.0.1:{port}'
+        finally:
+            process.terminate()
+            process.wait()
+
+    def has_file(self, revision, project, path):
+        """Есть ли файл path проекта в ревизии revision."""
+        name = posixpath.normpath(posixpath.join(project, path))
+        return subprocess.run(
+            ['git', 'cat-file', '-e', f'{revision}:{name}'],
+            cwd=settings.BASE_DIR, capture_output=True,
+        ).returncode == 0
+
+    def git_root(self):
+        return self.git('rev-parse', '--show-toplevel').strip()
+
+    def git(self, *args):
+        return subprocess.run(
+            ('git',) + args, cwd=settings.BASE_DIR, check=True,
+            capture_output=True, text=True,
+        ).stdout
@@ -0,0 +1,124 @@
+import io
+import random
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
+
+from posts import thumbnails
+from posts.benchmarks import Rollback
+from posts.models import Post, User
+
+# (ширина окна, плотность пикселей) типичных клиентов.
+VIEWPORTS = ((360, 2), (768, 1), (1280, 1))
+CARD_SLOT = 960
+
+
+def synthetic_image(seed, size=(1600, 1000)):
+    """Фотоподобная картинка: градиенты с шумом."""
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient('L')
+    channels = (
+        gradient.rotate(rng.randrange(360)).resize(size),
+        Image.effect_noise(size, rng.randrange(20, 60)),
+        gradient.rotate(rng.randrange(360)).resize(size),
+    )
+    buffer = io.BytesIO()
+    Image.merge('RGB', channels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает объём картинок страницы ленты: одна миниатюра 960x339 '
+        'для всех против вариантов из srcset для разных экранов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='Сгенерировать столько постов с картинками во временной '
+                 'папке и откатить их после замера.',
+        )
+
+    def page_posts(self):
+        return list(
+            Post.objects.exclude(image='').filter(
+                image_ready=True
+            ).prefetch_related('image_variants')[:settings.NUM_POSTS]
+        )
+
+    def report(self, posts):
+        if not posts:
+            raise CommandError('Нет готовых постов с картинками.')
+        geometry, options = settings.POST_IMAGE_GEOMETRIES[0]
+        before = 0
+        for post in posts:
+            thumbnail = get_thumbnail(post.image, geometry, **options)
+            before += thumbnail.storage.size(thumbnail.name)
+        preferred = thumbnails.variant_formats()
+        self.stdout.write(
+            f'Постов на странице: {len(posts)}, '
+            f'форматы вариантов: {", ".join(preferred)}'
+        )
+        self.stdout.write(f'{"экран":>10} {"до, КБ":>10} {"после, КБ":>10}')
+        for viewport, density in VIEWPORTS:
+            needed = min(viewport, CARD_SLOT) * density
+            after = 0
+            for post in posts:
+                variants = [
+                    variant for variant in post.image_variants.all()
+                    if variant.format == preferred[0]
+                ]
+                if not variants:
+                    continue
+                fitting = [
+                    variant for variant in variants
+                    if variant.width >= needed
+                ]
+                chosen = min(
+                    fitting or variants,
+                    key=lambda variant: (
+                        variant.width if fitting else -variant.width)
+                )
+                after += chosen.size
+            self.stdout.write(
+                f'{viewport:>6}@{density}x {before / 1024:>10.1f} '
+                f'{after / 1024:>10.1f}'
+            )
+
+    def synthetic(self, count):
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                with transaction.atomic():
+                    user = User.objects.create_user(username='bench_images')
+                    for index in range(count):
+                        post = Post.objects.create(
+                            author=user,
+                            text=f'Пост {index}',
+                            image=SimpleUploadedFile(
+                                f'bench_{index}.jpg', synthetic_image(index)
+                            ),
+                        )
+                        thumbnails.generate(post.id)
+                    self.report(self.page_posts())
+                    raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def handle(self, *args, synthetic=0, **options):
+        if synthetic:
+            self.synthetic(synthetic)
+        else:
+            self.report(self.page_posts())
@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import reverse
+
+from posts.benchmarks import isolated_cache
+from posts.caching import GLOBAL_SCOPE, bump
+from posts.management.commands.bench_http import InProcessClient, percentile
+
+# (название, настройки кеша лент) - без защиты все промахи считают сами.
+MODES = (
+    ('без защиты', {'FEED_CACHE_GRACE': 0, 'FEED_CACHE_LOCK_WAIT': 0}),
+    ('single-flight', {'FEED_CACHE_GRACE': 60, 'FEED_CACHE_LOCK_WAIT': 2}),
+)
+# Время жизни страницы на время замера, секунды.
+PAGE_TIMEOUT = 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет нагрузку на базу в момент, когда страница главной '
+        'истекает или сбрасывается под одновременными запросами: '
+        'сколько раз она пересобрана и сколько было запросов к базе, '
+        'без защиты и с single-flight. Кеш на время замера временный.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def handle(self, *args, **options):
+        self.client = InProcessClient()
+        self.path = reverse('posts:index')
+        concurrency = options['concurrency']
+        self.stdout.write(
+            f'{"режим":<14} {"событие":<10} {"SQL":>6} {"пересборок":>11} '
+            f'{"p50":>8} {"p95":>8}'
+        )
+        with isolated_cache(), \
+                ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for name, overrides in MODES:
+                with override_settings(
+                    FEED_CACHE_TIMEOUT=PAGE_TIMEOUT, **overrides
+                ):
+                    for event in ('истечение', 'сброс'):
+                        rows = [
+                            self.burst(executor, concurrency, event)
+                            for _ in range(options['rounds'])
+                        ]
+                        self.report(name, event, rows, options['rounds'])
+
+    def burst(self, executor, concurrency, event):
+        """Готовит событие и пускает concurrency запросов одновременно."""
+        cache.clear()
+        self.client.request('GET', self.path, {})
+        if event == 'истечение':
+            time.sleep(PAGE_TIMEOUT + 0.05)
+        else:
+            bump(GLOBAL_SCOPE)
+        barrier = threading.Barrier(concurrency)
+
+        def call(_):
+            barrier.wait()
+            start = time.perf_counter()
+            _, queries = self.client.request('GET', self.path, {})
+            return time.perf_counter() - start, queries
+
+        return list(executor.map(call, range(concurrency)))
+
+    def report(self, name, event, rounds, count):
+        results = [row for rows in rounds for row in rows]
+        latencies = [elapsed * 1000 for elapsed, _ in results]
+        queries = sum(row[1] for row in results)
+        # Собранная из кеша главная не ходит в базу.
+        renders = sum(1 for row in results if row[1])
+        self.stdout.write(
+            f'{name:<14} {event:<10} {queries / count:>6.1f} '
+            f'{renders / count:>11.1f} '
+            f'{percentile(latencies, 0.50):>8.2f} '
+            f'{percentile(latencies, 0.95):>8.2f}'
+        )
@@ -0,0 +1,92 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.transfer import (SECTIONS, dump_record, keyset_chunks,
+                            load_checkpoint, refuse_sharded,
+                            save_checkpoint)
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает группы, посты, комментарии и подписки в JSONL. '
+        'Таблицы читаются пачками по id, память не зависит от объёма. '
+        'С шардированием (YATUBE_SHARDS) не работает.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Файл JSONL или - для stdout.')
+        parser.add_argument(
+            '--models', nargs='+', choices=list(SECTIONS),
+            default=list(SECTIONS),
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки, по умолчанию OUTPUT.checkpoint.',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванную выгрузку с контрольной точки.',
+        )
+
+    def handle(self, *args, **options):
+        refuse_sharded()
+        models = [name for name in SECTIONS if name in options['models']]
+        if options['output'] == '-':
+            if options['resume']:
+                raise CommandError('В stdout нельзя продолжить выгрузку.')
+            stream = sys.stdout.buffer
+            written = self.export(stream, models, options['batch_size'])
+            stream.flush()
+            self.stderr.write(f'Выгружено записей: {written}')
+            return
+        checkpoint = options['checkpoint'] or f'{options["output"]}.checkpoint'
+        state = load_checkpoint(checkpoint)
+        if state and not options['resume']:
+            raise CommandError(
+                f'Есть контрольная точка {checkpoint}: добавьте --resume '
+                f'или удалите её.'
+            )
+        if options['resume'] and not state:
+            raise CommandError(f'Контрольная точка {checkpoint} не найдена.')
+        mode = 'wb'
+        if state:
+            # Всё, что записано после контрольной точки, выгрузим заново.
+            mode = 'r+b'
+        with open(options['output'], mode) as stream:
+            if state:
+                stream.truncate(state['offset'])
+                stream.seek(state['offset'])
+            written = self.export(
+                stream, models, options['batch_size'], checkpoint, state
+            )
+        os.remove(checkpoint)
+        self.stdout.write(f'Выгружено записей: {written}')
+
+    def export(self, stream, models, batch_size, checkpoint=None, state=None):
+        written = state['written'] if state else 0
+        if state:
+            models = models[models.index(state['model']):]
+        for name in models:
+            model, fields = SECTIONS[name]
+            after = 0
+            if state and state['model'] == name:
+                after = state['last_id']
+            queryset = model.objects.values(*fields.values())
+            for chunk in keyset_chunks(queryset, batch_size, after):
+                stream.write(b''.join(
+                    dump_record(name, values) for values in chunk
+                ))
+                written += len(chunk)
+                if checkpoint:
+                    stream.flush()
+                    os.fsync(stream.fileno())
+                    save_checkpoint(checkpoint, {
+                        'model': name,
+                        'last_id': chunk[-1]['id'],
+                        'offset': stream.tell(),
+                        'written': written,
+                    })
+        return written
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import sharding, thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Синхронно готовит миниатюры постов, картинки которых не готовы.'
+
+    def handle(self, *args, **options):
+        done = 0
+        for alias in sharding.post_databases():
+            post_ids = Post.objects.using(alias).exclude(image='').filter(
+                image_ready=False
+            ).values_list('id', flat=True)
+            done += sum(
+                thumbnails.generate(post_id, alias) for post_id in post_ids
+            )
+        self.stdout.write(f'Подготовлено постов: {done}')
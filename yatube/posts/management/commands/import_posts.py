@@ -0,0 +1,300 @@
+import json
+import os
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from posts import counters, search, timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.transfer import (SECTIONS, chunks, load_checkpoint,
+                            manual_dates, refuse_sharded, save_checkpoint)
+# Поля, по которым запись из файла узнаётся в базе. По первому полю
+# есть индекс: записи пачки ищутся запросом по нему, остальные поля
+# сверяются в Python.
+GROUP_KEY = ('slug',)
+POST_KEY = ('pub_date', 'author_id')
+COMMENT_KEY = ('post_id', 'author_id', 'created')
+FOLLOW_KEY = ('user_id', 'author_id')
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает JSONL из export_posts пачками bulk_create. '
+        'Недостающие пользователи создаются без пароля, группы ищутся '
+        'по slug. Уже загруженные посты и комментарии (тот же автор '
+        'и время) пропускаются, id из файла сохраняются, а если id занят '
+        'другой записью, она получает новый и комментарии идут за ней. '
+        'С шардированием (YATUBE_SHARDS) не работает.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл JSONL.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки, по умолчанию INPUT.checkpoint.',
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванную загрузку с контрольной точки.',
+        )
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересобирать ленты, счётчики и поисковый индекс.',
+        )
+
+    def handle(self, *args, **options):
+        refuse_sharded()
+        checkpoint = options['checkpoint'] or f'{options["input"]}.checkpoint'
+        state = load_checkpoint(checkpoint)
+        if state and not options['resume']:
+            raise CommandError(
+                f'Есть контрольная точка {checkpoint}: добавьте --resume '
+                f'или удалите её.'
+            )
+        if options['resume'] and not state:
+            raise CommandError(f'Контрольная точка {checkpoint} не найдена.')
+        self.user_ids = {}
+        self.group_ids = {}
+        self.loaded = dict(state['loaded']) if state else dict.fromkeys(
+            SECTIONS, 0)
+        self.skipped = dict(state['skipped']) if state else dict.fromkeys(
+            SECTIONS, 0)
+        self.renumbered = dict(state['renumbered']) if state else {
+            'post': 0, 'comment': 0}
+        # id поста в файле -> id в базе, где они различаются.
+        self.post_ids = {
+            int(source): target
+            for source, target in state['post_ids'].items()
+        } if state else {}
+        batch = []
+        with open(options['input'], 'rb') as stream:
+            if state:
+                stream.seek(state['offset'])
+            line_number = state['lines'] if state else 0
+            for line_number, record in self.records(stream, line_number):
+                batch.append(record)
+                if len(batch) >= options['batch_size']:
+                    self.flush(batch)
+                    batch = []
+                    self.save(checkpoint, stream.tell(), line_number)
+            self.flush(batch)
+        self.reset_sequences()
+        if not options['skip_derived']:
+            counters.recount_all()
+            search.rebuild()
+            timeline.rebuild()
+        cache.clear()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(', '.join(
+            f'{name}: {count}' for name, count in self.loaded.items()
+        ))
+        self.stdout.write('Уже были в базе: ' + ', '.join(
+            f'{name}: {count}' for name, count in self.skipped.items()
+        ))
+        self.stdout.write('Новые id из-за занятых: ' + ', '.join(
+            f'{name}: {count}' for name, count in self.renumbered.items()
+        ))
+
+    def records(self, stream, line_number):
+        """(номер строки, запись) для оставшихся строк файла."""
+        for line in iter(stream.readline, b''):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise CommandError(f'Строка {line_number}: это не JSON.')
+            if record.get('model') not in SECTIONS:
+                raise CommandError(
+                    f'Строка {line_number}: неизвестная модель '
+                    f'{record.get("model")!r}.'
+                )
+            yield line_number, record
+
+    def save(self, checkpoint, offset, lines):
+        save_checkpoint(checkpoint, {
+            'offset': offset,
+            'lines': lines,
+            'loaded': self.loaded,
+            'skipped': self.skipped,
+            'renumbered': self.renumbered,
+            'post_ids': self.post_ids,
+        })
+
+    def flush(self, batch):
+        """Пишет пачку одной транзакцией: группы, посты, комментарии,
+        подписки - в порядке ссылок между ними."""
+        if not batch:
+            return
+        sections = {name: [] for name in SECTIONS}
+        for record in batch:
+            sections[record['model']].append(record)
+        with transaction.atomic():
+            self.resolve_users(
+                record[field] for record in batch
+                for field in ('author', 'user') if field in record
+            )
+            self.insert(Group, 'group', GROUP_KEY, [
+                Group(
+                    title=record['title'],
+                    slug=record['slug'],
+                    description=record['description'],
+                )
+                for record in sections['group']
+            ])
+            self.resolve_groups(
+                record['group'] for record in sections['post']
+                if record['group']
+            )
+            fields = [Post._meta.get_field('pub_date'),
+                      Post._meta.get_field('modified'),
+                      Comment._meta.get_field('created')]
+            with manual_dates(*fields):
+                self.insert_numbered(Post, 'post', POST_KEY, [
+                    Post(
+                        id=record['id'],
+                        author_id=self.user_ids[record['author']],
+                        group_id=self.group_ids.get(record['group']),
+                        text=record['text'],
+                        image=record['image'],
+                        pub_date=parse_datetime(record['pub_date']),
+                        modified=parse_datetime(record['modified']),
+                    )
+                    for record in sections['post']
+                ])
+                self.insert_numbered(Comment, 'comment', COMMENT_KEY, [
+                    Comment(
+                        id=record['id'],
+                        post_id=self.post_ids.get(
+                            record['post'], record['post']),
+                        author_id=self.user_ids[record['author']],
+                        text=record['text'],
+                        created=parse_datetime(record['created']),
+                    )
+                    for record in sections['comment']
+                ])
+            self.insert(Follow, 'follow', FOLLOW_KEY, [
+                Follow(
+                    user_id=self.user_ids[record['user']],
+                    author_id=self.user_ids[record['author']],
+                )
+                for record in sections['follow']
+            ])
+
+    def existing(self, model, key, objects):
+        """{значения key: id} записей базы с теми же key, что у objects."""
+        field = key[0]
+        values = list({getattr(obj, field) for obj in objects})
+        found = {}
+        for chunk in chunks(values):
+            found.update(
+                (tuple(row[1:]), row[0])
+                for row in model.objects.order_by().filter(**{
+                    f'{field}__in': chunk
+                }).values_list('pk', *key)
+            )
+        return found
+
+    def insert(self, model, name, key, objects):
+        # Повтор пачки после сбоя не создаёт дублей.
+        loaded = self.existing(model, key, objects)
+        fresh = {}
+        for obj in objects:
+            values = tuple(getattr(obj, field) for field in key)
+            if values not in loaded:
+                fresh.setdefault(values, obj)
+        model.objects.bulk_create(fresh.values())
+        self.loaded[name] += len(fresh)
+        self.skipped[name] += len(objects) - len(fresh)
+
+    def insert_numbered(self, model, name, key, objects):
+        """Вставляет записи с id из файла, сверяя их с базой по key.
+
+        Запись с тем же key уже загружена и пропускается. Если id занят
+        другой записью, новая получает свободный id; для постов замена
+        запоминается в post_ids.
+        """
+        if not objects:
+            return
+
+        def values(obj):
+            return tuple(getattr(obj, field) for field in key)
+
+        loaded = self.existing(model, key, objects)
+        taken = set()
+        ids = [obj.pk for obj in objects]
+        for chunk in chunks(ids):
+            taken.update(model.objects.filter(
+                pk__in=chunk
+            ).values_list('pk', flat=True))
+        pending = set(ids)
+        free = (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        fresh = []
+        for obj in objects:
+            source = obj.pk
+            if values(obj) in loaded:
+                obj.pk = loaded[values(obj)]
+                self.skipped[name] += 1
+            else:
+                if obj.pk in taken:
+                    # Не занимать и id, которые ждут записи этой пачки.
+                    while free in taken or free in pending:
+                        free += 1
+                    obj.pk = free
+                    self.renumbered[name] += 1
+                taken.add(obj.pk)
+                loaded[values(obj)] = obj.pk
+                fresh.append(obj)
+            if model is Post and obj.pk != source:
+                self.post_ids[source] = obj.pk
+        model.objects.bulk_create(fresh)
+        self.loaded[name] += len(fresh)
+
+    def lookup(self, queryset, field, values):
+        """{значение field: id} для values, запросами по LOOKUP_CHUNK."""
+        found = {}
+        for chunk in chunks(list(values)):
+            found.update(queryset.filter(
+                **{f'{field}__in': chunk}
+            ).values_list(field, 'id'))
+        return found
+
+    def resolve_users(self, usernames):
+        missing = set(usernames) - set(self.user_ids)
+        if not missing:
+            return
+        self.user_ids.update(self.lookup(User.objects, 'username', missing))
+        missing -= set(self.user_ids)
+        if missing:
+            User.objects.bulk_create(
+                User(username=username, password='!')
+                for username in sorted(missing)
+            )
+            self.user_ids.update(
+                self.lookup(User.objects, 'username', missing)
+            )
+
+    def resolve_groups(self, slugs):
+        missing = set(slugs) - set(self.group_ids)
+        if not missing:
+            return
+        self.group_ids.update(self.lookup(Group.objects, 'slug', missing))
+        unknown = missing - set(self.group_ids)
+        if unknown:
+            raise CommandError(f'Нет групп: {", ".join(sorted(unknown))}')
+
+    def reset_sequences(self):
+        """После вставки с явными id счётчики автоинкремента отстают."""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Group, Post, Comment, Follow, User]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
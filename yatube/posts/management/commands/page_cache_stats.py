@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts import caching, views  # noqa: F401 регистрирует представления
+
+
+class Command(BaseCommand):
+    help = (
+        'Попадания, промахи и обходы кеша публичных страниц, размер '
+        'записанных страниц и сколько байт сэкономило сжатие.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', help='Обнулить счётчики.'
+        )
+
+    def handle(self, *args, **options):
+        prefixes = caching.PAGE_PREFIXES
+        stats = caching.page_cache_stats(prefixes)
+        self.stdout.write(
+            f'{"страница":<14} {"hit":>8} {"stale":>8} {"miss":>8} '
+            f'{"bypass":>8} {"доля hit":>9} {"байт":>10} {"сэкономлено":>12}'
+        )
+        for prefix, counts in stats.items():
+            ratio = '-' if counts['ratio'] is None else counts['ratio']
+            self.stdout.write(
+                f'{prefix:<14} {counts["hit"]:>8} {counts["stale"]:>8} '
+                f'{counts["miss"]:>8} {counts["bypass"]:>8} {ratio:>9} '
+                f'{counts["raw_bytes"]:>10} {counts["saved"]:>12}'
+            )
+        if options['reset']:
+            caching.reset_page_cache_stats(prefixes)
@@ -0,0 +1,124 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from posts import search, sharding
+from posts.models import Comment, Post, PostImageVariant
+from posts.transfer import chunks
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит посты авторов вместе с комментариями к ним на шарды, '
+        'которые назначает posts.sharding.shard_for при текущем '
+        'YATUBE_SHARDS: из default после включения шардирования и между '
+        'шардами после изменения их списка. id сохраняются, повторный '
+        'запуск после сбоя продолжает перенос.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drain', action='append', default=[], metavar='PATH',
+            help='Файл шарда, убранного из YATUBE_SHARDS: его посты тоже '
+                 'переносятся.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать авторов, которые должны переехать.',
+        )
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Шарды не настроены: задайте YATUBE_SHARDS.')
+        sources = [
+            'default', *settings.POST_SHARDS, *self.drained(options['drain'])
+        ]
+        for alias in sources[1:]:
+            sharding.disable_foreign_keys(connections[alias])
+        authors = Counter()
+        moved = Counter()
+        for source in sources:
+            for author_id in self.misplaced(source):
+                target = sharding.shard_for(author_id)
+                authors[source, target] += 1
+                if not options['dry_run']:
+                    moved.update(self.move(source, target, author_id))
+        for (source, target), count in sorted(authors.items()):
+            self.stdout.write(f'{source} -> {target}: авторов {count}')
+        self.stdout.write(
+            f'Перенесено постов: {moved["posts"]}, '
+            f'комментариев: {moved["comments"]}'
+        )
+
+    def drained(self, paths):
+        aliases = []
+        for index, path in enumerate(paths):
+            alias = f'drain_{index}'
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+            }
+            aliases.append(alias)
+        return aliases
+
+    def misplaced(self, source):
+        """Авторы, чьи посты лежат в source, но принадлежат другому шарду."""
+        author_ids = Post._base_manager.using(source).order_by().values_list(
+            'author_id', flat=True).distinct()
+        return [
+            author_id for author_id in author_ids
+            if sharding.shard_for(author_id) != source
+        ]
+
+    def move(self, source, target, author_id):
+        posts = list(Post._base_manager.using(source).filter(
+            author_id=author_id).order_by('pk'))
+        post_ids = [post.pk for post in posts]
+        comments = []
+        variants = []
+        for chunk in chunks(post_ids):
+            comments.extend(Comment._base_manager.using(source).filter(
+                post_id__in=chunk).order_by('pk'))
+            variants.extend(PostImageVariant._base_manager.using(
+                source).filter(post_id__in=chunk).order_by('pk'))
+        for variant in variants:
+            # id вариантов у каждой базы свои.
+            variant.pk = None
+        # Цель фиксируется раньше источника: после сбоя между ними
+        # записи есть в обоих местах, и повторный перенос их пропустит.
+        with transaction.atomic(using=source):
+            with transaction.atomic(using=target):
+                Post._base_manager.db_manager(target).bulk_create(
+                    posts, ignore_conflicts=True)
+                Comment._base_manager.db_manager(target).bulk_create(
+                    comments, ignore_conflicts=True)
+                stored = PostImageVariant._base_manager.db_manager(target)
+                for chunk in chunks(post_ids):
+                    stored.filter(post_id__in=chunk).delete()
+                stored.bulk_create(variants)
+                for post in posts:
+                    search.index_post(post)
+            self.delete(source, post_ids)
+        return {'posts': len(posts), 'comments': len(comments)}
+
+    def delete(self, source, post_ids):
+        """Удаляет посты и всё, что на них ссылается, без сигналов."""
+        opts = Post._meta
+        with connections[source].cursor() as cursor:
+            for chunk in chunks(post_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                for relation in opts.related_objects:
+                    cursor.execute(
+                        f'DELETE FROM {relation.related_model._meta.db_table}'
+                        f' WHERE {relation.field.column} IN ({placeholders})',
+                        chunk
+                    )
+                cursor.execute(
+                    f'DELETE FROM {opts.db_table} '
+                    f'WHERE {opts.pk.column} IN ({placeholders})', chunk
+                )
+                if source == 'default':
+                    for post_id in chunk:
+                        search.unindex_post(post_id)
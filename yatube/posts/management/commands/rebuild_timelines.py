@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок с нуля.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='usernames',
+            help='Пересобрать ленту только этого пользователя.',
+        )
+
+    def handle(self, *args, usernames=None, **options):
+        user_ids = None
+        if usernames:
+            user_ids = list(
+                User.objects.filter(
+                    username__in=usernames
+                ).values_list('id', flat=True)
+            )
+            if len(user_ids) != len(set(usernames)):
+                raise CommandError('Пользователь не найден.')
+        count = timeline.rebuild(user_ids)
+        self.stdout.write(f'Пересобрано подписок: {count}')
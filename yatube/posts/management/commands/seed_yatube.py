@@ -0,0 +1,289 @@
+import bisect
+import datetime
+import itertools
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+
+from posts import counters, search, timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.transfer import manual_dates, refuse_sharded
+
+SENTENCE_POOL = 5000
+GROUPED_SHARE = 0.7
+IMAGE_NAME = 'posts/seed.gif'
+
+
+def zipf_weights(count, exponent):
+    """Накопленные веса рангов 1..count по закону Ципфа."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+@contextmanager
+def fast_sqlite():
+    # Данные можно пересоздать, поэтому fsync на каждую транзакцию не нужен.
+    # Внутри транзакции SQLite не даёт менять этот режим.
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        synchronous = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous = OFF')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными: пользователи, группы, '
+        'посты, подписки со степенным распределением и комментарии. '
+        'При одном и том же --seed данные совпадают. '
+        'С шардированием (YATUBE_SHARDS) не работает.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя.',
+        )
+        parser.add_argument(
+            '--follow-distribution', choices=('zipf', 'uniform'),
+            default='zipf',
+            help='zipf - популярность авторов по закону Ципфа.',
+        )
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument(
+            '--images', type=int, default=0,
+            help='Сколько постов получат крошечную картинку.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--exponent', type=float, default=1.1)
+        parser.add_argument('--days', type=int, default=730)
+        parser.add_argument(
+            '--start', type=datetime.date.fromisoformat,
+            default=datetime.date(2020, 1, 1),
+            help='Дата первого поста, ГГГГ-ММ-ДД.',
+        )
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересобирать ленты, счётчики и поисковый индекс.',
+        )
+
+    def handle(self, *args, **options):
+        refuse_sharded()
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя.')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                f'укажите другой --prefix.'
+            )
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        self.sentences = [
+            self.fake.sentence(nb_words=self.rng.randint(3, 12))
+            for _ in range(SENTENCE_POOL)
+        ]
+        self.options = options
+        self.batch_size = options['batch_size']
+        with fast_sqlite():
+            users = self.step('пользователи', self.seed_users)
+            groups = self.step('группы', self.seed_groups)
+            posts = self.step('посты', self.seed_posts, users, groups)
+            self.step('подписки', self.seed_follows, users)
+            self.step('комментарии', self.seed_comments, users, posts)
+            if not options['skip_derived']:
+                self.step('счётчики', counters.recount_all)
+                self.step('поисковый индекс', search.rebuild)
+                self.step('ленты подписок', timeline.rebuild)
+        cache.clear()
+
+    def step(self, title, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(
+            f'{title}: {time.perf_counter() - start:.1f} с'
+        )
+        return result
+
+    def insert(self, model, rows):
+        """bulk_create пачками, каждая пачка в своей транзакции."""
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+
+    def new_ids(self, model, queryset, create):
+        before = queryset.order_by('-id').values_list('id', flat=True)
+        last = before.first() or 0
+        create()
+        return list(
+            queryset.filter(id__gt=last).order_by('id').values_list(
+                'id', flat=True)
+        )
+
+    def seed_users(self):
+        prefix = self.options['prefix']
+        joined = timezone.make_aware(
+            datetime.datetime.combine(self.options['start'], datetime.time())
+        )
+        return self.new_ids(User, User.objects.all(), lambda: self.insert(
+            User,
+            (
+                User(
+                    username=f'{prefix}_{index}',
+                    first_name=self.fake.first_name(),
+                    last_name=self.fake.last_name(),
+                    password='!',
+                    date_joined=joined,
+                )
+                for index in range(self.options['users'])
+            )
+        ))
+
+    def seed_groups(self):
+        prefix = self.options['prefix']
+        return self.new_ids(Group, Group.objects.all(), lambda: self.insert(
+            Group,
+            (
+                Group(
+                    title=self.fake.catch_phrase()[:200],
+                    slug=f'{prefix}-{index}',
+                    description=self.rng.choice(self.sentences),
+                )
+                for index in range(self.options['groups'])
+            )
+        ))
+
+    def text(self):
+        return ' '.join(
+            self.rng.choices(self.sentences, k=self.rng.randint(1, 5))
+        )
+
+    def pick(self, items, weights):
+        return items[bisect.bisect(weights, self.rng.random() * weights[-1])]
+
+    def seed_posts(self, users, groups):
+        total = self.options['posts']
+        image_name = ''
+        if self.options['images']:
+            image_name = default_storage.save(
+                IMAGE_NAME, ContentFile(settings.SMALL_GIF)
+            )
+        image_every = total / self.options['images'] if (
+            self.options['images']) else None
+        user_weights = zipf_weights(len(users), self.options['exponent'])
+        group_weights = zipf_weights(len(groups) or 1,
+                                     self.options['exponent'])
+        start = timezone.make_aware(
+            datetime.datetime.combine(self.options['start'], datetime.time())
+        )
+        step = datetime.timedelta(days=self.options['days']) / max(total, 1)
+
+        def rows():
+            images = 0
+            for index in range(total):
+                pub_date = start + step * index
+                group_id = None
+                if groups and self.rng.random() < GROUPED_SHARE:
+                    group_id = self.pick(groups, group_weights)
+                image = ''
+                if image_every and index >= images * image_every:
+                    image = image_name
+                    images += 1
+                yield Post(
+                    author_id=self.pick(users, user_weights),
+                    group_id=group_id,
+                    text=self.text(),
+                    image=image,
+                    pub_date=pub_date,
+                    modified=pub_date,
+                )
+
+        fields = [Post._meta.get_field('pub_date'),
+                  Post._meta.get_field('modified')]
+        with manual_dates(*fields):
+            return self.new_ids(
+                Post, Post.objects.all(), lambda: self.insert(Post, rows())
+            )
+
+    def seed_follows(self, users):
+        average = self.options['follows']
+        # Популярность не связана с тем, сколько автор пишет.
+        ranked = list(users)
+        self.rng.shuffle(ranked)
+        if self.options['follow_distribution'] == 'zipf':
+            weights = zipf_weights(len(users), self.options['exponent'])
+        else:
+            # Равные веса в накопленном виде.
+            weights = list(range(1, len(users) + 1))
+        wanted = min(average, len(users) - 1)
+
+        def rows():
+            for user_id in users:
+                count = self.rng.randint(0, 2 * wanted)
+                count = min(count, len(users) - 1)
+                authors = set()
+                attempts = count * 10
+                while len(authors) < count and attempts:
+                    attempts -= 1
+                    author_id = self.pick(ranked, weights)
+                    if author_id != user_id:
+                        authors.add(author_id)
+                for author_id in sorted(authors):
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        self.insert(Follow, rows())
+
+    def seed_comments(self, users, posts):
+        if not posts:
+            return
+        weights = zipf_weights(len(posts), self.options['exponent'])
+        start = self.options['start']
+        span = self.options['days'] * 24 * 60 * 60
+
+        def rows():
+            for _ in range(self.options['comments']):
+                # Чаще обсуждают свежие посты.
+                post_index = len(posts) - 1 - bisect.bisect(
+                    weights, self.rng.random() * weights[-1]
+                )
+                offset = span * post_index / len(posts)
+                offset += self.rng.uniform(0, 3 * 24 * 60 * 60)
+                created = timezone.make_aware(
+                    datetime.datetime.combine(start, datetime.time())
+                ) + datetime.timedelta(seconds=offset)
+                yield Comment(
+                    post_id=posts[post_index],
+                    author_id=self.rng.choice(users),
+                    text=self.rng.choice(self.sentences)[:200],
+                    created=created,
+                )
+
+        with manual_dates(Comment._meta.get_field('created')):
+            self.insert(Comment, rows())
@@ -0,0 +1,201 @@
+"""Полнотекстовый поиск по постам.
+
+На SQLite со сборкой FTS5 текст постов хранится в виртуальной таблице
+FTS_TABLE (rowid совпадает с id поста), релевантность считает bm25.
+Без FTS5 используется своя таблица слов SearchPosting, а релевантность
+считается как сумма tf * idf слов запроса. Оба движка добавляют к
+релевантности свежесть поста и отдают queryset с полем search_score.
+
+При шардировании строки SearchPosting лежат на шарде поста, idf
+считается по всем шардам, а страница поиска сливает их выдачу.
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from . import sharding
+from .models import Post, SearchPosting
+
+FTS_TABLE = 'posts_post_fts'
+SEARCH_ORDERING = ('-search_score', '-id')
+TERM_LENGTH = SearchPosting._meta.get_field('term').max_length
+BATCH_SIZE = 1000
+
+_fts_tables = {}
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре."""
+    return [word[:TERM_LENGTH] for word in re.findall(r'\w+', text.lower())]
+
+
+def fts_available():
+    """Есть ли в текущей базе таблица FTS5 для постов."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE type = 'table' AND name = %s",
+                [FTS_TABLE]
+            )
+            _fts_tables[name] = cursor.fetchone() is not None
+    return _fts_tables[name]
+
+
+def use_fts():
+    # Таблицу FTS5 миграция создаёт только в default.
+    if sharding.enabled():
+        return False
+    if settings.SEARCH_BACKEND == 'auto':
+        return fts_available()
+    return settings.SEARCH_BACKEND == 'fts'
+
+
+def index_post(post):
+    """Обновляет запись поста в поисковом индексе."""
+    if use_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk]
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+                [post.pk, post.text]
+            )
+        return
+    postings = SearchPosting.objects.using(post._state.db)
+    postings.filter(post_id=post.pk).delete()
+    postings.bulk_create(_postings(post.pk, post.text))
+
+
+def unindex_post(post_id):
+    """Удаляет пост из индекса; строки SearchPosting удалит каскад.
+
+    Таблица FTS5 чистится, даже если поиск идёт не по ней: иначе после
+    переноса постов на шарды в ней остались бы их строки.
+    """
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id]
+            )
+
+
+def _postings(post_id, text):
+    return [
+        SearchPosting(post_id=post_id, term=term, count=count)
+        for term, count in Counter(tokenize(text)).items()
+    ]
+
+
+def rebuild():
+    """Перестраивает индекс активного движка по всем постам."""
+    if use_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) '
+                f'SELECT id, text FROM {Post._meta.db_table}'
+            )
+        return
+    for alias in sharding.post_databases():
+        postings = SearchPosting.objects.using(alias)
+        postings.all().delete()
+        batch = []
+        rows = Post.objects.using(alias).order_by().values_list('id', 'text')
+        for post_id, text in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.extend(_postings(post_id, text))
+            if len(batch) >= BATCH_SIZE:
+                postings.bulk_create(batch)
+                batch = []
+        postings.bulk_create(batch)
+
+
+def _recency():
+    # Дни от начала эпохи, переведённые в годы.
+    if connection.vendor != 'sqlite':
+        return Value(0.0, output_field=FloatField())
+    table = Post._meta.db_table
+    return RawSQL(
+        f'%s * (julianday({table}.pub_date) - 2440587.5) / 365.25',
+        [settings.SEARCH_RECENCY_WEIGHT],
+        output_field=FloatField()
+    )
+
+
+def _fts_search(queryset, terms):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    table = Post._meta.db_table
+    relevance = RawSQL(
+        f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+        [match],
+        output_field=FloatField()
+    )
+    # RawSQL в pk__in дал бы IN ((SELECT ...)), а это одно значение.
+    queryset = queryset.extra(
+        where=[
+            f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[match]
+    )
+    return queryset, relevance
+
+
+def _term_postings(term):
+    # Диапазон вместо LIKE, чтобы поиск по префиксу шёл по индексу.
+    return SearchPosting.objects.filter(
+        term__gte=term, term__lt=term + '\uffff'
+    )
+
+
+def _index_search(queryset, terms):
+    databases = sharding.post_databases()
+    total = sum(
+        Post.objects.using(alias).count() for alias in databases
+    ) or 1
+    relevance = Value(0.0, output_field=FloatField())
+    for term in terms:
+        postings = _term_postings(term)
+        queryset = queryset.filter(pk__in=postings.values('post_id'))
+        found = sum(
+            postings.using(alias).values('post_id').distinct().count()
+            for alias in databases
+        )
+        idf = math.log(1 + (total - found + 0.5) / (found + 0.5))
+        frequency = Subquery(
+            postings.filter(post_id=OuterRef('pk')).values(
+                'post_id').annotate(total=Sum('count')).values('total'),
+            output_field=FloatField()
+        )
+        relevance = relevance + Coalesce(frequency, 0.0) * idf
+    return queryset, relevance
+
+
+def search_posts(query, queryset=None):
+    """Посты, подходящие под все слова запроса, с оценкой search_score.
+
+    Каждое слово запроса ищется как префикс слова поста.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return queryset.none().annotate(
+            search_score=Value(0.0, output_field=FloatField())
+        )
+    if use_fts():
+        queryset, relevance = _fts_search(queryset, terms)
+    else:
+        queryset, relevance = _index_search(queryset, terms)
+    return queryset.annotate(search_score=relevance + _recency())
@@ -0,0 +1,228 @@
+"""Горизонтальное шардирование постов и комментариев по автору.
+
+Если settings.POST_SHARDS не пуст, посты автора и комментарии к ним
+лежат на шарде shard_for(author_id), остальные таблицы - в default.
+Шард выбирает jump consistent hash: при добавлении шарда на новый
+переезжает лишь доля авторов 1/N, остальные остаются на месте. Чтобы
+id не пересекались между шардами, их выдаёт ShardSequence в default.
+
+Лента одного автора читается с одного шарда, ленты многих авторов
+(главная, группа, подписки) - опросом нужных шардов и слиянием кучей
+по (pub_date, id), см. utils.ShardedPaginator. Пост по id ищется
+на всех шардах по очереди.
+
+В этом режиме не ведутся ленты TimelineEntry: лента подписок читается
+с шардов напрямую. Поисковый индекс SearchPosting и варианты картинок
+PostImageVariant лежат на шарде поста. Удаление в default
+не видит записей на шардах, поэтому связи удаляемых пользователя или
+группы с ними обрабатывает delete_related. Команда rebalance_shards
+переносит посты авторов на их шарды: из default при включении и между
+шардами после изменения списка.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Max, prefetch_related_objects
+
+SHARDED_MODELS = ('post', 'comment', 'postimagevariant')
+POST_RELATED = ('author', 'group')
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def post_databases():
+    """Базы, в которых лежат посты."""
+    return list(settings.POST_SHARDS) or ['default']
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping, Veach): корзина ключа из buckets."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) % 2 ** 64
+        candidate = int((bucket + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(author_id):
+    shards = settings.POST_SHARDS
+    return shards[jump_hash(author_id, len(shards))]
+
+
+def shards_for(author_ids=None):
+    """Шарды с постами авторов author_ids, None - все шарды."""
+    if author_ids is None:
+        return list(settings.POST_SHARDS)
+    return sorted({shard_for(author_id) for author_id in author_ids})
+
+
+def is_sharded(model):
+    """Лежат ли на шардах записи модели (или экземпляра) model."""
+    opts = model._meta
+    return opts.app_label == 'posts' and opts.model_name in SHARDED_MODELS
+
+
+def locate(post_id):
+    """Шард, на котором лежит пост, или None."""
+    post_model = apps.get_model('posts', 'Post')
+    for alias in settings.POST_SHARDS:
+        if post_model._base_manager.using(alias).filter(pk=post_id).exists():
+            return alias
+    return None
+
+
+def home(instance):
+    """Шард, на котором лежит или должна лежать запись instance."""
+    state = instance._state
+    if not state.adding and state.db in settings.POST_SHARDS:
+        return state.db
+    opts = instance._meta
+    if opts.label == settings.AUTH_USER_MODEL:
+        return shard_for(instance.pk)
+    if not is_sharded(instance):
+        return None
+    if opts.model_name == 'post':
+        return shard_for(instance.author_id)
+    if not instance._meta.get_field('post').is_cached(instance):
+        return locate(instance.post_id)
+    post = instance.post
+    if not post._state.adding and post._state.db in settings.POST_SHARDS:
+        return post._state.db
+    return shard_for(post.author_id)
+
+
+class ShardRouter:
+    """Посты и комментарии - на шард автора поста, остальное - дальше.
+
+    Запрос без записи-подсказки (Post.objects.filter(...)) шард не
+    выбирает и уходит в default: ленты многих авторов указывают
+    шарды через using().
+    """
+
+    def _route(self, model, instance):
+        if not enabled() or instance is None or not is_sharded(model):
+            return None
+        if model._meta.model_name == 'comment' and not is_sharded(instance):
+            # Комментарии пользователя разбросаны по шардам.
+            return None
+        return home(instance)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints.get('instance'))
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in settings.POST_SHARDS:
+            return None
+        # Таблицы posts целиком, чтобы каскадное удаление поста находило
+        # связанные таблицы; RunPython и RunSQL работают только в default.
+        return app_label == 'posts' and model_name is not None
+
+
+def disable_foreign_keys(connection):
+    """Авторы и группы лежат в default: ссылки на них шард не проверит.
+
+    migrate включает проверку обратно, поэтому команды, которые пишут
+    на шарды, вызывают это и сами.
+    """
+    connection.ensure_connection()
+    connection.connection.execute('PRAGMA foreign_keys = OFF')
+
+
+def _shard_connected(sender, connection, **kwargs):
+    if connection.alias in settings.POST_SHARDS:
+        disable_foreign_keys(connection)
+
+
+connection_created.connect(_shard_connected)
+
+
+def delete_related(instance):
+    """Применяет on_delete ссылок на instance к постам и комментариям шардов.
+
+    Каскад Django идёт по базе удаляемой записи, то есть по default.
+    """
+    for model_name in SHARDED_MODELS:
+        model = apps.get_model('posts', model_name)
+        for field in model._meta.concrete_fields:
+            if field.related_model is not type(instance):
+                continue
+            for alias in settings.POST_SHARDS:
+                rows = model._base_manager.using(alias).filter(
+                    **{field.name: instance})
+                if field.remote_field.on_delete is models.SET_NULL:
+                    rows.update(**{field.name: None})
+                else:
+                    rows.delete()
+
+
+def next_id(model):
+    """Следующий id записи model, общий для всех шардов.
+
+    UPDATE и SELECT в одной транзакции вместо RETURNING: тот появился
+    только в SQLite 3.35.
+    """
+    sequence = apps.get_model('posts', 'ShardSequence')._meta.db_table
+    name = model._meta.db_table
+    increment = f'UPDATE {sequence} SET value = value + 1 WHERE name = %s'
+    with transaction.atomic(using='default'), \
+            connections['default'].cursor() as cursor:
+        cursor.execute(increment, [name])
+        if cursor.rowcount == 0:
+            start = max(
+                model._base_manager.using(alias).aggregate(
+                    top=Max('pk'))['top'] or 0
+                for alias in ['default', *settings.POST_SHARDS]
+            )
+            cursor.execute(
+                f'INSERT INTO {sequence} (name, value) VALUES (%s, %s) '
+                f'ON CONFLICT (name) DO NOTHING', [name, start]
+            )
+            cursor.execute(increment, [name])
+        cursor.execute(
+            f'SELECT value FROM {sequence} WHERE name = %s', [name]
+        )
+        return cursor.fetchone()[0]
+
+
+def with_related(queryset, *fields):
+    """select_related, а на шардах prefetch_related: JOIN с default нет."""
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+class ShardManager(models.Manager):
+    """Запросы к постам с учётом шардов."""
+
+    def create(self, **kwargs):
+        """Создаёт пост там, куда его направит роутер: на шард автора.
+
+        Post.objects.create пишет в базу менеджера, то есть в default.
+        """
+        post = self.model(**kwargs)
+        post.save(force_insert=True)
+        return post
+
+    def for_author(self, author_id):
+        queryset = self.filter(author_id=author_id)
+        if enabled():
+            queryset = queryset.using(shard_for(author_id))
+        return queryset
+
+    def find(self, pk):
+        """Пост с автором и группой или None."""
+        if not enabled():
+            return self.select_related(*POST_RELATED).filter(pk=pk).first()
+        for alias in settings.POST_SHARDS:
+            post = self.using(alias).filter(pk=pk).first()
+            if post is not None:
+                prefetch_related_objects([post], *POST_RELATED)
+                return post
+        return None
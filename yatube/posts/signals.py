@@ -0,0 +1,134 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import (caching, counters, feed, search, sharding, thumbnails,
+               timeline)
+from .models import Comment, Follow, Group, Post, User
+
+
+def image_name(post):
+    image = post.__dict__.get('image')
+    return getattr(image, 'name', image) or ''
+
+
+@receiver(post_init, sender=Post)
+def post_remember_loaded(sender, instance, **kwargs):
+    # Через __dict__, чтобы не подгружать отложенные (only/defer) поля.
+    instance._loaded_group_id = instance.__dict__.get('group_id')
+    instance._loaded_image = image_name(instance)
+
+
+@receiver(pre_save, sender=Post)
+def post_image_changed(sender, instance, **kwargs):
+    if image_name(instance) != instance._loaded_image:
+        instance.image_ready = False
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def shard_assign_id(sender, instance, **kwargs):
+    if instance.pk is None and sharding.enabled():
+        instance.pk = sharding.next_id(sender)
+
+
+@receiver(post_save, sender=Post)
+def post_fan_out(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(instance.author_id, 'posts_count', 1)
+        feed.forget_recent_posts(instance.author_id)
+        if not sharding.enabled():
+            timeline.fan_out(instance)
+    scopes = caching.post_scopes(instance)
+    loaded_group_id = instance._loaded_group_id
+    if loaded_group_id and loaded_group_id != instance.group_id:
+        slug = Group.objects.filter(pk=loaded_group_id).values_list(
+            'slug', flat=True).first()
+        if slug:
+            scopes.append(caching.group_scope(slug))
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_image = image_name(instance)
+    caching.bump(*scopes)
+    search.index_post(instance)
+    if instance.image and not instance.image_ready:
+        using = instance._state.db
+        transaction.on_commit(
+            lambda: thumbnails.schedule(instance.pk, using), using=using
+        )
+
+
+@receiver(post_delete, sender=Post)
+def post_forget(sender, instance, **kwargs):
+    counters.bump(instance.author_id, 'posts_count', -1)
+    feed.forget_recent_posts(instance.author_id)
+    search.unindex_post(instance.pk)
+    caching.bump(*caching.post_scopes(instance))
+
+
+@receiver(post_save, sender=Comment)
+def comment_count(sender, instance, created, using, **kwargs):
+    if created:
+        counters.bump_comments(instance.post_id, 1, using)
+        caching.bump(*caching.post_scopes(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_uncount(sender, instance, using, **kwargs):
+    counters.bump_comments(instance.post_id, -1, using)
+    post = Post.shards.find(instance.post_id)
+    if post is not None:
+        caching.bump(*caching.post_scopes(post))
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Group)
+def shard_delete_related(sender, instance, **kwargs):
+    if sharding.enabled():
+        sharding.delete_related(instance)
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    caching.bump(
+        caching.group_scope(instance.slug),
+        caching.group_card_scope(instance.pk),
+    )
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    # Вход пользователя сохраняет только last_login.
+    if created or update_fields == frozenset(['last_login']):
+        return
+    caching.bump(caching.author_card_scope(instance.pk))
+
+
+def follow_scopes(follow):
+    return (
+        caching.author_scope(follow.author.username),
+        caching.author_scope(follow.user.username),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_backfill(sender, instance, created, **kwargs):
+    if created:
+        counters.bump(instance.author_id, 'followers_count', 1)
+        counters.bump(instance.user_id, 'following_count', 1)
+        caching.bump(*follow_scopes(instance))
+        if sharding.enabled():
+            return
+        timeline.followers_changed(instance.author_id, 1)
+        if not timeline.is_celebrity(instance.author_id):
+            timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_trim(sender, instance, **kwargs):
+    counters.bump(instance.author_id, 'followers_count', -1)
+    counters.bump(instance.user_id, 'following_count', -1)
+    caching.bump(*follow_scopes(instance))
+    if not sharding.enabled():
+        timeline.trim(instance.user_id, instance.author_id)
+        timeline.followers_changed(instance.author_id, -1)
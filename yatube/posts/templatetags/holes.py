@@ -0,0 +1,14 @@
+from django import template
+
+from posts.holes import marker, punching, render_hole
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **arguments):
+    """Метка дырки на общей странице или её содержимое на обычной."""
+    request = context['request']
+    if punching(request):
+        return marker(name, arguments)
+    return render_hole(request, name, arguments)
@@ -0,0 +1,66 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from posts.caching import author_card_scope, generations, group_card_scope
+from posts.thumbnails import prefetch_thumbnails
+
+register = template.Library()
+
+CARD_TEMPLATE = 'includes/article.html'
+CARD_KEY = (
+    'card:{id}:{modified}:{comments}:{image}:{variant}:{author}:{group}'
+)
+
+
+def card_scopes(post):
+    """Области, поколения которых входят в ключ карточки: в ней имя
+    автора и название группы, а modified поста при их правке прежний."""
+    scopes = [author_card_scope(post.author_id)]
+    if post.group_id:
+        scopes.append(group_card_scope(post.group_id))
+    return scopes
+
+
+def card_key(post, is_not_group, versions):
+    return CARD_KEY.format(
+        id=post.id,
+        modified=post.modified.timestamp(),
+        comments=post.comments_count,
+        image=int(post.image_ready),
+        variant=int(bool(is_not_group)),
+        author=versions[author_card_scope(post.author_id)],
+        group=versions.get(group_card_scope(post.group_id), ''),
+    )
+
+
+@register.simple_tag
+def post_cards(posts, is_not_group=False):
+    """Возвращает HTML карточек постов, беря готовые из кеша.
+
+    Кеш читается одним get_many на страницу (и одним - поколения
+    авторов и групп), шаблон карточки
+    рендерится только для отсутствующих в кеше постов, а их миниатюры
+    разрешаются одним пакетным запросом.
+    """
+    posts = list(posts)
+    versions = generations(
+        {scope for post in posts for scope in card_scopes(post)}
+    )
+    keys = [card_key(post, is_not_group, versions) for post in posts]
+    cards = cache.get_many(keys)
+    missing = {}
+    card_template = get_template(CARD_TEMPLATE)
+    prefetch_thumbnails(
+        [post for key, post in zip(keys, posts) if key not in cards]
+    )
+    for key, post in zip(keys, posts):
+        if key not in cards:
+            cards[key] = missing[key] = card_template.render(
+                {'post': post, 'is_not_group': is_not_group}
+            )
+    if missing:
+        cache.set_many(missing, settings.CARD_CACHE_TIMEOUT)
+    return [mark_safe(cards[key]) for key in keys]
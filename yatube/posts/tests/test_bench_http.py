@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from posts.models import Comment
+
+
+class BenchHttpCommandTest(TestCase):
+    def test_requires_data(self):
+        with self.assertRaises(CommandError):
+            call_command('bench_http', requests=1, stdout=StringIO())
+
+    def test_in_process_run(self):
+        """Смесь запросов проходит без ошибок, сессии удаляются."""
+        call_command(
+            'seed_yatube', users=10, posts=50, groups=3, comments=20,
+            follows=3, stdout=StringIO(),
+        )
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        comments = Comment.objects.count()
+        out = StringIO()
+        call_command(
+            'bench_http', requests=60, warmup=0, concurrency=1, users=2,
+            json=path, stdout=out,
+        )
+        with open(path) as file:
+            report = json.load(file)
+        self.assertEqual(report['requests'], 60)
+        for name, view in report['views'].items():
+            with self.subTest(name=name):
+                self.assertEqual(view['errors'], 0)
+                self.assertIsNotNone(view['queries'])
+        added = report['views'].get('add_comment', {}).get('requests', 0)
+        self.assertEqual(Comment.objects.count(), comments + added)
+        self.assertFalse(Session.objects.exists())
+        self.assertIn('Запросов в секунду', out.getvalue())
@@ -0,0 +1,158 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import get_resolver, reverse
+
+from core.testing import query_budget
+from posts import counters, search, timeline
+from posts.models import (Comment, Follow, Group, Post, PostImageVariant,
+                          User)
+
+POSTS_COUNT = 50
+COMMENTS_COUNT = 200
+FOLLOWS_COUNT = 100
+
+# Имя URL: (запросов к базе, обращений к кешу) при пустом кеше.
+BUDGETS = {
+    'posts:index': (4, 30),
+    'posts:group_list': (6, 38),
+    'posts:user': (8, 38),
+    'posts:search': (4, 30),
+    'posts:post_detail': (7, 29),
+    'posts:post_comments': (2, 0),
+    'posts:post_create': (5, 0),
+    'posts:post_edit': (4, 0),
+    'posts:add_comment': (9, 8),
+    'posts:follow_index': (5, 26),
+    'posts:profile_follow': (12, 6),
+    'posts:profile_unfollow': (14, 4),
+}
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов страниц не растёт вместе с данными."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='group',
+            description='Описание',
+        )
+        User.objects.bulk_create(
+            User(username=f'followed_{i}') for i in range(FOLLOWS_COUNT - 1)
+        )
+        authors = [cls.author] + list(
+            User.objects.filter(username__startswith='followed_')
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.reader, author=author) for author in authors
+        )
+        Post.objects.bulk_create(
+            Post(
+                author=authors[i % 5],
+                group=cls.group,
+                text=f'Пост про море {i}',
+                image=f'posts/image_{i}.jpg',
+                image_ready=True,
+            )
+            for i in range(POSTS_COUNT)
+        )
+        posts = list(Post.objects.all())
+        PostImageVariant.objects.bulk_create(
+            PostImageVariant(
+                post=post,
+                width=width,
+                height=width // 3,
+                format=image_format,
+                name=f'cache/{post.id}_{width}.{image_format.lower()}',
+                size=width * 10,
+            )
+            for post in posts
+            for image_format in ('WEBP', 'JPEG')
+            for width in (320, 640, 960)
+        )
+        cls.post = posts[0]
+        Comment.objects.bulk_create(
+            Comment(
+                post=cls.post,
+                author=authors[i % FOLLOWS_COUNT],
+                text=f'Комментарий {i}',
+            )
+            for i in range(COMMENTS_COUNT)
+        )
+        cls.other = authors[-1]
+        counters.recount_all()
+        search.rebuild()
+        timeline.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def requests(self):
+        """Имя URL -> (клиент, метод, адрес, данные)."""
+        post_id = self.post.id
+        return {
+            'posts:index': (self.reader_client, 'get',
+                            reverse('posts:index'), None),
+            'posts:group_list': (
+                self.reader_client, 'get',
+                reverse('posts:group_list', args=[self.group.slug]), None),
+            'posts:user': (
+                self.reader_client, 'get',
+                reverse('posts:user', args=[self.author.username]), None),
+            'posts:search': (self.reader_client, 'get',
+                             reverse('posts:search'), {'q': 'море'}),
+            'posts:post_detail': (
+                self.reader_client, 'get',
+                reverse('posts:post_detail', args=[post_id]), None),
+            'posts:post_comments': (
+                self.reader_client, 'get',
+                reverse('posts:post_comments', args=[post_id]), None),
+            'posts:post_create': (self.author_client, 'get',
+                                  reverse('posts:post_create'), None),
+            'posts:post_edit': (
+                self.author_client, 'get',
+                reverse('posts:post_edit', args=[post_id]), None),
+            'posts:add_comment': (
+                self.reader_client, 'post',
+                reverse('posts:add_comment', args=[post_id]),
+                {'text': 'Ещё комментарий'}),
+            'posts:follow_index': (self.reader_client, 'get',
+                                   reverse('posts:follow_index'), None),
+            'posts:profile_follow': (
+                self.author_client, 'get',
+                reverse('posts:profile_follow', args=[self.other.username]),
+                None),
+            'posts:profile_unfollow': (
+                self.reader_client, 'get',
+                reverse('posts:profile_unfollow', args=[self.other.username]),
+                None),
+        }
+
+    def test_budgets_cover_all_urls(self):
+        """У каждого URL приложения posts есть бюджет."""
+        resolver = get_resolver()
+        names = {
+            f'posts:{name}'
+            for name in resolver.namespace_dict['posts'][1].reverse_dict
+            if isinstance(name, str)
+        }
+        self.assertEqual(set(BUDGETS), names)
+        self.assertEqual(set(self.requests()), names)
+
+    def test_views_fit_budgets(self):
+        """Страницы укладываются в бюджет запросов и обращений к кешу."""
+        for name, (client, method, url, data) in self.requests().items():
+            queries, cache_calls = BUDGETS[name]
+            with self.subTest(name=name):
+                cache.clear()
+                with query_budget(queries, cache_calls, label=name):
+                    response = getattr(client, method)(url, data or {})
+                self.assertLess(response.status_code, 400)
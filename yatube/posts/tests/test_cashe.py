@@ -1,8 +1,18 @@
-from ..models import Post, User, Group
-from django.test import TestCase, Client
+import gzip
+import threading
+import time
+from io import StringIO
+
+from ..models import Comment, Post, User, Group
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.cache import cache
 
+from ..caching import (LOCK_KEY, PAGE_PREFIXES, author_scope, bump,
+                       page_cache_stats, reset_page_cache_stats,
+                       single_flight)
+
 
 class PostCacheTests(TestCase):
     @classmethod
@@ -24,15 +34,261 @@ class PostCacheTests(TestCase):
             text='test text',
             group=self.group
         )
+        self.feed_urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:user', kwargs={'username': self.user.username}),
+        )
 
     def test_index_cache(self):
         """Проверяем, что индексная страница кешируется"""
-        first_view = self.authorized_client.get(reverse('posts:index'))
-        post_1 = Post.objects.get(pk=1)
-        post_1.text = 'changed text'
-        post_1.save()
-        second_view = self.authorized_client.get(reverse('posts:index'))
+        guest_client = Client()
+        first_view = guest_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='changed text')
+        second_view = guest_client.get(reverse('posts:index'))
         self.assertEqual(first_view.content, second_view.content)
         cache.clear()
-        third_view = self.authorized_client.get(reverse('posts:index'))
+        third_view = guest_client.get(reverse('posts:index'))
         self.assertNotEqual(first_view.content, third_view.content)
+
+    def test_feed_cache_hits(self):
+        """Повторные запросы лент обслуживаются из кеша без запросов к БД."""
+        guest_client = Client()
+        for url in self.feed_urls:
+            with self.subTest(url=url):
+                guest_client.get(url)
+                for _ in range(5):
+                    with self.assertNumQueries(0):
+                        response = guest_client.get(url)
+                    self.assertContains(response, 'test text')
+
+    def test_feed_cache_fresh_after_write(self):
+        """Запись поста или комментария сразу видна на всех лентах."""
+        guest_client = Client()
+        for url in self.feed_urls:
+            guest_client.get(url)
+        self.post.text = 'changed text'
+        self.post.save()
+        for url in self.feed_urls:
+            with self.subTest(url=url):
+                self.assertContains(guest_client.get(url), 'changed text')
+        Comment.objects.create(post=self.post, author=self.user, text='ок')
+        for url in self.feed_urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    guest_client.get(url), 'Комментариев: 1'
+                )
+        new_post = Post.objects.create(author=self.user, text='new post')
+        response = guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'][0], new_post)
+
+
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_page_cache_stats(PAGE_PREFIXES)
+        self.user = User.objects.create_user(username='auth')
+        self.post = Post.objects.create(author=self.user, text='test text')
+        self.url = reverse('posts:post_detail', args=[self.post.id])
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_post_page_cached_for_guests(self):
+        """Страница поста из кеша, пока пост и его автор не менялись."""
+        guest_client = Client()
+        self.assertEqual(guest_client.get(self.url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = guest_client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'test text')
+        self.assertIn('Cookie', response['Vary'])
+        Comment.objects.create(post=self.post, author=self.user, text='ок')
+        self.assertContains(guest_client.get(self.url), 'ок')
+        # Новый пост автора меняет счётчик в карточке автора.
+        Post.objects.create(author=self.user, text='other')
+        self.assertEqual(guest_client.get(self.url)['X-Cache'], 'MISS')
+
+    def test_gzip_page_for_guests(self):
+        """Гость с gzip получает сжатую страницу из кеша как есть."""
+        guest_client = Client(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        guest_client.get(self.url)
+        response = guest_client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = gzip.decompress(response.content).decode()
+        self.assertIn('test text', body)
+        self.assertIn('Войти', body)
+        self.assertNotIn('<!--hole:', body)
+        plain = Client().get(self.url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain.content.decode(), body)
+        response = self.authorized_client.get(
+            self.url, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertContains(response, 'Добавить комментарий')
+
+    def test_shared_page_and_stats(self):
+        """Гости и вошедшие получают одну запись кеша, POST идёт мимо."""
+        guest_client = Client()
+        guest_response = guest_client.get(self.url)
+        guest_client.get(self.url)
+        response = self.authorized_client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotContains(guest_response, 'Добавить комментарий')
+        self.assertContains(response, 'Добавить комментарий')
+        response = self.authorized_client.post(
+            reverse('posts:post_detail', args=[self.post.id])
+        )
+        self.assertEqual(response['X-Cache'], 'BYPASS')
+        stats = page_cache_stats(['post_page'])['post_page']
+        self.assertEqual(
+            {name: stats[name] for name in ('hit', 'stale', 'miss', 'bypass')},
+            {'hit': 2, 'stale': 0, 'miss': 1, 'bypass': 1}
+        )
+        self.assertEqual(stats['ratio'], 0.667)
+        self.assertGreater(stats['saved'], 0)
+        out = StringIO()
+        call_command('page_cache_stats', '--reset', stdout=out)
+        self.assertIn('0.667', out.getvalue())
+        self.assertEqual(page_cache_stats(['post_page'])['post_page']['hit'],
+                         0)
+
+    def test_group_change_invalidates_page(self):
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        url = reverse('posts:group_list', args=[group.slug])
+        guest_client = Client()
+        guest_client.get(url)
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(guest_client.get(url), 'Новое название')
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.posts = [
+            Post.objects.create(author=cls.user, text=f'text {i}')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def render_profile(self):
+        # Минуя кеш страниц, чтобы проверить именно кеш карточек.
+        bump(author_scope(self.user.username))
+        return self.client.get(
+            reverse('posts:user', kwargs={'username': self.user.username})
+        )
+
+    def test_cards_rendered_once(self):
+        """Карточки рендерятся один раз и обновляются после правки."""
+        first = self.render_profile()
+        self.assertTemplateUsed(first, 'includes/article.html')
+        second = self.render_profile()
+        self.assertTemplateNotUsed(second, 'includes/article.html')
+        self.assertEqual(first.content, second.content)
+        post = self.posts[0]
+        post.text = 'edited text'
+        post.save()
+        third = self.render_profile()
+        self.assertTemplateUsed(third, 'includes/article.html')
+        self.assertContains(third, 'edited text')
+
+    def test_cards_follow_author_and_group_changes(self):
+        """Карточки не показывают старое имя автора и группы."""
+        group = Group.objects.create(title='Старая группа', slug='old')
+        Post.objects.create(author=self.user, text='В группе', group=group)
+        self.render_profile()
+        self.user.first_name, self.user.last_name = 'Новое', 'Имя'
+        self.user.save()
+        group.title, group.slug = 'Новая группа', 'new'
+        group.save()
+        response = self.render_profile()
+        self.assertContains(response, 'Новое Имя')
+        self.assertContains(response, 'Новая группа')
+        self.assertContains(response, reverse('posts:group_list',
+                                              args=['new']))
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_fresh_value_is_not_recomputed(self):
+        self.assertEqual(single_flight('key', self.compute, 60), (1, 'miss'))
+        self.assertEqual(single_flight('key', self.compute, 60), (1, 'hit'))
+
+    def test_stale_value_while_other_request_recomputes(self):
+        single_flight('key', self.compute, 0)
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(single_flight('key', self.compute, 0), (1, 'stale'))
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(single_flight('key', self.compute, 0), (2, 'miss'))
+
+    def test_invalid_value_is_recomputed(self):
+        single_flight('key', self.compute, 60)
+        self.assertEqual(
+            single_flight('key', self.compute, 60, lambda value: value > 1),
+            (2, 'miss')
+        )
+
+    @override_settings(FEED_CACHE_LOCK_WAIT=0)
+    def test_computes_itself_when_wait_is_over(self):
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(single_flight('key', self.compute, 60), (1, 'miss'))
+
+    def test_concurrent_misses_compute_once(self):
+        """Одновременные промахи ждут один пересчёт."""
+        def slow():
+            time.sleep(0.2)
+            return self.compute()
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(single_flight('key', slow, 60))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), [(1, 'hit')] * 4 + [(1, 'miss')])
+
+    @override_settings(FEED_CACHE_LOCK_WAIT=5)
+    def test_uncacheable_result_releases_waiters(self):
+        """Ждущие не спят весь FEED_CACHE_LOCK_WAIT, если кешировать
+        нечего."""
+        def slow():
+            time.sleep(0.2)
+            self.compute()
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(single_flight('key', slow, 60))
+            )
+            for _ in range(3)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(results, [(None, 'miss')] * 3)
@@ -0,0 +1,109 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Post, User
+from yatube.settings import NUM_COMMENTS
+
+COMMENTS_COUNT = NUM_COMMENTS * 2 + 5
+
+
+class CommentPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+        cls.quiet_post = Post.objects.create(author=cls.author, text='Тихо')
+        commenters = [
+            User.objects.create_user(username=f'reader_{i}')
+            for i in range(3)
+        ]
+        Comment.objects.bulk_create(
+            Comment(
+                post=cls.post,
+                author=commenters[i % len(commenters)],
+                text=f'Комментарий {i}',
+            )
+            for i in range(COMMENTS_COUNT)
+        )
+        Comment.objects.create(
+            post=cls.quiet_post, author=cls.author, text='Один'
+        )
+        cls.expected = list(
+            cls.post.comments.order_by('-created', '-id').values_list(
+                'id', flat=True)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def detail_url(self, post):
+        return reverse('posts:post_detail', args=[post.id])
+
+    def test_detail_shows_first_page(self):
+        """На странице поста только первая страница комментариев."""
+        response = self.client.get(self.detail_url(self.post))
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.id for comment in comments],
+            self.expected[:NUM_COMMENTS]
+        )
+        self.assertContains(
+            response,
+            f'?after={comments.paginator.next_cursor}'
+        )
+
+    def test_detail_query_count_is_bounded(self):
+        """Число запросов не зависит от числа комментариев."""
+        # Первый запрос заполняет кеш счётчиков автора.
+        self.client.get(self.detail_url(self.quiet_post))
+        # Сравниваем отрисовку, а не кеш страниц.
+        cache.clear()
+        with CaptureQueriesContext(connection) as quiet:
+            self.client.get(self.detail_url(self.quiet_post))
+        cache.clear()
+        with CaptureQueriesContext(connection) as busy:
+            self.client.get(self.detail_url(self.post))
+        self.assertEqual(len(busy), len(quiet))
+
+    def test_fragment_walks_all_comments(self):
+        """Фрагмент JSON отдаёт следующие страницы без пропусков."""
+        seen = []
+        url = (
+            reverse('posts:post_comments', args=[self.post.id])
+            + '?format=json'
+        )
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(comment['id'] for comment in data['comments'])
+            url = data['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_fragment_html(self):
+        """HTML-фрагмент содержит следующую пачку и ссылку на ещё одну."""
+        first = self.client.get(self.detail_url(self.post))
+        cursor = first.context['comments'].paginator.next_cursor
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.id]),
+            {'after': cursor}
+        )
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertEqual(
+            [comment.id for comment in response.context['comments']],
+            self.expected[NUM_COMMENTS:NUM_COMMENTS * 2]
+        )
+        self.assertContains(response, 'data-load-more')
+        self.assertNotContains(response, '<html')
+
+    def test_fragment_bad_cursor(self):
+        """Испорченный курсор даёт первую страницу."""
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.id]),
+            {'after': 'мусор', 'format': 'json'}
+        )
+        ids = [comment['id'] for comment in response.json()['comments']]
+        self.assertEqual(ids, self.expected[:NUM_COMMENTS])
@@ -0,0 +1,104 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Группа',
+            slug='group',
+            description='Описание',
+        )
+        self.post = Post.objects.create(
+            author=self.author,
+            text='Текст поста',
+            group=self.group,
+        )
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.urls = (
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:user', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.id]),
+        )
+
+    def test_unchanged_page_is_not_modified(self):
+        """Неизменная страница отдаёт 304 без основной выборки.
+
+        Валидаторы берутся из кеша, читателю нужны только сессия
+        и пользователь.
+        """
+        for client, session_queries in ((self.guest_client, 0),
+                                        (self.reader_client, 2)):
+            for url in self.urls:
+                with self.subTest(url=url, client=client):
+                    etag = client.get(url)['ETag']
+                    with self.assertNumQueries(session_queries):
+                        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 304)
+                    self.assertEqual(response.content, b'')
+
+    def test_edit_of_older_post_is_not_hidden_by_if_modified_since(self):
+        """Правка старого поста не даёт 304 по дате последней записи."""
+        Post.objects.create(
+            author=self.author, text='Новый пост', group=self.group)
+        for url in self.urls[:2]:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertFalse(response.has_header('Last-Modified'))
+                etag = response['ETag']
+                self.post.text = f'Правка для {url}'
+                self.post.save()
+                response = self.guest_client.get(
+                    url,
+                    HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT',
+                )
+                self.assertContains(response, self.post.text)
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_changes_invalidate_etag(self):
+        """Новый пост, правка и комментарий меняют ETag."""
+        changes = (
+            lambda: Post.objects.create(
+                author=self.author, text='Новый', group=self.group),
+            lambda: Post.objects.get(pk=self.post.pk).save(),
+            lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text='Комментарий'),
+        )
+        for change in changes:
+            etags = {
+                url: self.guest_client.get(url)['ETag'] for url in self.urls
+            }
+            change()
+            for url, etag in etags.items():
+                with self.subTest(url=url):
+                    response = self.guest_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_etag_varies_by_reader_and_follows(self):
+        url = reverse('posts:user', args=[self.author.username])
+        guest_etag = self.guest_client.get(url)['ETag']
+        reader_etag = self.reader_client.get(url)['ETag']
+        self.assertNotEqual(guest_etag, reader_etag)
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.reader_client.get(
+            url, HTTP_IF_NONE_MATCH=reader_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], reader_etag)
+
+    def test_missing_post_has_no_etag(self):
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=[self.post.id + 100])
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
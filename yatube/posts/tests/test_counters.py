@@ -0,0 +1,86 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.counters import stats_for
+from posts.models import AuthorStats, Comment, Follow, Post, User
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def assertStats(self, user, posts, followers, following):
+        stats = AuthorStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.posts_count, stats.followers_count, stats.following_count),
+            (posts, followers, following)
+        )
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении строк."""
+        stats_for(self.author)
+        stats_for(self.reader)
+        post = Post.objects.create(author=self.author, text='текст')
+        Post.objects.create(author=self.author, text='текст 2')
+        self.client.get(
+            reverse('posts:profile_follow', args=[self.author.username])
+        )
+        self.client.post(
+            reverse('posts:add_comment', args=[post.id]), {'text': 'ок'}
+        )
+        self.assertStats(self.author, 2, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        Comment.objects.all().delete()
+        post.delete()
+        self.client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username])
+        )
+        self.assertStats(self.author, 1, 0, 0)
+        self.assertStats(self.reader, 0, 0, 0)
+
+    def test_recount_counters_command(self):
+        post = Post.objects.create(author=self.author, text='текст')
+        Comment.objects.bulk_create(
+            Comment(post=post, author=self.reader, text=f'{i}')
+            for i in range(3)
+        )
+        Follow.objects.bulk_create(
+            [Follow(user=self.reader, author=self.author)]
+        )
+        call_command('recount_counters', stdout=StringIO())
+        self.assertStats(self.author, 1, 1, 0)
+        self.assertStats(self.reader, 0, 0, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 3)
+
+    def test_profile_does_not_count_posts(self):
+        """Профиль и пост не выполняют агрегирующих запросов."""
+        post = Post.objects.create(author=self.author, text='текст')
+        stats_for(self.author)
+        urls = (
+            reverse('posts:user', args=[self.author.username]),
+            reverse('posts:post_detail', args=[post.id]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(url)
+                self.assertFalse(
+                    any('COUNT(' in query['sql'] for query in queries)
+                )
@@ -0,0 +1,84 @@
+import re
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Post, User
+
+
+class HolePunchingTests(TestCase):
+    """Общая страница из кеша дополняется данными посетителя."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.stranger = User.objects.create_user(username='stranger')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(author=self.author, text='Текст')
+        self.clients = {}
+        for user in (self.author, self.reader, self.stranger):
+            client = Client(enforce_csrf_checks=True)
+            client.force_login(user)
+            self.clients[user.username] = client
+        self.profile_url = reverse('posts:user', args=['author'])
+        self.detail_url = reverse('posts:post_detail', args=[self.post.id])
+
+    def test_header_and_follow_button(self):
+        pages = {
+            name: client.get(self.profile_url)
+            for name, client in self.clients.items()
+        }
+        self.assertEqual(pages['author']['X-Cache'], 'MISS')
+        self.assertEqual(pages['stranger']['X-Cache'], 'HIT')
+        for name, response in pages.items():
+            with self.subTest(name=name):
+                self.assertContains(response, f'Пользователь: {name}')
+                self.assertNotContains(response, '<!--hole:')
+        self.assertNotContains(pages['author'], 'Подписаться')
+        self.assertNotContains(pages['author'], 'Отписаться')
+        self.assertContains(pages['reader'], 'Отписаться')
+        # Подписан читатель, а не этот пользователь.
+        self.assertContains(pages['stranger'], 'Подписаться')
+        guest = Client().get(self.profile_url)
+        self.assertContains(guest, 'Войти')
+        self.assertContains(guest, 'Подписаться')
+
+    def test_edit_link(self):
+        for name, client in self.clients.items():
+            with self.subTest(name=name):
+                response = client.get(self.detail_url)
+                edit_url = reverse('posts:post_edit', args=[self.post.id])
+                if name == 'author':
+                    self.assertContains(response, edit_url)
+                else:
+                    self.assertNotContains(response, edit_url)
+
+    def test_csrf_token_per_visitor(self):
+        """Токен из страницы, взятой из кеша, принимается при отправке."""
+        for name, client in self.clients.items():
+            with self.subTest(name=name):
+                page = client.get(self.detail_url).content.decode()
+                token = re.search(
+                    r'name="csrfmiddlewaretoken" value="([^"]+)"', page
+                ).group(1)
+                client.post(
+                    reverse('posts:add_comment', args=[self.post.id]),
+                    {'text': f'от {name}', 'csrfmiddlewaretoken': token},
+                )
+                self.assertTrue(
+                    Comment.objects.filter(text=f'от {name}').exists()
+                )
+
+    def test_cached_page_queries(self):
+        """Вошедшему нужны сессия, пользователь и проверка подписки."""
+        client = self.clients['stranger']
+        client.get(self.profile_url)
+        client.get(self.detail_url)
+        with self.assertNumQueries(3):
+            response = client.get(self.profile_url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        with self.assertNumQueries(2):
+            response = client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'HIT')
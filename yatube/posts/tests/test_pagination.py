@@ -0,0 +1,118 @@
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+from posts.utils import CursorPaginator, encode_cursor
+from yatube.settings import NUM_POSTS
+
+POSTS_COUNT = 25
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Тестовый текст {i}', author=cls.user, group=cls.group)
+            for i in range(POSTS_COUNT)
+        )
+        cls.expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get_page(self, **kwargs):
+        paginator = CursorPaginator(Post.objects.all(), NUM_POSTS, **kwargs)
+        return paginator.get_page()
+
+    def test_walk_forward_and_back(self):
+        """Курсоры обходят ленту вперёд и назад без пропусков."""
+        seen = []
+        page = self.get_page()
+        pages = [page]
+        while page.has_next():
+            page = self.get_page(after=page.paginator.next_cursor)
+            pages.append(page)
+        for page in pages:
+            seen.extend(post.id for post in page)
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        previous = self.get_page(before=pages[-1].paginator.previous_cursor)
+        self.assertEqual(
+            [post.id for post in previous],
+            [post.id for post in pages[1]]
+        )
+        self.assertEqual(previous.number, 2)
+        first = self.get_page(before=previous.paginator.previous_cursor)
+        self.assertEqual(first.number, 1)
+        self.assertFalse(first.has_previous())
+
+    def test_deep_page_single_query(self):
+        """Любая страница - один запрос без COUNT и OFFSET."""
+        last = Post.objects.order_by('pub_date', 'id').first()
+        token = encode_cursor([last.pub_date, last.id + 1], 40)
+        with self.assertNumQueries(1):
+            page = self.get_page(after=token)
+            list(page)
+            page.has_next()
+
+    def test_invalid_cursor_returns_first_page(self):
+        page = self.get_page(after='не-курсор')
+        self.assertEqual(page.number, 1)
+        self.assertEqual(len(page), NUM_POSTS)
+
+    def test_forged_cursor_returns_first_page(self):
+        """Курсор с None или вложенными значениями не роняет ленты."""
+        post = Post.objects.first()
+        tokens = [
+            encode_cursor([None, None], 2),
+            encode_cursor([[1], {'id': 1}], 2),
+            encode_cursor([{'a': 1}, [post.id]], 2),
+            encode_cursor(['2022-01-01T00:00:00', 'x'], 2),
+            encode_cursor(['2022-01-01T00:00:00', post.id], float('inf')),
+            encode_cursor(['2022-01-01T00:00:00', 10 ** 30], 2),
+            encode_cursor(['2022-01-01T00:00:00', 1e300], 2),
+            encode_cursor(['2022-01-01T00:00:00', float('nan')], 2),
+            encode_cursor([float('inf'), post.id], 2),
+        ]
+        for token in tokens:
+            with self.subTest(token=token):
+                page = self.get_page(after=token)
+                self.assertEqual(page.number, 1)
+                for url, params in (
+                    (reverse('posts:index'), {}),
+                    (reverse('posts:user', args=[post.author.username]), {}),
+                    (reverse('posts:search'), {'q': post.text.split()[0]}),
+                    (reverse('posts:post_comments', args=[post.id]), {}),
+                ):
+                    response = self.client.get(
+                        url, dict(params, before=token))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_views_follow_cursor(self):
+        """Ленты принимают ?after= и старый ?page=N."""
+        first = self.client.get(reverse('posts:index'))
+        token = first.context['page_obj'].paginator.next_cursor
+        self.assertContains(first, f'?after={token}')
+        second = self.client.get(reverse('posts:index'), {'after': token})
+        self.assertEqual(
+            [post.id for post in second.context['page_obj']],
+            self.expected[NUM_POSTS:NUM_POSTS * 2]
+        )
+        legacy = self.client.get(
+            reverse('posts:user', kwargs={'username': self.user.username}),
+            {'page': 3}
+        )
+        self.assertEqual(
+            len(legacy.context['page_obj']), POSTS_COUNT - NUM_POSTS * 2)
@@ -0,0 +1,126 @@
+import re
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+# Таблицы из нескольких строк: полный просмотр дешевле индекса.
+SMALL_TABLES = ('posts_group',)
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+TEMP_SORT = 'USE TEMP B-TREE'
+# Найденные посты сортируются по вычисленной оценке: сортируется
+# только выборка совпадений, а не вся таблица.
+SORTED_BY_SCORE = 'ORDER BY "search_score" DESC'
+
+
+class QueryPlanTest(TestCase):
+    """Запросы представлений posts не просматривают таблицы целиком.
+
+    Для каждого SELECT, UPDATE и DELETE, выполненного представлением,
+    строится EXPLAIN QUERY PLAN. Статистики ANALYZE в тестовой базе нет,
+    поэтому SQLite планирует запросы как для больших таблиц.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='group',
+            description='Описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, text='Текст поста', group=cls.group
+        )
+        Comment.objects.create(
+            author=cls.reader, post=cls.post, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    @contextmanager
+    def capture(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().split(None, 1)[0].upper() in (
+                    'SELECT', 'UPDATE', 'DELETE'):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            yield statements
+
+    def plan(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def problems(self, statements):
+        found = []
+        for sql, params in statements:
+            for step in self.plan(sql, params):
+                scan = FULL_SCAN.match(step)
+                if scan and scan.group(1) not in SMALL_TABLES:
+                    found.append(f'{step}: {sql}')
+                if TEMP_SORT in step and SORTED_BY_SCORE not in sql:
+                    found.append(f'{step}: {sql}')
+        return found
+
+    def assertIndexedPlans(self, client, method, url, data=None):
+        with self.capture() as statements:
+            getattr(client, method)(url, data or {})
+        self.assertTrue(statements, url)
+        self.assertEqual(self.problems(statements), [], url)
+
+    def test_read_views_use_indexes(self):
+        """Страницы читают данные по индексам без сортировки в памяти."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:user', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.id]),
+            reverse('posts:post_comments', args=[self.post.id]),
+            reverse('posts:follow_index'),
+            reverse('posts:search') + '?q=текст',
+            reverse('posts:post_edit', args=[self.post.id]),
+            reverse('posts:post_create'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertIndexedPlans(self.author_client, 'get', url)
+                cache.clear()
+                self.assertIndexedPlans(self.client, 'get', url)
+
+    def test_write_views_use_indexes(self):
+        """Запись поста, комментария и подписки не просматривает таблицы."""
+        other = User.objects.create_user(username='other')
+        writes = (
+            (self.author_client, reverse('posts:post_create'),
+             {'text': 'Новый пост', 'group': self.group.id}),
+            (self.author_client,
+             reverse('posts:post_edit', args=[self.post.id]),
+             {'text': 'Правка', 'group': self.group.id}),
+            (self.client, reverse('posts:add_comment', args=[self.post.id]),
+             {'text': 'Ещё комментарий'}),
+            (self.client,
+             reverse('posts:profile_follow', args=[other.username]), None),
+            (self.client,
+             reverse('posts:profile_unfollow', args=[other.username]), None),
+        )
+        for client, url, data in writes:
+            with self.subTest(url=url):
+                method = 'post' if data else 'get'
+                self.assertIndexedPlans(client, method, url, data)
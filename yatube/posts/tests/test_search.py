@@ -0,0 +1,135 @@
+import datetime
+
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import search
+from posts.models import Post, SearchPosting, User
+from yatube.settings import NUM_POSTS
+
+
+class SearchMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        search.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def found(self, query):
+        return list(
+            search.search_posts(query).order_by(
+                *search.SEARCH_ORDERING).values_list('text', flat=True)
+        )
+
+    def test_search_matches_all_words(self):
+        """Находятся посты со всеми словами запроса в любом регистре."""
+        Post.objects.create(author=self.user, text='Кошка спит на окне')
+        Post.objects.create(author=self.user, text='Собака спит в будке')
+        self.assertEqual(self.found('СПИТ кошка'), ['Кошка спит на окне'])
+        self.assertEqual(len(self.found('спит')), 2)
+        self.assertEqual(self.found('слон'), [])
+        self.assertEqual(self.found('!!!'), [])
+
+    def test_search_by_prefix(self):
+        """Слово запроса совпадает с началом слова поста."""
+        Post.objects.create(author=self.user, text='Программирование')
+        self.assertEqual(len(self.found('програм')), 1)
+
+    def test_search_ranks_by_relevance_then_recency(self):
+        """Частое слово поднимает пост выше, при равенстве - свежий."""
+        now = timezone.now()
+        old = Post.objects.create(author=self.user, text='чай чай чай')
+        Post.objects.filter(pk=old.pk).update(pub_date=now)
+        Post.objects.create(author=self.user, text='чай и кофе')
+        older = Post.objects.create(author=self.user, text='кофе')
+        newer = Post.objects.create(author=self.user, text='кофе')
+        Post.objects.filter(pk=older.pk).update(
+            pub_date=now - datetime.timedelta(days=365)
+        )
+        Post.objects.filter(pk=newer.pk).update(pub_date=now)
+        self.assertEqual(self.found('чай'), ['чай чай чай', 'чай и кофе'])
+        ids = list(
+            search.search_posts('кофе').filter(text='кофе').order_by(
+                *search.SEARCH_ORDERING).values_list('id', flat=True)
+        )
+        self.assertEqual(ids, [newer.pk, older.pk])
+
+    def test_search_follows_edits_and_deletes(self):
+        """Индекс обновляется при изменении и удалении поста."""
+        post = Post.objects.create(author=self.user, text='первая версия')
+        post.text = 'вторая редакция'
+        post.save()
+        self.assertEqual(self.found('первая'), [])
+        self.assertEqual(self.found('редакция'), ['вторая редакция'])
+        post.delete()
+        self.assertEqual(self.found('редакция'), [])
+
+    def test_search_page_walks_results(self):
+        """Страница поиска листается курсором и сохраняет запрос."""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост про море {i}')
+            for i in range(NUM_POSTS + 3)
+        )
+        Post.objects.create(author=self.user, text='Пост про горы')
+        search.rebuild()
+        url = reverse('posts:search')
+        response = self.client.get(url, {'q': 'море'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), NUM_POSTS)
+        next_cursor = page_obj.paginator.next_cursor
+        self.assertContains(response, f'?q=%D0%BC%D0%BE%D1%80%D0%B5'
+                                      f'&amp;after={next_cursor}')
+        response = self.client.get(url, {'q': 'море', 'after': next_cursor})
+        self.assertEqual(len(response.context['page_obj']), 3)
+        seen = {post.id for post in page_obj}
+        seen.update(post.id for post in response.context['page_obj'])
+        self.assertEqual(len(seen), NUM_POSTS + 3)
+
+    def test_search_page_reports_no_results(self):
+        Post.objects.create(author=self.user, text='Пост про горы')
+        response = self.client.get(reverse('posts:search'), {'q': 'море'})
+        self.assertContains(response, 'По запросу «море» ничего не найдено.')
+
+    def test_search_page_without_query(self):
+        response = self.client.get(reverse('posts:search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['page_obj'])
+
+    def test_admin_uses_search_index(self):
+        """Поиск в админке идёт через тот же индекс."""
+        Post.objects.create(author=self.user, text='Кошка спит')
+        Post.objects.create(author=self.user, text='Собака лает')
+        admin = site._registry[Post]
+        request = RequestFactory().get('/admin/posts/post/')
+        queryset, distinct = admin.get_search_results(
+            request, Post.objects.all(), 'кош'
+        )
+        self.assertFalse(distinct)
+        self.assertEqual(
+            list(queryset.values_list('text', flat=True)), ['Кошка спит']
+        )
+
+
+@override_settings(SEARCH_BACKEND='auto')
+class FTSSearchTest(SearchMixin, TestCase):
+    def test_fts_backend_is_used(self):
+        self.assertTrue(search.use_fts())
+        Post.objects.create(author=self.user, text='слово')
+        self.assertFalse(SearchPosting.objects.exists())
+
+
+@override_settings(SEARCH_BACKEND='index')
+class InvertedIndexSearchTest(SearchMixin, TestCase):
+    def test_postings_are_stored(self):
+        post = Post.objects.create(author=self.user, text='Раз два раз')
+        self.assertEqual(
+            dict(post.search_postings.values_list('term', 'count')),
+            {'раз': 2, 'два': 1}
+        )
@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase, override_settings
+
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class SeedCommandTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def seed(self, prefix, seed=1):
+        call_command(
+            'seed_yatube',
+            users=30, posts=200, groups=5, comments=100, follows=5,
+            images=10, seed=seed, prefix=prefix, stdout=StringIO(),
+        )
+        posts = Post.objects.filter(author__username__startswith=prefix)
+        return list(posts.order_by('id').values_list('text', 'pub_date'))
+
+    def test_seed_volumes(self):
+        self.seed('first')
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 5)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertEqual(Post.objects.exclude(image='').count(), 10)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        stats = AuthorStats.objects.order_by('-posts_count').first()
+        self.assertEqual(
+            stats.posts_count, Post.objects.filter(author=stats.user).count()
+        )
+
+    def test_seed_is_deterministic(self):
+        """Один и тот же --seed даёт те же тексты и даты."""
+        first = self.seed('first')
+        second = self.seed('second')
+        other = self.seed('other', seed=2)
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
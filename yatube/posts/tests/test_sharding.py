@@ -0,0 +1,214 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts import sharding
+from posts.models import Comment, Follow, Group, Post, PostImageVariant, User
+from yatube.settings import NUM_POSTS
+
+SHARDS = ['shard_test_0', 'shard_test_1']
+TEMP_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+class ShardingTest(TransactionTestCase):
+    # TestCase проверяет внешние ключи шардов, а авторов на них нет.
+    databases = {'default', *SHARDS}
+
+    @classmethod
+    def setUpClass(cls):
+        # Шарды - настоящие файлы SQLite: их база не создаётся раннером.
+        cls.sharded = override_settings(POST_SHARDS=SHARDS)
+        cls.sharded.enable()
+        for alias in SHARDS:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(TEMP_DIR, f'{alias}.sqlite3'),
+            }
+            call_command('migrate', database=alias, verbosity=0)
+            connections[alias].close()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        cls.sharded.disable()
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authors = {}
+        index = 0
+        while len(self.authors) < len(SHARDS):
+            user = User.objects.create_user(username=f'author{index}')
+            self.authors.setdefault(sharding.shard_for(user.pk), user)
+            index += 1
+        self.reader = User.objects.create_user(username='reader')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def locations(self, model, pk):
+        return [
+            alias for alias in ['default', *SHARDS]
+            if model.objects.using(alias).filter(pk=pk).exists()
+        ]
+
+    def create_posts(self, count):
+        authors = list(self.authors.values())
+        return [
+            Post.shards.create(
+                author=authors[index % len(authors)], text=f'Пост {index}'
+            )
+            for index in range(count)
+        ]
+
+    def test_jump_hash_moves_authors_only_to_new_shard(self):
+        moved = 0
+        for author_id in range(1, 1001):
+            before = sharding.jump_hash(author_id, 2)
+            after = sharding.jump_hash(author_id, 3)
+            self.assertIn(after, (before, 2))
+            moved += after != before
+        self.assertTrue(250 < moved < 420, moved)
+
+    def test_rows_live_on_shard_of_post_author(self):
+        for shard, author in self.authors.items():
+            post = Post.shards.create(author=author, text='Текст')
+            comment = post.comments.create(
+                author=self.reader, text='Комментарий'
+            )
+            self.assertEqual(self.locations(Post, post.pk), [shard])
+            self.assertEqual(self.locations(Comment, comment.pk), [shard])
+            post = Post.shards.find(post.pk)
+            self.assertEqual(post.comments_count, 1)
+            self.assertEqual(post.author, author)
+        ids = [
+            post_id for alias in SHARDS
+            for post_id in Post.objects.using(alias).values_list(
+                'id', flat=True)
+        ]
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_index_merges_shards_by_pub_date(self):
+        posts = self.create_posts(NUM_POSTS + 3)
+        expected = [post.pk for post in reversed(posts)]
+        response = self.client.get(reverse('posts:index'))
+        page_obj = response.context['page_obj']
+        self.assertEqual([post.pk for post in page_obj], expected[:NUM_POSTS])
+        response = self.client.get(
+            reverse('posts:index'), {'after': page_obj.paginator.next_cursor}
+        )
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']],
+            expected[NUM_POSTS:],
+        )
+
+    def test_follow_index_reads_followed_authors(self):
+        followed = list(self.authors.values())[0]
+        Follow.objects.create(user=self.reader, author=followed)
+        self.create_posts(4)
+        response = self.client.get(reverse('posts:follow_index'))
+        authors = {post.author for post in response.context['page_obj']}
+        self.assertEqual(authors, {followed})
+
+    def test_post_page_and_comment(self):
+        shard, author = next(iter(self.authors.items()))
+        post = Post.shards.create(author=author, text='Пост на шарде')
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]), {'text': 'Ответ'}
+        )
+        self.assertTrue(
+            Comment.objects.using(shard).filter(text='Ответ').exists()
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertContains(response, 'Пост на шарде')
+        self.assertContains(response, 'Ответ')
+
+    def test_rebalance_moves_posts_from_default(self):
+        with override_settings(POST_SHARDS=[]):
+            posts = self.create_posts(4)
+            posts[0].comments.create(author=self.reader, text='Комментарий')
+        self.assertEqual(Post.objects.using('default').count(), 4)
+        call_command('rebalance_shards', stdout=StringIO())
+        self.assertFalse(Post.objects.using('default').exists())
+        self.assertFalse(Comment.objects.using('default').exists())
+        for post in posts:
+            self.assertEqual(
+                self.locations(Post, post.pk),
+                [sharding.shard_for(post.author_id)],
+            )
+        self.assertEqual(
+            Comment.objects.using(
+                sharding.shard_for(posts[0].author_id)).count(), 1
+        )
+
+    def test_search_sees_posts_on_all_shards(self):
+        with override_settings(POST_SHARDS=[]):
+            moved = self.create_posts(2)
+        call_command('rebalance_shards', stdout=StringIO())
+        created = self.create_posts(2)
+        response = self.client.get(reverse('posts:search'), {'q': 'пост'})
+        self.assertEqual(
+            {post.pk for post in response.context['page_obj']},
+            {post.pk for post in moved + created},
+        )
+        response = self.client.get(reverse('posts:search'), {'q': 'пост 1'})
+        self.assertEqual(
+            {post.pk for post in response.context['page_obj']},
+            {moved[1].pk, created[1].pk},
+        )
+
+    def test_deleting_author_and_group_reaches_shards(self):
+        group = Group.objects.create(title='Группа', slug='group')
+        author, other_author = self.authors.values()
+        post = Post.shards.create(author=author, text='Текст', group=group)
+        other = Post.shards.create(author=other_author, text='Чужой пост')
+        comment = other.comments.create(author=author, text='Комментарий')
+        group.delete()
+        self.assertIsNone(Post.shards.find(post.pk).group_id)
+        author.delete()
+        self.assertEqual(self.locations(Post, post.pk), [])
+        self.assertEqual(self.locations(Comment, comment.pk), [])
+        self.assertTrue(self.locations(Post, other.pk))
+
+    @override_settings(MEDIA_ROOT=TEMP_DIR)
+    def test_thumbnails_are_prepared_on_shard(self):
+        shard, author = next(iter(self.authors.items()))
+        post = Post.shards.create(
+            author=author, text='С картинкой',
+            image=SimpleUploadedFile(
+                'small.gif', settings.SMALL_GIF, content_type='image/gif'
+            ),
+        )
+        self.assertTrue(Post.objects.using(shard).get(pk=post.pk).image_ready)
+        self.assertTrue(PostImageVariant.objects.using(shard).filter(
+            post_id=post.pk).exists())
+        self.assertFalse(PostImageVariant.objects.exists())
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertContains(response, 'srcset=')
+
+    def test_transfer_commands_refuse_sharding(self):
+        for name, args in (
+            ('export_posts', ['-']),
+            ('import_posts', [os.path.join(TEMP_DIR, 'posts.jsonl')]),
+            ('seed_yatube', []),
+        ):
+            with self.subTest(command=name):
+                with self.assertRaisesMessage(CommandError, 'шардирование'):
+                    call_command(name, *args, stdout=StringIO())
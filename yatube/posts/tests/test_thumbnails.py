@@ -0,0 +1,142 @@
+import shutil
+import tempfile
+
+import sorl
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import get_thumbnail
+
+from posts import thumbnails
+from posts.models import Post, PostImageVariant, User
+from posts.templatetags.post_cards import post_cards
+from yatube.settings import NUM_POSTS
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.post = Post.objects.create(
+            author=self.user,
+            text='Тестовый пост',
+            image=SimpleUploadedFile(
+                'small.gif', settings.SMALL_GIF, content_type='image/gif'
+            ),
+        )
+
+    def get_detail(self):
+        return self.client.get(
+            reverse('posts:post_detail', args=[self.post.id])
+        )
+
+    def test_placeholder_until_ready(self):
+        """Пока миниатюры не готовы, страница не нарезает картинку."""
+        self.assertFalse(self.post.image_ready)
+        response = self.get_detail()
+        self.assertNotContains(response, '<img class="card-img')
+        self.assertTrue(thumbnails.generate(self.post.id))
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.image_ready)
+        self.assertContains(self.get_detail(), '<img class="card-img')
+
+    def test_new_image_resets_ready(self):
+        thumbnails.generate(self.post.id)
+        self.post.refresh_from_db()
+        self.post.text = 'Другой текст'
+        self.post.save()
+        self.assertTrue(self.post.image_ready)
+        self.post.image = SimpleUploadedFile(
+            'other.gif', settings.SMALL_GIF, content_type='image/gif'
+        )
+        self.post.save()
+        self.assertFalse(self.post.image_ready)
+
+    def test_thumbnail_file_matches_sorl(self):
+        """thumbnail_file даёт то же имя, что get_thumbnail."""
+        self.assertEqual(
+            sorl.__version__, thumbnails.SORL_VERSION,
+            'thumbnail_file повторяет внутренности sorl-thumbnail: сверьте '
+            'его с ThumbnailBackend.get_thumbnail новой версии.',
+        )
+        for geometry, options in settings.POST_IMAGE_GEOMETRIES:
+            with self.subTest(geometry=geometry):
+                self.assertEqual(
+                    thumbnails.thumbnail_file(
+                        self.post.image, geometry, options).name,
+                    get_thumbnail(self.post.image, geometry, **options).name,
+                )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPrefetchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        for i in range(NUM_POSTS):
+            post = Post.objects.create(
+                author=cls.user,
+                text=f'Пост {i}',
+                image=SimpleUploadedFile(
+                    f'small_{i}.gif', settings.SMALL_GIF,
+                    content_type='image/gif'
+                ),
+            )
+            thumbnails.generate(post.id)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_pictures_resolved_in_bulk(self):
+        """Варианты картинок страницы - один запрос на все посты."""
+        posts = list(Post.objects.select_related('author', 'group'))
+        with self.assertNumQueries(1):
+            thumbnails.prefetch_thumbnails(posts)
+        widths = settings.POST_IMAGE_VARIANT_WIDTHS
+        for post in posts:
+            self.assertEqual(post.picture['width'], widths[-1])
+            for width in widths:
+                self.assertIn(f' {width}w', post.picture['srcset'])
+        posts = list(Post.objects.select_related('author', 'group'))
+        with self.assertNumQueries(1):
+            html = ''.join(post_cards(posts))
+        self.assertEqual(html.count('loading="lazy"'), NUM_POSTS)
+        self.assertEqual(html.count('sizes="'), NUM_POSTS)
+
+    def test_thumbnails_without_variants_resolved_in_bulk(self):
+        """Без вариантов миниатюры берутся из хранилища sorl пачкой."""
+        PostImageVariant.objects.all().delete()
+        posts = list(Post.objects.select_related('author', 'group'))
+        with self.assertNumQueries(2):
+            thumbnails.prefetch_thumbnails(posts)
+        posts = list(Post.objects.select_related('author', 'group'))
+        with self.assertNumQueries(1):
+            thumbnails.prefetch_thumbnails(posts)
+        geometry, options = settings.POST_IMAGE_GEOMETRIES[0]
+        for post in posts:
+            self.assertIsNone(post.picture)
+            self.assertEqual(
+                post.thumb_url,
+                get_thumbnail(post.image, geometry, **options).url
+            )
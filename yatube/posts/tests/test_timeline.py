@@ -0,0 +1,126 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Post, TimelineEntry, User
+from yatube.settings import NUM_POSTS
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.stranger = User.objects.create_user(username='stranger')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def timeline_posts(self):
+        return list(
+            TimelineEntry.objects.filter(
+                user=self.reader
+            ).values_list('post_id', flat=True)
+        )
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков и только в них."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='текст')
+        Post.objects.create(author=self.stranger, text='чужой')
+        self.assertEqual(self.timeline_posts(), [post.id])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        posts = [
+            Post.objects.create(author=self.author, text=f'текст {i}')
+            for i in range(3)
+        ]
+        self.client.get(
+            reverse('posts:profile_follow', args=[self.author.username])
+        )
+        self.assertEqual(
+            self.timeline_posts(), [post.id for post in reversed(posts)]
+        )
+        self.client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username])
+        )
+        self.assertEqual(self.timeline_posts(), [])
+
+    def test_rebuild_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'текст {i}') for i in range(5)
+        )
+        self.assertEqual(self.timeline_posts(), [])
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(len(self.timeline_posts()), 5)
+
+    def test_follow_index_reads_timeline(self):
+        """Лента подписок - один запрос к материализованной ленте."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(NUM_POSTS + 2):
+            Post.objects.create(author=self.author, text=f'текст {i}')
+        first = self.client.get(reverse('posts:follow_index'))
+        page_obj = first.context['page_obj']
+        self.assertEqual(len(page_obj), NUM_POSTS)
+        self.assertIsInstance(page_obj[0], Post)
+        second = self.client.get(
+            reverse('posts:follow_index'),
+            {'after': page_obj.paginator.next_cursor}
+        )
+        self.assertEqual(len(second.context['page_obj']), 2)
+
+
+@override_settings(FEED_CELEBRITY_THRESHOLD=2, FEED_RECENT_POSTS=5)
+class HybridFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.celebrity = User.objects.create_user(username='celebrity')
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+        Follow.objects.create(user=self.reader, author=self.celebrity)
+        Follow.objects.create(user=self.fan, author=self.celebrity)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def tearDown(self):
+        cache.clear()
+
+    def feed_ids(self, **params):
+        response = self.client.get(reverse('posts:follow_index'), params)
+        page_obj = response.context['page_obj']
+        return [post.id for post in page_obj], page_obj.paginator
+
+    def test_celebrity_posts_are_pulled(self):
+        """Посты знаменитого автора не раскладываются, но видны в ленте."""
+        posts = []
+        for i in range(NUM_POSTS + 5):
+            author = self.celebrity if i % 2 else self.author
+            posts.append(Post.objects.create(author=author, text=f'{i}'))
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.celebrity).exists()
+        )
+        expected = [post.id for post in reversed(posts)]
+        first, paginator = self.feed_ids()
+        second, _ = self.feed_ids(after=paginator.next_cursor)
+        self.assertEqual(first + second, expected)
+
+    def test_unfollow_below_threshold_pushes_author(self):
+        post = Post.objects.create(author=self.celebrity, text='текст')
+        Follow.objects.filter(user=self.fan).delete()
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(self.feed_ids()[0], [post.id])
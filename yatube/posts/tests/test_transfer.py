@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+class TransferCommandsTest(TestCase):
+    def setUp(self):
+        call_command(
+            'seed_yatube', users=20, posts=120, groups=4, comments=80,
+            follows=4, stdout=StringIO(),
+        )
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'posts.jsonl')
+
+    def export(self, **options):
+        call_command('export_posts', self.path, stdout=StringIO(), **options)
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def snapshot(self):
+        return {
+            'posts': list(Post.objects.order_by('id').values_list(
+                'id', 'author__username', 'group__slug', 'text', 'pub_date',
+                'modified')),
+            'comments': list(Comment.objects.order_by('id').values_list(
+                'id', 'post_id', 'author__username', 'text', 'created')),
+            'follows': sorted(Follow.objects.values_list(
+                'user__username', 'author__username')),
+            'groups': sorted(Group.objects.values_list('slug', 'title')),
+        }
+
+    def wipe(self):
+        for model in (Comment, Follow, Post, Group):
+            model.objects.all().delete()
+        User.objects.filter(username__endswith='_1').delete()
+
+    def test_round_trip(self):
+        """Выгрузка и загрузка восстанавливают посты, комментарии,
+        подписки и производные данные."""
+        before = self.snapshot()
+        self.export(batch_size=7)
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+        self.wipe()
+        call_command('import_posts', self.path, batch_size=13,
+                     stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+        author = Post.objects.order_by('id').first().author
+        self.assertEqual(
+            AuthorStats.objects.get(user=author).posts_count,
+            author.posts.count(),
+        )
+
+    def test_import_is_idempotent(self):
+        self.export()
+        before = self.snapshot()
+        call_command('import_posts', self.path, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def contents(self):
+        """Посты и комментарии без id: после замены id они другие."""
+        posts = Post.objects.exclude(author__username='stranger')
+        return (
+            list(posts.order_by('pub_date', 'author__username').values_list(
+                'author__username', 'group__slug', 'text', 'pub_date',
+                'modified')),
+            list(Comment.objects.order_by(
+                'created', 'author__username', 'text'
+            ).values_list(
+                'post__author__username', 'post__pub_date',
+                'author__username', 'text', 'created')),
+        )
+
+    def test_import_into_database_with_other_posts(self):
+        """Занятые чужими постами id заменяются, комментарии остаются
+        у своих постов, повтор загрузки ничего не добавляет."""
+        self.export()
+        before = self.contents()
+        clashing = list(Comment.objects.order_by('post_id').values_list(
+            'post_id', flat=True).distinct()[:3])
+        self.wipe()
+        stranger = User.objects.create_user(username='stranger')
+        for post_id in clashing:
+            Post.objects.create(id=post_id, author=stranger, text='Чужой')
+        output = StringIO()
+        call_command('import_posts', self.path, stdout=output)
+        self.assertEqual(self.contents(), before)
+        self.assertEqual(
+            list(stranger.posts.order_by('id').values_list('id', 'text')),
+            [(post_id, 'Чужой') for post_id in clashing],
+        )
+        self.assertIn('post: 120', output.getvalue())
+        self.assertIn('Новые id из-за занятых: post: 3', output.getvalue())
+        output = StringIO()
+        call_command('import_posts', self.path, stdout=output)
+        self.assertEqual(self.contents(), before)
+        self.assertIn('post: 0, comment: 0', output.getvalue())
+
+    def test_import_resumes_after_failure(self):
+        data = self.export()
+        lines = data.splitlines(keepends=True)
+        broken = lines[:50] + [b'{broken\n'] + lines[50:]
+        with open(self.path, 'wb') as file:
+            file.write(b''.join(broken))
+        before = self.snapshot()
+        self.wipe()
+        with self.assertRaises(CommandError):
+            call_command('import_posts', self.path, batch_size=20,
+                         stdout=StringIO())
+        checkpoint = f'{self.path}.checkpoint'
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file)['lines'], 40)
+        with self.assertRaises(CommandError):
+            call_command('import_posts', self.path, stdout=StringIO())
+        with open(self.path, 'wb') as file:
+            file.write(data)
+        call_command('import_posts', self.path, batch_size=20, resume=True,
+                     stdout=StringIO())
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(self.snapshot(), before)
+
+    def test_export_resumes_from_checkpoint(self):
+        full = self.export()
+        lines = full.splitlines(keepends=True)
+        done = b''.join(lines[:30])
+        last = json.loads(lines[29])
+        with open(self.path, 'wb') as file:
+            file.write(done + b'{"model": "post", "id": 1, "obrez')
+        with open(f'{self.path}.checkpoint', 'w') as file:
+            json.dump({
+                'model': last['model'],
+                'last_id': last['id'],
+                'offset': len(done),
+                'written': 30,
+            }, file)
+        self.assertEqual(self.export(resume=True, batch_size=9), full)
@@ -236,6 +236,25 @@ class PostViewsTest(TestCase):
         )
         self.check_context(response_follow.context)
 
+    def test_follow_page_shows_new_subscription_at_once(self):
+        """Лента подписок сразу показывает посты нового автора."""
+        new_user = User.objects.create(username='Lermontov')
+        authorized_client = Client()
+        authorized_client.force_login(new_user)
+        follow_index = reverse('posts:follow_index')
+        self.assertNotContains(
+            authorized_client.get(follow_index), self.post.text
+        )
+        authorized_client.get(
+            reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.user.username}
+            )
+        )
+        self.assertContains(
+            authorized_client.get(follow_index), self.post.text
+        )
+
     def test_unfollowing_posts(self):
         """Тестирование отсутствия поста автора у нового пользователя."""
         new_user = User.objects.create(username='Lermontov')
@@ -249,10 +268,8 @@ class PostViewsTest(TestCase):
 
 
 class PaginatorViewsTest(TestCase):
-    @classmethod
     def setUp(self):
         cache.clear()
-        super().setUpClass()
         self.user = User.objects.create_user(username='StasBasov')
         self.group = Group.objects.create(
             title='Тестовая группа',
@@ -0,0 +1,278 @@
+"""Фоновая подготовка миниатюр картинок постов.
+
+После сохранения поста с новой картинкой все размеры из
+settings.POST_IMAGE_GEOMETRIES и варианты для srcset нарезаются в пуле
+процессов (работа упирается в процессор), а родительский процесс
+записывает варианты, помечает пост готовым и сбрасывает кеш его лент.
+До этого шаблоны показывают заглушку, поэтому ни один запрос не ждёт PIL.
+При шардировании пост и его варианты пишутся на шард поста.
+
+prefetch_thumbnails вычисляет имена миниатюр закрытыми методами
+ThumbnailBackend (_get_format, _get_thumbnail_filename) и читает
+хранилище ключей sorl напрямую: публичный get_thumbnail обращается
+к хранилищу по одной картинке и рисует недостающую прямо в запросе.
+Поэтому sorl-thumbnail закреплён в requirements.txt на SORL_VERSION,
+а тесты сверяют thumbnail_file с get_thumbnail.
+"""
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import prefetch_related_objects
+from PIL import features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from . import caching, sharding
+from .models import Post, PostImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Версия sorl-thumbnail, внутренности которой повторяет thumbnail_file.
+SORL_VERSION = '12.7.0'
+
+_executor = None
+
+
+def _init_worker():
+    # Соединения родителя нельзя использовать в дочернем процессе.
+    for conn in connections.all():
+        conn.close()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.POST_IMAGE_WORKERS,
+            initializer=_init_worker,
+        )
+    return _executor
+
+
+def variant_formats():
+    """Форматы вариантов, которые умеет записывать установленный Pillow."""
+    return [
+        image_format for image_format in settings.POST_IMAGE_VARIANT_FORMATS
+        if image_format != 'WEBP' or features.check('webp')
+    ]
+
+
+def render_variants(image_name):
+    """Нарезает варианты картинки карточки для srcset."""
+    geometry, options = settings.POST_IMAGE_GEOMETRIES[0]
+    card_width, card_height = map(int, geometry.split('x'))
+    variants = []
+    for image_format in variant_formats():
+        for width in settings.POST_IMAGE_VARIANT_WIDTHS:
+            height = round(card_height * width / card_width)
+            thumbnail = get_thumbnail(
+                image_name, f'{width}x{height}',
+                format=image_format, **options
+            )
+            variants.append({
+                'width': thumbnail.width,
+                'height': thumbnail.height,
+                'format': image_format,
+                'name': thumbnail.name,
+                'size': thumbnail.storage.size(thumbnail.name),
+            })
+    return variants
+
+
+def render_thumbnails(image_name):
+    """Нарезает все размеры картинки; выполняется в рабочем процессе."""
+    for geometry, options in settings.POST_IMAGE_GEOMETRIES:
+        get_thumbnail(image_name, geometry, **options)
+    return image_name, render_variants(image_name)
+
+
+def post_database(post_id):
+    """База поста: его шард или default; None, если поста нет."""
+    if sharding.enabled():
+        return sharding.locate(post_id)
+    return 'default'
+
+
+def _image_name(post_id, using):
+    if using is None:
+        return None
+    return Post.objects.using(using).filter(pk=post_id).values_list(
+        'image', flat=True).first()
+
+
+def mark_ready(post_id, result, using='default'):
+    """Сохраняет варианты и помечает картинку поста готовой.
+
+    Ничего не делает, если картинку успели заменить.
+    """
+    image_name, variants = result
+    with transaction.atomic(using=using):
+        updated = Post.objects.using(using).filter(
+            pk=post_id, image=image_name
+        ).update(image_ready=True)
+        if updated:
+            stored = PostImageVariant.objects.using(using)
+            stored.filter(post_id=post_id).delete()
+            stored.bulk_create(
+                PostImageVariant(post_id=post_id, **variant)
+                for variant in variants
+            )
+    if updated:
+        caching.bump(*caching.post_scopes(Post.shards.find(post_id)))
+    return bool(updated)
+
+
+def generate(post_id, using=None):
+    """Синхронно готовит миниатюры поста."""
+    using = using or post_database(post_id)
+    image_name = _image_name(post_id, using)
+    if not image_name:
+        return False
+    return mark_ready(post_id, render_thumbnails(image_name), using)
+
+
+def _done(post_id, using, caller, future):
+    try:
+        mark_ready(post_id, future.result(), using)
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры поста %s', post_id)
+    finally:
+        # Колбэк выполняется в служебном потоке пула со своими
+        # соединениями.
+        if threading.current_thread() is not caller:
+            connections.close_all()
+
+
+def _shared_database():
+    # Рабочий процесс не увидит базу, живущую в памяти родителя.
+    return not (
+        connection.vendor == 'sqlite'
+        and connection.creation.is_in_memory_db(
+            connection.settings_dict['NAME'])
+    )
+
+
+def schedule(post_id, using='default'):
+    """Ставит подготовку миниатюр поста в очередь пула процессов."""
+    if not settings.POST_IMAGE_WORKERS or not _shared_database():
+        try:
+            generate(post_id, using)
+        except Exception:
+            logger.exception(
+                'Не удалось подготовить миниатюры поста %s', post_id)
+        return
+    image_name = _image_name(post_id, using)
+    if not image_name:
+        return
+    future = _get_executor().submit(render_thumbnails, image_name)
+    caller = threading.current_thread()
+    future.add_done_callback(
+        lambda result: _done(post_id, using, caller, result)
+    )
+
+
+def thumbnail_file(image, geometry, options):
+    """ImageFile миниатюры без обращения к хранилищу ключей.
+
+    Повторяет вычисление имени из ThumbnailBackend.get_thumbnail.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def picture(variants):
+    """Атрибуты <picture> из вариантов картинки.
+
+    Последний формат из POST_IMAGE_VARIANT_FORMATS - запасной для <img>,
+    остальные выводятся как <source>.
+    """
+    by_format = {}
+    for variant in sorted(variants, key=lambda variant: variant.width):
+        by_format.setdefault(variant.format, []).append(variant)
+    formats = [name for name in variant_formats() if name in by_format]
+    if not formats:
+        return None
+
+    def srcset(items):
+        return ', '.join(
+            f'{default.storage.url(item.name)} {item.width}w'
+            for item in items
+        )
+
+    fallback = by_format[formats[-1]]
+    largest = fallback[-1]
+    return {
+        'sources': [
+            {
+                'type': f'image/{name.lower()}',
+                'srcset': srcset(by_format[name]),
+            }
+            for name in formats[:-1]
+        ],
+        'src': default.storage.url(largest.name),
+        'srcset': srcset(fallback),
+        'sizes': settings.POST_IMAGE_SIZES,
+        'width': largest.width,
+        'height': largest.height,
+    }
+
+
+def prefetch_thumbnails(posts):
+    """Проставляет post.picture и post.thumb_url для картинок страницы.
+
+    Варианты для srcset загружаются одним запросом. Для постов без
+    вариантов записи о миниатюрах читаются одним get_many из кеша sorl и,
+    для промахов, одним запросом к его таблице. Посты без найденной
+    миниатюры получают thumb_url = None и рисуются тегом thumbnail.
+    """
+    geometry, options = settings.POST_IMAGE_GEOMETRIES[0]
+    ready = [post for post in posts if post.image and post.image_ready]
+    prefetch_related_objects(ready, 'image_variants')
+    wanted = {}
+    for post in posts:
+        post.thumb_url = None
+        post.picture = None
+    for post in ready:
+        post.picture = picture(post.image_variants.all())
+        if post.picture is None:
+            thumbnail = thumbnail_file(post.image, geometry, options)
+            wanted.setdefault(add_prefix(thumbnail.key), []).append(post)
+    if not wanted:
+        return posts
+    kv_cache = default.kvstore.cache
+    found = kv_cache.get_many(list(wanted))
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        rows = dict(
+            KVStore.objects.filter(key__in=missing).values_list(
+                'key', 'value')
+        )
+        kv_cache.set_many(rows, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(rows)
+    for key, key_posts in wanted.items():
+        value = found.get(key)
+        if value is None or value == EMPTY_VALUE:
+            continue
+        url = deserialize_image_file(value).url
+        for post in key_posts:
+            post.thumb_url = url
+    return posts
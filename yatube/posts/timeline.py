@@ -0,0 +1,139 @@
+"""Материализованные ленты подписок (fan-out on write).
+
+Каждый новый пост раскладывается в TimelineEntry всех подписчиков автора,
+поэтому чтение ленты follow_index сводится к одному диапазонному
+сканированию индекса (user, -pub_date, -post).
+
+Авторы, у которых подписчиков не меньше FEED_CELEBRITY_THRESHOLD,
+в ленты не раскладываются: их посты подмешиваются при чтении
+(см. posts.feed).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+
+from core.replication import primary_reads
+
+from .models import Follow, Post, TimelineEntry
+
+BATCH_SIZE = 1000
+TIMELINE_ORDERING = ('-pub_date', '-post_id')
+CELEBRITIES_KEY = 'feed:celebrities'
+
+
+def celebrity_ids():
+    """Множество id авторов, чьи посты подмешиваются при чтении."""
+    ids = cache.get(CELEBRITIES_KEY)
+    if ids is None:
+        with primary_reads():
+            ids = set(
+                Follow.objects.order_by().values('author_id').annotate(
+                    followers=Count('id')
+                ).filter(
+                    followers__gte=settings.FEED_CELEBRITY_THRESHOLD
+                ).values_list('author_id', flat=True)
+            )
+        cache.set(CELEBRITIES_KEY, ids, None)
+    return ids
+
+
+def is_celebrity(author_id):
+    return author_id in celebrity_ids()
+
+
+def followers_changed(author_id, delta):
+    """Переклассифицирует автора, если подписка пересекла порог.
+
+    Ставший обычным автор раскладывается в ленты всех подписчиков,
+    ранее разложенные посты ставшего знаменитым остаются на месте.
+    """
+    threshold = settings.FEED_CELEBRITY_THRESHOLD
+    followers = Follow.objects.filter(author_id=author_id).count()
+    if delta > 0 and followers == threshold:
+        cache.delete(CELEBRITIES_KEY)
+    elif delta < 0 and followers == threshold - 1:
+        cache.delete(CELEBRITIES_KEY)
+        user_ids = Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True)
+        for user_id in user_ids.distinct():
+            backfill(user_id, author_id)
+
+
+def _entry(user_id, post):
+    return TimelineEntry(
+        user_id=user_id,
+        post_id=post.id,
+        author_id=post.author_id,
+        pub_date=post.pub_date,
+    )
+
+
+def _bulk_insert(entries):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Добавляет пост в ленты всех подписчиков обычного автора."""
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_insert(_entry(user_id, post) for user_id in followers.iterator())
+
+
+def backfill(user_id, author_id):
+    """Заполняет ленту читателя постами автора после подписки."""
+    posts = Post.objects.filter(author_id=author_id).only(
+        'id', 'author_id', 'pub_date'
+    ).order_by()
+    _bulk_insert(_entry(user_id, post) for post in posts.iterator())
+
+
+def trim(user_id, author_id):
+    """Убирает посты автора из ленты читателя после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты с нуля по текущим подпискам.
+
+    Записи вставляются одним INSERT ... SELECT по соединению
+    подписок с постами, без выборки строк в Python.
+    """
+    follows = Follow.objects.order_by()
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    cache.delete(CELEBRITIES_KEY)
+    follows = follows.exclude(author_id__in=celebrity_ids())
+    rows = follows.filter(author__posts__isnull=False).values_list(
+        'user_id', 'author__posts__id', 'author_id', 'author__posts__pub_date'
+    )
+    sql, params = rows.query.sql_with_params()
+    with transaction.atomic():
+        entries.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {TimelineEntry._meta.db_table} '
+                f'(user_id, post_id, author_id, pub_date) {sql}',
+                params
+            )
+    return follows.count()
+
+
+def timeline_for(user):
+    """Queryset записей ленты читателя вместе с постами."""
+    return TimelineEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group'
+    )
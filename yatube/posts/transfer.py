@@ -0,0 +1,137 @@
+"""Перенос постов, комментариев и подписок в формате JSONL.
+
+Каждая строка - одна запись с полем model. Ссылки на пользователей
+и группы записаны именами и slug. Идентификаторы постов и комментариев
+сохраняются, если они свободны в базе, иначе запись получает новый,
+а комментарии следуют за своим постом. Уже загруженные записи
+узнаются по автору и времени, так что повтор загрузки не создаёт
+дублей. Записи идут в порядке SECTIONS, поэтому при загрузке
+всё, на что ссылаются, уже прочитано.
+
+Контрольная точка - JSON-файл рядом с данными: смещение в файле
+и последний id раздела. Она пишется после каждой пачки, так что
+прерванный перенос продолжается с места остановки.
+
+Перенос читает и пишет только default, поэтому при шардировании
+команды переноса и seed_yatube отказываются работать.
+"""
+import datetime
+import json
+import os
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+
+from . import sharding
+from .models import Comment, Follow, Group, Post
+
+# Ограничение SQLite на число параметров запроса.
+LOOKUP_CHUNK = 500
+
+SECTIONS = {
+    'group': (Group, {
+        'id': 'id',
+        'title': 'title',
+        'slug': 'slug',
+        'description': 'description',
+    }),
+    'post': (Post, {
+        'id': 'id',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'text': 'text',
+        'image': 'image',
+        'pub_date': 'pub_date',
+        'modified': 'modified',
+    }),
+    'comment': (Comment, {
+        'id': 'id',
+        'post': 'post_id',
+        'author': 'author__username',
+        'text': 'text',
+        'created': 'created',
+    }),
+    'follow': (Follow, {
+        'id': 'id',
+        'user': 'user__username',
+        'author': 'author__username',
+    }),
+}
+
+
+def _encode(value):
+    # DjangoJSONEncoder обрезает время до миллисекунд.
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+def dump_record(model, values):
+    """Строка JSONL из словаря values() раздела model."""
+    _, fields = SECTIONS[model]
+    record = {'model': model}
+    for key, lookup in fields.items():
+        record[key] = values[lookup]
+    line = json.dumps(record, default=_encode, ensure_ascii=False)
+    return line.encode() + b'\n'
+
+
+def chunks(items, size=LOOKUP_CHUNK):
+    """Срезы items по size, для запросов с __in."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def keyset_chunks(queryset, batch_size, after=0):
+    """Пачки строк по возрастанию id без OFFSET и без загрузки всей таблицы.
+
+    Память ограничена одной пачкой, каждая пачка читается .iterator().
+    """
+    while True:
+        chunk = list(
+            queryset.filter(id__gt=after).order_by('id')[:batch_size]
+            .iterator()
+        )
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]['id']
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_checkpoint(path, state):
+    """Пишет контрольную точку атомарно: временный файл и переименование."""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+@contextmanager
+def manual_dates(*fields):
+    """Отключает auto_now/auto_now_add, чтобы записать свои даты."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def refuse_sharded():
+    """CommandError, если посты разложены по шардам."""
+    if sharding.enabled():
+        raise CommandError(
+            'Включено шардирование (YATUBE_SHARDS): команда работает '
+            'только с базой default.'
+        )
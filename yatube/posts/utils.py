@@ -1,10 +1,265 @@
-from django.core.paginator import Paginator
+import base64
+import datetime
+import heapq
+import json
+import math
+from itertools import islice
 
-from yatube.settings import NUM_POSTS
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db.models import Q, prefetch_related_objects
+from django.utils.functional import cached_property
 
+from yatube.settings import NUM_COMMENTS, NUM_POSTS
 
-def get_page_context(queryset, request):
-    paginator = Paginator(queryset, NUM_POSTS)
+from . import sharding
+
+CURSOR_ORDERING = ('-pub_date', '-id')
+# Диапазон INTEGER в SQLite: большее число не привязать к запросу.
+INTEGER_RANGE = range(-2 ** 63, 2 ** 63)
+COMMENT_ORDERING = ('-created', '-id')
+
+
+def _cursor_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values, number):
+    """Упаковывает значения ключа и номер страницы в непрозрачный токен."""
+    payload = json.dumps([list(values), number], default=_cursor_default)
+    token = base64.urlsafe_b64encode(payload.encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен, созданный encode_cursor."""
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        values, number = json.loads(base64.urlsafe_b64decode(padded))
+        number = int(number)
+    except (ValueError, TypeError, OverflowError):
+        raise InvalidPage('Некорректный курсор')
+    return values, max(number, 1)
+
+
+def keyset_filter(ordering, values, forward=True):
+    """Условие "после/до записи со значениями values" для сортировки."""
+    fields = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for index, field in enumerate(ordering):
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == forward else 'gt'
+        step = Q(**{f'{fields[index]}__{lookup}': values[index]})
+        for name, value in zip(fields[:index], values[:index]):
+            step &= Q(**{name: value})
+        condition |= step
+    return condition
+
+
+def _bindable(value):
+    """Можно ли передать value параметром запроса к SQLite."""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, int):
+        return value in INTEGER_RANGE
+    return True
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу сортировки вместо OFFSET.
+
+    Страница выбирается условием по последней (или первой) записи
+    соседней страницы, поэтому глубокие страницы стоят столько же,
+    сколько первая, а COUNT(*) не выполняется вовсе.
+    """
+    is_cursor = True
+    supports_offset = True
+
+    def __init__(self, object_list, per_page, ordering=CURSOR_ORDERING,
+                 after=None, before=None):
+        super().__init__(object_list, per_page)
+        self.ordering = tuple(ordering)
+        self.after = after
+        self.before = before
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._number = 1
+
+    @property
+    def fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def validate_number(self, number):
+        return number
+
+    @cached_property
+    def num_pages(self):
+        if self.next_cursor:
+            return self._number + 1
+        return self._number
+
+    def _parse(self, token):
+        values, number = decode_cursor(token)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidPage('Некорректный курсор')
+        opts = self.object_list.model._meta
+        parsed = []
+        for name, value in zip(self.fields, values):
+            # В ключе только скаляры: None, списки и словари из подделанного
+            # токена не годятся как значения фильтра.
+            if isinstance(value, bool) or not isinstance(
+                    value, (str, int, float)):
+                raise InvalidPage('Некорректный курсор')
+            try:
+                value = opts.get_field(name).to_python(value)
+            except FieldDoesNotExist:
+                # Аннотация (например, оценка поиска) сравнивается как есть.
+                if not isinstance(value, (int, float)):
+                    raise InvalidPage('Некорректный курсор')
+            except (ValidationError, TypeError, ValueError, OverflowError):
+                raise InvalidPage('Некорректный курсор')
+            if value is None or not _bindable(value):
+                raise InvalidPage('Некорректный курсор')
+            parsed.append(value)
+        return parsed, number
+
+    def _values(self, obj):
+        return [getattr(obj, name) for name in self.fields]
+
+    def window(self, queryset, values, backwards):
+        """Записи queryset за курсором в порядке обхода."""
+        queryset = queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(
+                keyset_filter(self.ordering, values, not backwards)
+            )
+        if backwards:
+            queryset = queryset.reverse()
+        return queryset
+
+    def fetch(self, values, backwards, limit):
+        """Возвращает до limit записей за курсором в порядке обхода."""
+        return list(self.window(self.object_list, values, backwards)[:limit])
+
+    def page(self, number=None):
+        backwards = bool(self.before)
+        token = self.before or self.after
+        values, number = None, 1
+        if token:
+            values, number = self._parse(token)
+        rows = self.fetch(values, backwards, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            if not has_more:
+                number = 1
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(token)
+        if not rows:
+            has_next = False
+        self._number = number
+        if has_next:
+            self.next_cursor = encode_cursor(
+                self._values(rows[-1]), number + 1)
+        if has_previous and rows and number > 1:
+            self.previous_cursor = encode_cursor(
+                self._values(rows[0]), number - 1)
+        return Page(rows, number, self)
+
+    def get_page(self, number=None):
+        try:
+            return self.page()
+        except InvalidPage:
+            self.after = self.before = None
+            return self.page()
+
+
+class ShardedPaginator(CursorPaginator):
+    """Курсорный пагинатор, сливающий выборки шардов кучей.
+
+    С каждого шарда берётся до limit записей за курсором, heapq.merge
+    по ключу сортировки оставляет первые limit из них. Связи из
+    select_related подгружаются после слияния запросом на связь:
+    JOIN с таблицами default на шарде невозможен.
+    """
+    supports_offset = False
+
+    def __init__(self, object_list, per_page, shards=(), **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.shards = list(shards)
+
+    def fetch(self, values, backwards, limit):
+        related = self.object_list.query.select_related
+        streams = [
+            self.window(
+                self.object_list.using(alias).select_related(None),
+                values, backwards,
+            )[:limit]
+            for alias in self.shards
+        ]
+        descending = self.ordering[0].startswith('-')
+        rows = list(islice(heapq.merge(
+            *streams,
+            key=self._values,
+            reverse=descending != backwards,
+        ), limit))
+        if isinstance(related, dict):
+            prefetch_related_objects(rows, *related)
+        return rows
+
+
+def get_page_context(queryset, request, ordering=CURSOR_ORDERING,
+                     paginator_class=CursorPaginator, **kwargs):
+    """Возвращает страницу ленты.
+
+    По умолчанию используется пагинация по курсору (?after=/?before=),
+    старый параметр ?page=N обслуживается обычным Paginator,
+    если включён settings.LEGACY_PAGINATION и лента это допускает.
+    """
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return page_obj
+    if (page_number is not None and settings.LEGACY_PAGINATION
+            and paginator_class.supports_offset):
+        paginator = Paginator(queryset, NUM_POSTS)
+        return paginator.get_page(page_number)
+    paginator = paginator_class(
+        queryset,
+        NUM_POSTS,
+        ordering=ordering,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        **kwargs
+    )
+    return paginator.get_page()
+
+
+def get_post_page(queryset, request, author_ids=None,
+                  ordering=CURSOR_ORDERING):
+    """Страница ленты постов, при шардировании - слиянием шардов.
+
+    author_ids сужает опрос до шардов этих авторов.
+    """
+    if not sharding.enabled():
+        return get_page_context(queryset, request, ordering=ordering)
+    return get_page_context(
+        queryset,
+        request,
+        ordering=ordering,
+        paginator_class=ShardedPaginator,
+        shards=sharding.shards_for(author_ids),
+    )
+
+
+def get_comments_page(post, after=None):
+    """Страница комментариев поста, от новых к старым."""
+    paginator = CursorPaginator(
+        sharding.with_related(post.comments, 'author'),
+        NUM_COMMENTS,
+        ordering=COMMENT_ORDERING,
+        after=after,
+    )
+    return paginator.get_page()
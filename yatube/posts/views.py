@@ -1,58 +1,140 @@
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
-
+from django.urls import reverse
+
+from .caching import (GLOBAL_SCOPE, author_scope, depends_on, group_scope,
+                      post_scope, public_page)
+from .conditional import (conditional_page, group_validators,
+                          post_validators, profile_validators)
+from .counters import stats_for
+from .feed import get_follow_page
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
-from .utils import get_page_context
+from .search import SEARCH_ORDERING, search_posts
+from .thumbnails import prefetch_thumbnails
+from .utils import get_comments_page, get_post_page
+
 
+def get_post_or_404(post_id):
+    post = Post.shards.find(post_id)
+    if post is None:
+        raise Http404('Пост не найден.')
+    return post
 
-@cache_page(20, key_prefix='index_page')
+
+@public_page('index_page', lambda: [GLOBAL_SCOPE])
 def index(request):
     """Выводит шаблон главной страницы"""
     posts = Post.objects.select_related('group', 'author').all()
     context = {
-        'page_obj': get_page_context(posts, request)
+        'page_obj': get_post_page(posts, request)
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(group_validators)
+@public_page('group_page', lambda slug: [group_scope(slug)])
 def group_posts(request, slug):
     """Выводит шаблон с группами постов"""
     group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.select_related('author').all()
+    posts = group.posts.select_related('author')
     context = {
         'group': group,
-        'page_obj': get_page_context(posts, request)
+        'page_obj': get_post_page(posts, request)
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(profile_validators)
+@public_page('profile_page', lambda username: [author_scope(username)])
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    following = request.user.is_authenticated and author.following.exists()
-    page_obj = get_page_context(author.posts.select_related('group'), request)
+    page_obj = get_post_page(
+        author.posts.select_related('group'), request, [author.pk]
+    )
     context = {
         'page_obj': page_obj,
         'author': author,
-        'following': following
+        'author_stats': stats_for(author),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@public_page('search_page', lambda: [GLOBAL_SCOPE])
+def search(request):
+    """Выводит посты, найденные по запросу ?q="""
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        posts = search_posts(query).select_related('group', 'author')
+        page_obj = get_post_page(
+            posts.order_by(*SEARCH_ORDERING),
+            request,
+            ordering=SEARCH_ORDERING
+        )
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@conditional_page(post_validators)
+@public_page('post_page', lambda post_id: [post_scope(post_id)])
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    form = CommentForm()
-    comments = post.comments.all()
+    post = get_post_or_404(post_id)
+    # Число постов автора в карточке.
+    depends_on(request, author_scope(post.author.username))
+    prefetch_thumbnails([post])
+    comments = get_comments_page(post)
     context = {
         'post': post,
+        'author_stats': stats_for(post.author),
         'comments': comments,
-        'form': form,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    """Следующая страница комментариев для кнопки "Показать ещё".
+
+    Отдаёт HTML-фрагмент или JSON, если он запрошен ?format=json
+    или заголовком Accept.
+    """
+    post = get_post_or_404(post_id)
+    comments = get_comments_page(post, request.GET.get('after'))
+    wants_json = (
+        request.GET.get('format') == 'json'
+        or 'application/json' in request.META.get('HTTP_ACCEPT', '')
+    )
+    if not wants_json:
+        context = {'post': post, 'comments': comments}
+        return render(request, 'includes/comment_list.html', context)
+    next_cursor = comments.paginator.next_cursor
+    next_url = None
+    if next_cursor:
+        next_url = (
+            f"{reverse('posts:post_comments', args=[post.id])}"
+            f"?format=json&after={next_cursor}"
+        )
+    return JsonResponse({
+        'comments': [
+            {
+                'id': comment.id,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in comments
+        ],
+        'next': next_url,
+    })
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -70,7 +152,7 @@ def post_create(request):
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_post_or_404(post_id)
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
 
@@ -91,8 +173,9 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_post_or_404(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -104,14 +187,14 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
     context = {
-        'page_obj': get_page_context(posts, request),
+        'page_obj': get_follow_page(request),
     }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     follow = Follow.objects.filter(
@@ -126,6 +209,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follow = Follow.objects.filter(
@@ -1,4 +1,8 @@
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -30,6 +34,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.replication.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,7 +51,8 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, считающий время отрисовки для core.middleware.
+        'BACKEND': 'core.middleware.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -66,10 +73,41 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.getenv(
+            'YATUBE_DB_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
     }
 }
 
+# Реплики только для чтения: пути к копиям базы через запятую. Копии
+# догоняют основную базу командой replicate (core.replication).
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.getenv(
+        'YATUBE_REPLICAS', '').split(','))):
+    DATABASE_REPLICAS.append(f'replica_{index}')
+    DATABASES[f'replica_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+# Шарды постов и комментариев: пути к файлам SQLite через запятую.
+# Посты автора и комментарии к ним лежат на шарде posts.sharding.shard_for,
+# остальные таблицы - в default.
+POST_SHARDS = []
+for index, path in enumerate(filter(None, os.getenv(
+        'YATUBE_SHARDS', '').split(','))):
+    POST_SHARDS.append(f'shard_{index}')
+    DATABASES[f'shard_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+    }
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'core.replication.PrimaryReplicaRouter',
+]
+# Сколько секунд после записи чтения клиента идут в основную базу.
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_COOKIE = 'primary_until'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -109,6 +147,49 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 NUM_POSTS = 10
+NUM_COMMENTS = 20
+
+# Обслуживать ли старые ссылки вида ?page=N через OFFSET-пагинацию.
+LEGACY_PAGINATION = True
+
+# Авторы с таким числом подписчиков не раскладываются в ленты подписок,
+# их посты подмешиваются при чтении.
+FEED_CELEBRITY_THRESHOLD = 1000
+# Сколько последних постов такого автора держать в кеше.
+FEED_RECENT_POSTS = 200
+
+# Страницы лент сбрасываются записью, поэтому их можно хранить долго.
+FEED_CACHE_TIMEOUT = 60 * 60
+# Сколько секунд после истечения страницу ещё можно отдать, пока один
+# запрос её пересобирает (stale-while-revalidate).
+FEED_CACHE_GRACE = 60
+# Время жизни блокировки пересборки и сколько секунд другие запросы
+# ждут её результата, если устаревшей копии нет.
+FEED_CACHE_LOCK_TIMEOUT = 10
+FEED_CACHE_LOCK_WAIT = 2
+# Страницы от этого размера хранятся в кеше сжатыми.
+PAGE_COMPRESS_MIN_BYTES = 1024
+
+# Ключ HTML карточки поста меняется вместе с постом.
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Размеры миниатюр картинок постов, которые готовятся заранее.
+POST_IMAGE_GEOMETRIES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+# Ширины и форматы вариантов картинки карточки для srcset;
+# последний формат - запасной для браузеров без поддержки остальных.
+POST_IMAGE_VARIANT_WIDTHS = (320, 480, 640, 768, 960)
+POST_IMAGE_VARIANT_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
+# Число процессов, нарезающих миниатюры; 0 - нарезать сразу в запросе.
+POST_IMAGE_WORKERS = 2
+
+# Движок поиска: 'fts' (SQLite FTS5), 'index' (своя таблица слов)
+# или 'auto' - FTS5, если таблица для него создана миграцией.
+SEARCH_BACKEND = 'auto'
+# Сколько очков релевантности даёт посту год свежести.
+SEARCH_RECENCY_WEIGHT = 1.0
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -122,10 +203,56 @@ SMALL_GIF = (
     b'\x0A\x00\x3B'
 )
 
+# Тесты получают свой файл кеша во временном каталоге; подпроцессы
+# (серверы бенчмарков) наследуют его через переменную окружения.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING and 'YATUBE_CACHE_PATH' not in os.environ:
+    _cache_dir = tempfile.mkdtemp(prefix='yatube-cache-')
+    atexit.register(shutil.rmtree, _cache_dir, True)
+    os.environ['YATUBE_CACHE_PATH'] = os.path.join(
+        _cache_dir, 'cache.sqlite3')
+
+# L1 в памяти каждого процесса, L2 - общий для процессов SQLite-файл
+# (core.cache).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': os.getenv(
+            'YATUBE_CACHE_PATH', os.path.join(BASE_DIR, 'cache.sqlite3')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': 256 * 1024 * 1024,
+            'L1_MAX_BYTES': 32 * 1024 * 1024,
+            'SYNC_INTERVAL': 0.1,
+        },
     }
 }
 
+# Доля запросов, для которых собираются метрики SQL, кеша и шаблонов
+# (заголовок Server-Timing и лог core.metrics); 0 - middleware отключён.
+REQUEST_METRICS_SAMPLE_RATE = float(
+    os.getenv('YATUBE_METRICS_SAMPLE_RATE', 0))
+# Пороги, выше которых метрики запроса пишутся предупреждением.
+REQUEST_METRICS_BUDGETS = {
+    'queries': 20,
+    'duplicates': 3,
+    'db_ms': 100,
+    'templates_ms': 200,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'